@@ -0,0 +1,80 @@
+"""
+Runs benchmark suites and prints their results.
+
+    python -m benchmarks codec runner --output results.json
+    python -m benchmarks end_to_end --broker rabbitmq --broker-host localhost --baseline results.json
+    python -m benchmarks end_to_end
+
+Results are saved as JSON document. If baseline results are specified,
+process exits with non zero code when any result is degraded beyond tolerance.
+"""
+import argparse
+import logging
+import sys
+
+from benchmarks import bench_codec, bench_dispatcher, bench_end_to_end, bench_runner
+from benchmarks.common import find_regressions, load_results, write_results
+from dcn.common.broker import Broker
+from dcn.common.memory_broker import MemoryBroker
+
+BROKERS = {
+    'rabbitmq': Broker,
+    'memory': MemoryBroker,
+}
+
+# Suites that do not depend on RabbitMQ are run by default,
+# dispatcher waits for RabbitMQ on start unless memory broker is used
+SUITES = {
+    bench_codec.SUITE: lambda args: bench_codec.run(),
+    bench_runner.SUITE: lambda args: bench_runner.run(),
+    bench_dispatcher.SUITE: lambda args: bench_dispatcher.run(broker_host=args.broker_host,
+                                                              broker_class=BROKERS[args.broker]),
+    bench_end_to_end.SUITE: lambda args: [
+        result
+        for batch_size in args.batch_sizes
+        for result in bench_end_to_end.run(args.tasks, args.broker_host, batch_size, BROKERS[args.broker])
+    ],
+}
+DEFAULT_SUITES = [bench_codec.SUITE, bench_runner.SUITE, bench_dispatcher.SUITE]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmarks', description='DCN performance benchmarks')
+    parser.add_argument('suites', nargs='*', choices=list(SUITES), default=DEFAULT_SUITES,
+                        help='suites to run')
+    parser.add_argument('--broker', choices=list(BROKERS), default='memory', help='broker backend')
+    parser.add_argument('--broker-host', default='localhost', help='broker host')
+    parser.add_argument('--tasks', type=int, default=bench_end_to_end.TASKS,
+                        help='number of end to end tasks')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100],
+                        help='client batch sizes of end to end tasks')
+    parser.add_argument('--output', help='path of JSON results document')
+    parser.add_argument('--baseline', help='path of JSON results document to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative degradation against baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Per task logging would dominate measured time
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('pika').setLevel(logging.CRITICAL)
+    results = []
+    for suite in args.suites:
+        suite_results = SUITES[suite](args)
+        for result in suite_results:
+            print(result)
+        results.extend(suite_results)
+    if args.output:
+        write_results(results, args.output)
+    if args.baseline:
+        regressions = find_regressions(results, load_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
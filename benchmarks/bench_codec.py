@@ -0,0 +1,38 @@
+from typing import List
+
+from benchmarks.common import LOWER, Result, measure, rate
+from dcn.common.codec import available_codecs, get_codec
+from dcn.common.data_structures import compose_queue, compose_task
+
+SUITE = 'codec'
+# Number of values in task arguments of representative payloads
+PAYLOAD_SIZES = {
+    'small': 10,
+    'medium': 1000,
+    'large': 100000,
+}
+# Total number of values processed per measurement, so large payloads take reasonable time
+VALUES_PER_MEASUREMENT = 2000000
+
+
+def compose_payload(size: int) -> dict:
+    arguments = {'values': [i * 0.5 for i in range(size)], 'name': 'benchmark'}
+    return compose_task(1, compose_queue('benchmark'), 'builtin', 'relay', arguments)
+
+
+def run() -> List[Result]:
+    """
+    Measures encoding and decoding rates and encoded size of task messages.
+    """
+    results = []
+    for payload_name, size in PAYLOAD_SIZES.items():
+        payload = compose_payload(size)
+        count = max(10, VALUES_PER_MEASUREMENT // size)
+        for codec_name in available_codecs():
+            codec = get_codec(codec_name)
+            data = codec.encode(payload)
+            name = f'{codec_name}.{payload_name}'
+            results.append(rate(SUITE, f'{name}.encode', count, measure(lambda: codec.encode(payload), count)))
+            results.append(rate(SUITE, f'{name}.decode', count, measure(lambda: codec.decode(data), count)))
+            results.append(Result(SUITE, f'{name}.size', len(data), 'bytes', LOWER))
+    return results
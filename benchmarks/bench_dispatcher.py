@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+from copy import deepcopy
+from threading import Thread
+from typing import List, Type
+
+from benchmarks.common import Result, measure, rate
+from dcn.common.broker import Broker, BrokerBase
+from dcn.common.connection import RequestConnection
+from dcn.common.database import Database, MemoryBackend
+from dcn.common.defaults import DISPATCHER_WORKERS
+from dcn.common.request_types import Client_queues, Pulse, Register_agent
+from dcn.dispatcher.dispatcher import Dispatcher
+
+SUITE = 'dispatcher'
+REQUESTS = 2000
+TOKEN = 'benchmark'
+LISTEN_TIMEOUT = 0.1
+# Router workers count that is compared with default dispatcher
+ROUTER_WORKERS = 4
+
+
+@contextmanager
+def running_dispatcher(broker_host: str = 'localhost',
+                       workers: int = DISPATCHER_WORKERS,
+                       broker_class: Type[BrokerBase] = Broker):
+    """
+    Starts dispatcher that listens in background thread on free port.
+    Benchmark token is bound to specified broker host.
+    """
+    params = {kind: {TOKEN: {'broker': broker_host}} for kind in ('agents', 'clients')}
+    with Dispatcher(broker_host=broker_host, workers=workers,
+                    database=Database(MemoryBackend(params)), broker_class=broker_class) as dispatcher:
+        listener = Thread(target=dispatcher.listen, args=[LISTEN_TIMEOUT], daemon=True)
+        listener.start()
+        try:
+            yield dispatcher
+        finally:
+            dispatcher._listen = False
+            listener.join()
+
+
+def run(requests: int = REQUESTS,
+        broker_host: str = 'localhost',
+        broker_class: Type[BrokerBase] = Broker) -> List[Result]:
+    """
+    Measures rate of sequential requests to dispatcher by request type.
+    Client queues are not assigned if broker is not reachable,
+    request handling is measured anyway.
+    """
+    results = []
+    for workers in (DISPATCHER_WORKERS, ROUTER_WORKERS):
+        with running_dispatcher(broker_host, workers, broker_class) as dispatcher, \
+                RequestConnection(port=dispatcher.socket.port) as connection:
+            connection.establish()
+            register = deepcopy(Register_agent)
+            register['token'] = TOKEN
+            pulse = deepcopy(Pulse)
+            pulse['id'] = connection.send(deepcopy(register))['id']
+            client_queues = deepcopy(Client_queues)
+            client_queues['name'] = 'benchmark'
+            client_queues['token'] = TOKEN
+            for name, request in (('register_agent', register),
+                                  ('pulse', pulse),
+                                  ('client_queues', client_queues)):
+                duration = measure(lambda: connection.send(deepcopy(request)), requests)
+                results.append(rate(SUITE, f'{name}.workers{workers}', requests, duration, 'requests/s'))
+    return results
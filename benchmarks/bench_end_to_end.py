@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import Future, wait
+from functools import partial
+from threading import Event, Thread
+from time import perf_counter
+from typing import List, Type
+
+from benchmarks.bench_dispatcher import TOKEN, running_dispatcher
+from benchmarks.common import Result, latency_results, rate
+from dcn.agent.agent import Agent
+from dcn.agent.pool import TaskPool
+from dcn.client.client import Client
+from dcn.common.broker import Broker, BrokerBase
+from dcn.common.constants import SECOND
+
+SUITE = 'end_to_end'
+TASKS = 5000
+AGENT_WORKERS = 1
+RESULT_TIMEOUT = 60 * SECOND
+INACTIVITY_TIMEOUT = 0.1 * SECOND
+
+
+def serve_tasks(agent: Agent, stop: Event):
+    # Called from agent thread, broker connection is used only by it
+    agent.broker.connect()
+    agent.broker._inactivity_timeout = INACTIVITY_TIMEOUT
+    with TaskPool(agent.broker, agent.workers) as pool:
+        while not stop.is_set():
+            for task in agent.broker.pulling_generator():
+                pool.submit(task)
+
+
+def run(tasks: int = TASKS,
+        broker_host: str = 'localhost',
+        batch_size: int = 1,
+        broker_class: Type[BrokerBase] = Broker) -> List[Result]:
+    """
+    Measures client submit rate, task throughput and latency from task
+    submission to its result on client through dispatcher, broker and agent.
+    """
+    name = f'batch{batch_size}'
+    stop = Event()
+    with running_dispatcher(broker_host, broker_class=broker_class) as dispatcher, \
+            Agent(token=TOKEN, dsp_port=dispatcher.socket.port, workers=AGENT_WORKERS,
+                  broker_class=broker_class) as agent, \
+            Client(name=f'benchmark-{os.getpid()}', token=TOKEN, dsp_port=dispatcher.socket.port,
+                   batch_size=batch_size, broker_class=broker_class) as client:
+        if not (agent.register() and agent.request_broker_data()):
+            raise ConnectionError('Agent is not registered on dispatcher')
+        if not (client.get_client_queues() and client.broker.connect()):
+            raise ConnectionError(f'Broker on {broker_host} is not reachable')
+        agent_thread = Thread(target=serve_tasks, args=[agent, stop], daemon=True)
+        agent_thread.start()
+        latencies = []
+        futures = []
+        completed = [0.0]
+
+        def on_done(submitted: float, _: Future):
+            completed[0] = perf_counter()
+            latencies.append(completed[0] - submitted)
+
+        started = perf_counter()
+        for i in range(tasks):
+            submitted = perf_counter()
+            future = client.submit('builtin', 'relay', {'value': i})
+            future.add_done_callback(partial(on_done, submitted))
+            futures.append(future)
+        submit_duration = perf_counter() - started
+        _, pending = wait(futures, RESULT_TIMEOUT)
+        stop.set()
+        agent_thread.join()
+        if pending:
+            raise TimeoutError(f'{len(pending)} of {tasks} tasks are not completed')
+    return [
+        rate(SUITE, f'{name}.submit', tasks, submit_duration, 'tasks/s'),
+        rate(SUITE, f'{name}.throughput', tasks, completed[0] - started, 'tasks/s'),
+        *latency_results(SUITE, f'{name}.latency', latencies),
+    ]
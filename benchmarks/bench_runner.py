@@ -0,0 +1,26 @@
+from typing import List
+
+from benchmarks.common import Result, measure, rate
+from dcn.agent.pool import execute_task
+from dcn.common.data_structures import compose_batch, compose_queue, compose_task
+
+SUITE = 'runner'
+TASKS = 20000
+BATCH_SIZE = 100
+
+
+def run(tasks: int = TASKS) -> List[Result]:
+    """
+    Measures agent task execution rate without broker: tasks one by one,
+    batched tasks and batched tasks of vectorized function.
+    """
+    client = compose_queue('benchmark')
+    task = compose_task(1, client, 'builtin', 'relay', {'value': 1})
+    results = [rate(SUITE, 'relay.single', tasks, measure(lambda: execute_task(task), tasks), 'tasks/s')]
+    batches = max(1, tasks // BATCH_SIZE)
+    for function in ('relay', 'relay_vectorized'):
+        batch = compose_batch(1, client, [compose_task(i, client, 'builtin', function, {'value': i})
+                                          for i in range(BATCH_SIZE)])
+        duration = measure(lambda: execute_task(batch), batches)
+        results.append(rate(SUITE, f'{function}.batch{BATCH_SIZE}', batches * BATCH_SIZE, duration, 'tasks/s'))
+    return results
@@ -0,0 +1,119 @@
+import json
+import math
+import platform
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Union
+
+HIGHER = 'higher'
+LOWER = 'lower'
+
+
+class Result:
+    """
+    Single benchmark measurement. Results are identified by suite and name,
+    so runs with the same parameters are comparable.
+    """
+    __slots__ = ('suite', 'name', 'value', 'unit', 'better')
+
+    def __init__(self, suite: str, name: str, value: float, unit: str, better: str = HIGHER):
+        self.suite = suite
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.better = better
+
+    @property
+    def key(self) -> str:
+        return f'{self.suite}::{self.name}'
+
+    def as_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Result':
+        return cls(**data)
+
+    def __str__(self):
+        return f'{self.key:60} {self.value:>14.6g} {self.unit}'
+
+
+def rate(suite: str, name: str, count: int, duration: float, unit: str = 'ops/s') -> Result:
+    return Result(suite, name, count / duration if duration else math.inf, unit, HIGHER)
+
+
+def measure(function: Callable, count: int) -> float:
+    """
+    Calls function specified number of times.
+
+    :param function: function without arguments
+    :param count: number of calls
+    :return: total duration in seconds
+    """
+    started = perf_counter()
+    for _ in range(count):
+        function()
+    return perf_counter() - started
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Returns value below which specified percent of values fall,
+    nearest rank method is used.
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_results(suite: str, name: str, latencies: List[float]) -> List[Result]:
+    return [
+        Result(suite, f'{name}.p50', percentile(latencies, 50), 's', LOWER),
+        Result(suite, f'{name}.p99', percentile(latencies, 99), 's', LOWER),
+    ]
+
+
+def write_results(results: Iterable[Result], path: Union[str, Path]):
+    """
+    Saves results with run environment description as JSON document.
+    """
+    document = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': [result.as_dict() for result in results]
+    }
+    Path(path).write_text(json.dumps(document, indent=2))
+
+
+def load_results(path: Union[str, Path]) -> Dict[str, Result]:
+    document = json.loads(Path(path).read_text())
+    results = (Result.from_dict(data) for data in document['results'])
+    return {result.key: result for result in results}
+
+
+def find_regressions(results: Iterable[Result],
+                     baseline: Dict[str, Result],
+                     tolerance: float) -> List[str]:
+    """
+    Compares results with baseline ones of the same key.
+
+    :param results: current results
+    :param baseline: baseline results by key
+    :param tolerance: allowed relative degradation, 0.1 is 10%
+    :return: descriptions of degraded results
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.key)
+        if reference is None or not reference.value:
+            continue
+        change = (result.value - reference.value) / reference.value
+        if result.better == LOWER:
+            change = -change
+        if change < -tolerance:
+            regressions.append(f'{result.key}: {reference.value:.6g} -> {result.value:.6g} {result.unit}')
+    return regressions
@@ -1 +1,4 @@
 from .agent import Agent, RemoteAgent, TaskRunner
+from .pool import TaskPool
+from .async_agent import AsyncAgent
+from .runtime import AgentRuntime
@@ -6,46 +6,95 @@ import traceback
 
 from copy import deepcopy
 from datetime import datetime
-from importlib import import_module
-
-from dcn.common.broker import Broker
+from threading import Lock
+from time import monotonic
+from types import GeneratorType
+from typing import Callable, Generator, Iterable, List, Optional, Type
+
+from dcn.agent.loader import loader
+from dcn.agent.modules import BATCH_ATTRIBUTE, CACHEABLE_ATTRIBUTE
+from dcn.common.blob_store import BlobStore
+from dcn.common.broker import Broker, BrokerBase, connection_pool
+from dcn.common.codec import available_codecs
 from dcn.common.connection import RequestConnection
 from dcn.common.constants import AGENT, QUEUE
-from dcn.common.data_structures import task_report
+from dcn.common.data_structures import compose_chunk, compose_report
+from dcn.common.defaults import AGENT_EXECUTOR, AGENT_WORKERS, PREFETCH_COUNT
+from dcn.common.metrics import metrics
 from dcn.common.request_types import Agent_queues, Disconnect, Register_agent, Pulse
+from dcn.common.result_cache import ResultCache, task_key
 
 logger = logging.getLogger(AGENT)
 
+STAGE_SECONDS = metrics.histogram('dcn_task_stage_seconds', 'Duration of task processing stages', ('stage',))
+RESULT_CACHE = metrics.counter('dcn_task_result_cache_total', 'Result cache lookups', ('outcome',))
+
 parent_path = pathlib.Path(__file__).parent.absolute()
 sys.path.append(f'{parent_path}/modules')
 
 
 class AgentBase:
+    __slots__ = ('id', 'name', 'commands', 'token', 'tags', 'last_sync')
+
     def __init__(self):
         self.id = 0
         self.name = ''
         self.commands = []
         self.token = ''
+        self.tags = []
         self.last_sync = datetime.utcnow()
 
     @abc.abstractmethod
     def sync(self, reply: dict):
         ...
 
+    def is_target(self, message: dict) -> bool:
+        """
+        Checks whether agent matches all targets of commands message.
+
+        :param message: message with optional agent ids, token and tags
+        :return: True if commands are addressed to the agent
+        """
+        return ((not message.get('agents') or self.id in message['agents'])
+                and (not message.get('token') or self.token == message['token'])
+                and set(message.get('tags') or ()).issubset(self.tags))
+
     def __str__(self):
         return f'Agent: {self.name}({self.id})'
 
 
 class Agent(AgentBase):
+    connection_class = RequestConnection
+    broker_class = Broker
+
     def __init__(self,
                  token: str,
                  dsp_host: str = 'localhost',
-                 dsp_port: int = 9999):
+                 dsp_port: int = 9999,
+                 workers: int = AGENT_WORKERS,
+                 executor: str = AGENT_EXECUTOR,
+                 blob_store: BlobStore = None,
+                 broker_class: Type[BrokerBase] = None,
+                 tags: Iterable[str] = (),
+                 result_cache: ResultCache = None):
         logger.info('Starting Agent')
         super(Agent, self).__init__()
-        self.socket = RequestConnection(dsp_host, dsp_port)
+        if broker_class is not None:
+            self.broker_class = broker_class
+        self.socket = self.connection_class(dsp_host, dsp_port)
+        # Requests socket is shared by pulse and task consuming threads
+        self._socket_lock = Lock()
         self.broker = None
         self.token = token
+        self.workers = workers
+        self.executor = executor
+        self.blob_store = blob_store
+        self.result_cache = result_cache
+        self.tags = list(tags)
+        # Broker host of control exchange, epoch and version of the last applied broadcast
+        self.control_host = ''
+        self.command_epoch = ''
+        self.command_version = 0
 
     def __enter__(self):
         self.socket.establish()
@@ -59,12 +108,22 @@ class Agent(AgentBase):
             self.broker.close()
         self.socket.close()
 
+    def _send(self, request: dict) -> dict:
+        with self._socket_lock:
+            return self.socket.send(request)
+
     def register(self):
+        return self._register_reply(self._send(self._register_request()))
+
+    def _register_request(self) -> dict:
         request = deepcopy(Register_agent)
         if self.name:
             request['name'] = self.name
         request['token'] = self.token
-        reply = self.socket.send(request)
+        request['tags'] = self.tags
+        return request
+
+    def _register_reply(self, reply: dict) -> bool:
         if reply['result']:
             self.id = reply['id']
             self.sync(reply)
@@ -74,24 +133,42 @@ class Agent(AgentBase):
         """
         Request Agent queues on Broker from Dispatcher.
         """
+        return self._broker_data_reply(self._send(self._broker_data_request()))
+
+    def _broker_data_request(self) -> dict:
         request = deepcopy(Agent_queues)
         request['token'] = self.token
         request['id'] = self.id
-        reply = self.socket.send(request)
+        request['codecs'] = available_codecs()
+        return request
+
+    def _broker_data_reply(self, reply: dict) -> bool:
         if reply['result']:
             self.sync(reply)
             host = reply['broker']['host']
             queue = reply['broker']['queue']
-            self.broker = Broker(queue=queue, host=host)
+            # Prefetch window is matched to the number of concurrently executed tasks
+            prefetch_count = self.workers if self.workers > 1 else PREFETCH_COUNT
+            self.broker = self.broker_class(queue=queue, host=host, codec=reply['broker']['codec'],
+                                            prefetch_count=prefetch_count,
+                                            max_priority=reply['broker'].get('max_priority', 0),
+                                            queue_weights=reply['broker'].get('queues') or None,
+                                            pool=connection_pool)
+            self.control_host = reply['broker'].get('control', '')
             # self.broker.output_queue = reply['broker']['result']
             return True
         else:
             return False
 
     def pulse(self) -> bool:
+        return self._pulse_reply(self._send(self._pulse_request()))
+
+    def _pulse_request(self) -> dict:
         request = deepcopy(Pulse)
         request['id'] = self.id
-        reply = self.socket.send(request)
+        return request
+
+    def _pulse_reply(self, reply: dict) -> bool:
         self.sync(reply['reply'])
         return reply['result']
 
@@ -100,8 +177,8 @@ class Agent(AgentBase):
         if 'commands' in reply:
             self.commands = reply['commands']
 
-    def apply_commands(self):
-        for command in self.commands:
+    def apply_commands(self, commands: List[str] = None):
+        for command in self.commands if commands is None else commands:
             _method = getattr(self, command)
             if not _method():
                 logger.error(f'Method "{_method}" has failed to apply')
@@ -109,10 +186,43 @@ class Agent(AgentBase):
         else:
             return True
 
+    def receive_control(self, message: dict) -> List[str]:
+        """
+        Selects commands of broadcast received from control exchange.
+        Broadcast is accepted once, so redelivered one is ignored.
+        Versions start over with new epoch once dispatcher state is lost.
+
+        :param message: broadcast message
+        :return: commands that should be applied by agent
+        """
+        epoch = message.get('epoch', '')
+        if epoch != self.command_epoch:
+            self.command_epoch = epoch
+            self.command_version = 0
+        if message['version'] <= self.command_version:
+            return []
+        self.command_version = message['version']
+        return list(message['commands']) if self.is_target(message) else []
+
+    def rebalance(self) -> bool:
+        """
+        Drops current broker connection and requests agent queues again,
+        since dispatcher may have assigned other task queue shard.
+        """
+        if self.broker:
+            self.broker.close()
+            self.broker = None
+        return self.request_broker_data()
+
     def disconnect(self):
+        return self._disconnect_reply(self._send(self._disconnect_request()))
+
+    def _disconnect_request(self) -> dict:
         request = deepcopy(Disconnect)
         request['id'] = self.id
-        reply = self.socket.send(request)
+        return request
+
+    def _disconnect_reply(self, reply: dict) -> bool:
         if reply['result']:
             self.broker.close()
             self.broker = None
@@ -125,6 +235,9 @@ class Agent(AgentBase):
 
 
 class RemoteAgent(AgentBase):
+    # Dispatcher keeps an instance per registered agent
+    __slots__ = ()
+
     def __init__(self,
                  id_: int = 0):
         super(RemoteAgent, self).__init__()
@@ -133,17 +246,23 @@ class RemoteAgent(AgentBase):
     def sync(self, request: dict):
         self.last_sync = datetime.utcnow()
         if self.commands:
-            request['reply']['commands'] = self.commands
+            # Commands are delivered once
+            request['reply']['commands'], self.commands = self.commands, []
         request['result'] = True
         return request
 
 
 class TaskRunner:
-    def __init__(self, task: dict):
+    def __init__(self, task: dict, blob_store: BlobStore = None, result_cache: ResultCache = None):
         self.task = task
-        self.report = deepcopy(task_report)
+        self.report = compose_report()
+        self.blob_store = blob_store
+        self.result_cache = result_cache
+        self.stream = None
         self._module = None
         self._function = None
+        self._cache_key = None
+        self._cache_checked = False
         self.flow = [self.validate_task_parameters, self.get_module, self.get_function, self.execution]
 
     def update_status(self, status: bool, resolution: str):
@@ -163,18 +282,22 @@ class TaskRunner:
             self.update_status(False,
                                f'Mandatory task components are missing')
             return False
-        logger.info(
-            f"Task ({self.task['id']}) is received from "
-            f"{self.task['client']}: {self.task['module']}::{self.task['function']}"
-        )
+        logger.debug('Task (%s) is received from %s: %s::%s',
+                     self.task['id'], self.task['client'], self.task['module'], self.task['function'])
         self.report['id'] = self.task['id']
         self.report['client'] = self.task['client']
+        if self.blob_store:
+            try:
+                self.blob_store.resolve(self.task, 'arguments')
+            except OSError:
+                self.update_status(False, f'Task arguments are not loaded:\n{traceback.format_exc()}')
+                return False
         return True
 
     def get_module(self) -> bool:
         module_name = self.task['module']
         try:
-            self._module = import_module(module_name)
+            self._module = loader.get_module(module_name)
             return True
         except ModuleNotFoundError:
             self.update_status(False, f'Module {module_name} is not found')
@@ -183,34 +306,130 @@ class TaskRunner:
     def get_function(self) -> bool:
         function_name = self.task['function']
         try:
-            self._function = getattr(self._module, function_name)
+            self._function = loader.get_function(self.task['module'], function_name)
             return True
         except AttributeError:
-            logger.error(f'Module {self._module} does not contain '
-                         f'function {function_name}')
+            self.update_status(False, f'Module {self._module} does not contain '
+                                      f'function {function_name}')
             return False
 
+    @property
+    def batch_function(self) -> Optional[Callable]:
+        """
+        Batch variant of resolved task function if it is vectorized.
+        """
+        return getattr(self._function, BATCH_ATTRIBUTE, None)
+
+    @property
+    def cacheable(self) -> bool:
+        """
+        Task result could be cached if task function is declared pure
+        or task is marked as cacheable.
+        """
+        return bool(self.task.get('cacheable') or getattr(self._function, CACHEABLE_ATTRIBUTE, False))
+
+    def lookup_result(self) -> bool:
+        """
+        Completes task with cached result of the same call.
+
+        :return: True if result is found in cache
+        """
+        # Cache is checked once, batch runner checks it before execution
+        if self._cache_checked or self.result_cache is None or not self.cacheable:
+            return False
+        self._cache_checked = True
+        self._cache_key = task_key(self.task['module'], self.task['function'], self.task['arguments'])
+        if self._cache_key is None:
+            return False
+        found, result = self.result_cache.get(self._cache_key)
+        if metrics.enabled:
+            RESULT_CACHE.inc('hit' if found else 'miss')
+        if found:
+            logger.debug('Cached result is used for task (%s)', self.task['id'])
+            self.report['result'] = result
+            self.update_status(True, '')
+        return found
+
+    def set_result(self, result):
+        self.report['result'] = result
+        self.update_status(True, '')
+        if self._cache_key is not None:
+            self.result_cache.set(self._cache_key, result)
+
     def execution(self) -> bool:
+        if self.lookup_result():
+            return True
         try:
-            if self.task['arguments']:
-                self.report['result'] = \
-                    self._function(self.task['arguments'])
+            # Vectorized function gets the same arguments as in batch call
+            if self.task['arguments'] or self.batch_function is not None:
+                result = self._function(self.task['arguments'])
             else:
-                self.report['result'] = \
-                    self._function()
-            self.update_status(True, '')
+                result = self._function()
+            if isinstance(result, GeneratorType):
+                # Generator is consumed while result messages are produced
+                self.stream = result
+                self.report['result'] = None
+                self.update_status(True, '')
+            else:
+                self.set_result(result)
             return True
         except Exception as e:
             self.update_status(False, traceback.format_exc())
             return False
 
+    def prepare(self) -> bool:
+        """
+        Runs stages that precede task function execution, so task could be
+        executed along with others by batch function.
+
+        :return: preparation status
+        """
+        return self._run_stages(self.flow[:-1])
+
     def run(self):
-        for stage in self.flow:
-            logger.debug(f'Starting {stage}')
-            if stage():
-                logger.debug(f'Complete {stage}')
-            else:
-                return False
-        else:
-            logger.info('Command execution is completed')
+        if self._run_stages(self.flow):
+            logger.debug('Command execution is completed')
             return True
+        return False
+
+    def _run_stages(self, stages: list) -> bool:
+        timed = metrics.enabled
+        # Level is checked once per task instead of twice per stage
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for stage in stages:
+            if debug:
+                logger.debug('Starting %s', stage.__name__)
+            started = monotonic() if timed else 0
+            completed = stage()
+            if timed:
+                STAGE_SECONDS.observe(monotonic() - started, stage.__name__)
+            if not completed:
+                return False
+            if debug:
+                logger.debug('Complete %s', stage.__name__)
+        return True
+
+    def messages(self) -> Generator[dict, None, None]:
+        """
+        Produces messages with task results for the task client.
+        Streamed result is split to chunk messages that are followed by
+        the last chunk with execution status.
+
+        :return: generator of messages
+        """
+        if self.stream is None:
+            yield self._spill(self.report)
+            return
+        sequence = 0
+        try:
+            for result in self.stream:
+                yield self._spill(compose_chunk(self.report, sequence, result))
+                sequence += 1
+        except Exception:
+            self.update_status(False, traceback.format_exc())
+        yield compose_chunk(self.report, sequence, None, last=True)
+
+    def _spill(self, message: dict) -> dict:
+        if self.blob_store:
+            self.blob_store.spill(message)
+        return message
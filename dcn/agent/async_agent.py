@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Union
+
+from dcn.agent.agent import Agent
+from dcn.agent.pool import EXECUTORS, execute_task
+from dcn.common.async_broker import AsyncBroker
+from dcn.common.connection import AsyncRequestConnection
+from dcn.common.constants import AGENT
+from dcn.common.defaults import PULSE_PERIOD, RECONNECT_DELAY
+
+logger = logging.getLogger(AGENT)
+
+
+class AsyncAgent(Agent):
+    """
+    Agent for asyncio applications. Tasks are executed on workers pool,
+    while event loop receives tasks, publishes results and sends pulses.
+    """
+    connection_class = AsyncRequestConnection
+    broker_class = AsyncBroker
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncAgent, self).__init__(*args, **kwargs)
+        self._executor: Union[Executor, None] = None
+        self._tasks = set()
+        self._running = False
+
+    async def __aenter__(self):
+        self.socket.establish()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.stop()
+        await self.drain()
+        self.close()
+
+    def close(self):
+        super(AsyncAgent, self).close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def register(self) -> bool:
+        return self._register_reply(await self.socket.send(self._register_request()))
+
+    async def request_broker_data(self) -> bool:
+        """
+        Request Agent queues on Broker from Dispatcher.
+        """
+        return self._broker_data_reply(await self.socket.send(self._broker_data_request()))
+
+    async def pulse(self) -> bool:
+        return self._pulse_reply(await self.socket.send(self._pulse_request()))
+
+    async def rebalance(self) -> bool:
+        if self.broker:
+            self.broker.close()
+            self.broker = None
+        return await self.request_broker_data()
+
+    async def disconnect(self) -> bool:
+        return self._disconnect_reply(await self.socket.send(self._disconnect_request()))
+
+    async def run(self, pulse_period: Union[int, float] = PULSE_PERIOD):
+        """
+        Registers on Dispatcher and processes tasks until stopped.
+
+        :param pulse_period: delay between pulse requests
+        """
+        self._running = True
+        while self._running and not await self.register():
+            await asyncio.sleep(RECONNECT_DELAY)
+        while self._running and not await self.request_broker_data():
+            await asyncio.sleep(RECONNECT_DELAY)
+        pulse = asyncio.ensure_future(self._pulse_loop(pulse_period))
+        try:
+            while self._running:
+                if not self.broker.connected and not await self.broker.connect():
+                    await asyncio.sleep(self.broker.backoff.remaining)
+                    continue
+                async for task in self.broker.pulling_generator():
+                    self.submit(task)
+                    if not self._running:
+                        break
+        finally:
+            pulse.cancel()
+
+    def stop(self):
+        self._running = False
+        if self.broker:
+            self.broker.stop_consuming()
+
+    async def _pulse_loop(self, period: Union[int, float]):
+        while self._running:
+            await asyncio.sleep(period)
+            await self.pulse()
+
+    def submit(self, task: dict):
+        """
+        Starts task execution on workers pool.
+
+        :param task: task received from broker pulling generator
+        """
+        if self._executor is None:
+            self._executor = EXECUTORS[self.executor](max_workers=self.workers)
+        processing = asyncio.ensure_future(self._process(task))
+        self._tasks.add(processing)
+        processing.add_done_callback(self._tasks.discard)
+
+    async def _process(self, task: dict):
+        loop = asyncio.get_running_loop()
+        try:
+            messages = await loop.run_in_executor(self._executor, execute_task, task,
+                                                  self.blob_store, self.result_cache)
+        except Exception:
+            logger.exception(f'Task processing has crashed: {task}')
+            self.broker.set_task_failed(task, requeue=False)
+            return
+        correlation_id = self.broker.correlation_id(task)
+        published = True
+        for message in messages:
+            published = await self.broker.push(message, message['client'], correlation_id) and published
+        # Task is acknowledged only after all its results are published
+        if published:
+            self.broker.set_task_done(task)
+        else:
+            self.broker.set_task_failed(task)
+
+    async def drain(self):
+        """
+        Waits for completion of tasks that are in progress.
+        """
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
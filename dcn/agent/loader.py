@@ -0,0 +1,93 @@
+import importlib
+import logging
+import sys
+from types import ModuleType
+from typing import Callable, Dict, Set, Tuple
+
+from dcn.common.constants import AGENT
+
+logger = logging.getLogger(AGENT)
+
+
+class FunctionLoader:
+    """
+    Process wide cache of modules and functions that are requested by tasks.
+    Modules that are not found are remembered as well, so tasks that
+    refer to them fail without import system lookup.
+    """
+    def __init__(self):
+        self._modules: Dict[str, ModuleType] = {}
+        self._functions: Dict[Tuple[str, str], Callable] = {}
+        self.missing_modules: Set[str] = set()
+
+    def get_module(self, module_name: str) -> ModuleType:
+        """
+        Returns imported module.
+
+        :param module_name: module name
+        :return: module
+        :raises ModuleNotFoundError: module is not found now or earlier
+        """
+        module = self._modules.get(module_name)
+        if module is not None:
+            return module
+        if module_name in self.missing_modules:
+            raise ModuleNotFoundError(f'Module {module_name} is not found', name=module_name)
+        try:
+            module = importlib.import_module(module_name)
+        except ModuleNotFoundError as e:
+            # Module itself is missing, not one of its dependencies
+            if e.name and (module_name == e.name or module_name.startswith(f'{e.name}.')):
+                self.missing_modules.add(module_name)
+            raise
+        self._modules[module_name] = module
+        return module
+
+    def get_function(self, module_name: str, function_name: str) -> Callable:
+        """
+        Returns function from module.
+
+        :param module_name: module name
+        :param function_name: function name
+        :return: function
+        :raises ModuleNotFoundError: module is not found
+        :raises AttributeError: module does not contain function
+        """
+        key = (module_name, function_name)
+        function = self._functions.get(key)
+        if function is None:
+            function = getattr(self.get_module(module_name), function_name)
+            self._functions[key] = function
+        return function
+
+    def invalidate(self, module_name: str = ''):
+        """
+        Drops cached entries, so they are resolved again on next request.
+
+        :param module_name: module to drop, all modules if not specified
+        """
+        if not module_name:
+            self._modules.clear()
+            self._functions.clear()
+            self.missing_modules.clear()
+            return
+        self._modules.pop(module_name, None)
+        self.missing_modules.discard(module_name)
+        for key in [key for key in self._functions if key[0] == module_name]:
+            del self._functions[key]
+
+    def reload(self, module_name: str) -> ModuleType:
+        """
+        Reloads module code and drops its cached functions.
+
+        :param module_name: module name
+        :return: reloaded module
+        """
+        self.invalidate(module_name)
+        if module_name in sys.modules:
+            logger.info(f'Reloading module {module_name}')
+            importlib.reload(sys.modules[module_name])
+        return self.get_module(module_name)
+
+
+loader = FunctionLoader()
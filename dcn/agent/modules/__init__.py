@@ -0,0 +1,56 @@
+from functools import wraps
+from typing import Callable
+
+# Attribute of task function that refers to its batch variant
+BATCH_ATTRIBUTE = 'batch'
+# Attribute of pure task function, its results are cached by arguments
+CACHEABLE_ATTRIBUTE = 'cacheable'
+
+
+def split_results(results, count: int) -> list:
+    """
+    Splits result of batch function call to per task results.
+    Arrays are converted to lists, so results are encoded by any codec.
+
+    :param results: sequence or array with result per task
+    :param count: number of tasks
+    :return: list of results
+    """
+    if hasattr(results, 'tolist'):
+        results = results.tolist()
+    results = list(results)
+    if len(results) != count:
+        raise ValueError(f'Batch function returned {len(results)} results for {count} tasks')
+    return results
+
+
+def vectorized(batch_function: Callable) -> Callable:
+    """
+    Declares task function that processes arguments of many tasks at once.
+    Decorated function receives list of task arguments and returns sequence
+    or array with result per task. Agent calls it once for tasks of the
+    same batch, single task is executed as a batch of one. Arguments are
+    passed as they are in task, even if they are empty.
+
+    :param batch_function: function of arguments list
+    :return: task function
+    """
+    @wraps(batch_function)
+    def function(arguments=None):
+        return split_results(batch_function([arguments]), 1)[0]
+
+    setattr(function, BATCH_ATTRIBUTE, batch_function)
+    return function
+
+
+def cacheable(function: Callable) -> Callable:
+    """
+    Declares pure task function. Its result depends only on arguments,
+    so agent with result cache returns cached result of the same call
+    instead of execution. Streamed results are not cached.
+
+    :param function: task function
+    :return: the same function
+    """
+    setattr(function, CACHEABLE_ATTRIBUTE, True)
+    return function
@@ -1,2 +1,14 @@
+from dcn.agent.modules import vectorized
+
+
 def relay(arguments: dict) -> dict:
     return arguments
+
+
+@vectorized
+def relay_vectorized(arguments: list) -> list:
+    return arguments
+
+
+def stream(arguments: list):
+    yield from arguments
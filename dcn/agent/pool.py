@@ -0,0 +1,283 @@
+import logging
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from threading import BoundedSemaphore
+from time import monotonic
+from typing import Callable, Dict, Generator, List, Tuple, Union
+
+from dcn.agent.agent import STAGE_SECONDS, TaskRunner
+from dcn.agent.modules import split_results
+from dcn.common.blob_store import BlobStore
+from dcn.common.broker import BrokerBase
+from dcn.common.constants import AGENT, SECOND
+from dcn.common.data_structures import compose_batch_report, is_batch
+from dcn.common.defaults import AGENT_EXECUTOR
+from dcn.common.metrics import metrics
+from dcn.common.result_cache import ResultCache
+
+logger = logging.getLogger(AGENT)
+
+THREAD = 'thread'
+PROCESS = 'process'
+
+EXECUTORS = {
+    THREAD: ThreadPoolExecutor,
+    PROCESS: ProcessPoolExecutor
+}
+# Messages produced by worker threads that may wait for publishing
+STREAM_WINDOW_PER_WORKER = 4
+
+TASK_SECONDS = metrics.histogram('dcn_agent_task_seconds',
+                                 'Time from task delivery to publishing of its results')
+TASKS = metrics.counter('dcn_agent_tasks_total', 'Tasks processed by agent', ('outcome',))
+TASKS_IN_PROGRESS = metrics.gauge('dcn_agent_tasks_in_progress', 'Tasks executed by agent pool')
+
+
+def run_vectorized(runners: List[TaskRunner]):
+    """
+    Executes prepared tasks of the same vectorized function with a single
+    batch function call. Tasks are executed one by one if the call fails,
+    so failure is reported only for tasks that cause it.
+
+    :param runners: runners of prepared tasks
+    """
+    started = monotonic() if metrics.enabled else 0
+    try:
+        results = runners[0].batch_function([runner.task['arguments'] for runner in runners])
+        results = split_results(results, len(runners))
+    except Exception:
+        logger.exception(f'Batch call of {len(runners)} tasks has failed')
+        results = None
+    if started:
+        STAGE_SECONDS.observe(monotonic() - started, 'batch_execution')
+    if results is None:
+        for runner in runners:
+            runner.execution()
+        return
+    for runner, result in zip(runners, results):
+        runner.set_result(result)
+
+
+def run_batch(batch: dict, blob_store: BlobStore = None, result_cache: ResultCache = None) -> dict:
+    """
+    Runs tasks of the batch and collects their reports. Tasks of vectorized
+    functions are executed with one call per function, others one by one.
+    Streamed results are collected to lists, since batch is reported
+    with a single message.
+
+    :param batch: batch message
+    :param blob_store: storage for large payloads
+    :param result_cache: cache of pure task function results
+    :return: batch report
+    """
+    runners = [TaskRunner(task, blob_store, result_cache) for task in batch['batch']]
+    vectorized: Dict[Tuple[str, str], List[TaskRunner]] = {}
+    for runner in runners:
+        if not runner.prepare() or runner.lookup_result():
+            continue
+        if runner.batch_function is not None:
+            vectorized.setdefault((runner.task['module'], runner.task['function']), []).append(runner)
+        elif runner.execution() and runner.stream is not None:
+            try:
+                runner.report['result'] = list(runner.stream)
+            except Exception:
+                runner.update_status(False, traceback.format_exc())
+    for group in vectorized.values():
+        run_vectorized(group)
+    report = compose_batch_report(batch, [runner.report for runner in runners])
+    if blob_store:
+        blob_store.spill(report, 'batch')
+    return report
+
+
+def iterate_task(task: dict,
+                 blob_store: BlobStore = None,
+                 result_cache: ResultCache = None) -> Generator[dict, None, None]:
+    """
+    Runs task and produces messages with its results.
+
+    :param task: task body or batch of tasks
+    :param blob_store: storage for large payloads
+    :param result_cache: cache of pure task function results
+    :return: generator of messages for task client
+    """
+    if is_batch(task):
+        yield run_batch(task, blob_store, result_cache)
+        return
+    runner = TaskRunner(task, blob_store, result_cache)
+    runner.run()
+    yield from runner.messages()
+
+
+def execute_task(task: dict, blob_store: BlobStore = None, result_cache: ResultCache = None) -> List[dict]:
+    """
+    Runs task and returns messages with its results. Module level function
+    is used, so it could be passed to worker processes. Streamed result is
+    collected completely before return, so it is held in worker memory and
+    its chunks are published only after the task is completed.
+
+    :param task: task body
+    :param blob_store: storage for large payloads
+    :param result_cache: cache of pure task function results
+    :return: messages for task client
+    """
+    return list(iterate_task(task, blob_store, result_cache))
+
+
+def is_final(message: dict) -> bool:
+    """
+    Checks whether message completes task results.
+    """
+    return message.get('last', True)
+
+
+class TaskPool:
+    """
+    Executes tasks received from broker on a pool of workers.
+    Results are published as soon as they are produced and tasks are
+    acknowledged after their final message. Process workers return all
+    chunks of streamed result at once, so results that should not be held
+    in memory should be streamed by thread workers. Broker is accessed only from
+    the thread that consumes tasks, results are delivered to it via broker
+    events processing.
+    """
+    def __init__(self,
+                 broker: BrokerBase,
+                 workers: int = 1,
+                 mode: str = AGENT_EXECUTOR,
+                 blob_store: BlobStore = None,
+                 result_cache: ResultCache = None):
+        if mode not in EXECUTORS:
+            raise ValueError(f'Unknown executor mode "{mode}". Expected one of: {list(EXECUTORS)}')
+        self.broker = broker
+        self.workers = workers
+        self.mode = mode
+        self.blob_store = blob_store
+        # Worker processes share only results stored on disk
+        self.result_cache = result_cache
+        self.in_progress = 0
+        self._started: Dict[int, float] = {}  # id(task): submission time, only if metrics are enabled
+        self._failed = set()
+        self._window = BoundedSemaphore(workers * STREAM_WINDOW_PER_WORKER)
+        # Single worker executes tasks inline in consuming thread
+        self._executor = EXECUTORS[mode](max_workers=workers) if workers > 1 else None
+        if self._executor is not None and mode == PROCESS:
+            logger.info('Streamed results are collected by worker processes and published on task completion')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, task: dict):
+        """
+        Starts task execution.
+
+        :param task: task received from broker pulling generator
+        """
+        self.in_progress += 1
+        if metrics.enabled:
+            self._started[id(task)] = monotonic()
+            TASKS_IN_PROGRESS.set(self.in_progress)
+        if self._executor is None:
+            try:
+                for message in iterate_task(task, self.blob_store, self.result_cache):
+                    self._publish(task, message)
+            except Exception:
+                logger.exception(f'Task processing has crashed: {task}')
+                self._crash(task)
+        elif self.mode == PROCESS:
+            future = self._executor.submit(execute_task, task, self.blob_store, self.result_cache)
+            future.add_done_callback(partial(self._on_done, task))
+        else:
+            self._executor.submit(self._stream, task)
+
+    def _stream(self, task: dict):
+        # Called from worker thread
+        try:
+            for message in iterate_task(task, self.blob_store, self.result_cache):
+                while not self._window.acquire(timeout=SECOND):
+                    if not self.broker.connected:
+                        return
+                if not self._schedule(partial(self._publish, task, message, True)):
+                    self._window.release()
+                    return
+        except Exception:
+            logger.exception(f'Task processing has crashed: {task}')
+            self._schedule(partial(self._crash, task))
+
+    def _on_done(self, task: dict, future: Future):
+        # Called from executor management thread
+        try:
+            messages = future.result()
+        except Exception:
+            logger.exception(f'Task processing has crashed: {task}')
+            self._schedule(partial(self._crash, task))
+            return
+        if len(messages) > 1:
+            logger.debug('%d chunks of streamed result are returned by worker process at once', len(messages))
+        for message in messages:
+            self._schedule(partial(self._publish, task, message))
+
+    def _schedule(self, callback: Callable) -> bool:
+        try:
+            self.broker.call_threadsafe(callback)
+            return True
+        except Exception:
+            # Unacknowledged task is redelivered by broker after connection loss
+            logger.exception('Task results are not delivered to consuming thread')
+            return False
+
+    def _publish(self, task: dict, message: dict, windowed: bool = False):
+        if windowed:
+            self._window.release()
+        if not self.broker.push(message, message['client'], self.broker.correlation_id(task)):
+            self._failed.add(id(task))
+        if not is_final(message):
+            return
+        self.in_progress -= 1
+        # Task is acknowledged only after all its results are published
+        if id(task) in self._failed:
+            self._failed.discard(id(task))
+            self.broker.set_task_failed(task)
+            self._observe(task, 'requeued')
+        else:
+            self.broker.set_task_done(task)
+            self._observe(task, 'done')
+
+    def _crash(self, task: dict):
+        self.in_progress -= 1
+        self._failed.discard(id(task))
+        self.broker.set_task_failed(task, requeue=False)
+        self._observe(task, 'crashed')
+
+    def _observe(self, task: dict, outcome: str):
+        started = self._started.pop(id(task), None)
+        if started is None:
+            return
+        TASK_SECONDS.observe(monotonic() - started)
+        TASKS.inc(outcome)
+        TASKS_IN_PROGRESS.set(self.in_progress)
+
+    def drain(self, timeout: Union[int, float, None] = None) -> bool:
+        """
+        Waits for completion of tasks that are in progress.
+
+        :param timeout: waiting limit
+        :return: True if all tasks are completed
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while self.in_progress and self.broker.connected:
+            if deadline is not None and monotonic() > deadline:
+                break
+            self.broker.process_events(time_limit=0.1 * SECOND)
+        return not self.in_progress
+
+    def close(self):
+        self.drain()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self.broker.connected:
+            self.broker.process_events()
@@ -0,0 +1,148 @@
+import logging
+from queue import Empty, Queue
+from threading import Event, Thread
+from typing import Union
+from uuid import uuid4
+
+from dcn.agent.agent import Agent
+from dcn.agent.pool import TaskPool
+from dcn.common.constants import AGENT, SECOND
+from dcn.common.defaults import CONTROL_EXCHANGE_NAME, CONTROL_EXCHANGE_TYPE, PULSE_PERIOD, RECONNECT_DELAY, \
+    RoutingKeys
+
+logger = logging.getLogger(AGENT)
+
+# Queued instead of commands once dispatcher does not know agent anymore
+REGISTER = 'register'
+
+
+class AgentRuntime:
+    """
+    Event driven main loop of Agent. Tasks are consumed as soon as broker
+    delivers them, while pulses are sent from separate thread on their own
+    period and commands broadcast by dispatcher are received by control
+    thread. Broker is used only by the thread that runs the loop, so
+    commands are applied there once tasks in progress are completed.
+    """
+    # Period of control consumer stop request check
+    CONTROL_POLL_PERIOD = 0.1 * SECOND
+
+    def __init__(self, agent: Agent, pulse_period: Union[int, float] = PULSE_PERIOD):
+        self.agent = agent
+        self.pulse_period = pulse_period
+        self._commands: Queue = Queue()
+        self._running = False
+        self._stopped = Event()
+
+    def run(self):
+        """
+        Registers on Dispatcher and processes tasks until stopped.
+        Tasks in progress are completed before return.
+        """
+        agent = self.agent
+        self._running = True
+        self._stopped.clear()
+        pulses = Thread(target=self._pulse_loop, name='pulse', daemon=True)
+        control = Thread(target=self._consume_control, name='control', daemon=True)
+        pool = None
+        try:
+            while self._running:
+                if not self._commands.empty():
+                    # Commands may replace broker, so its tasks are completed first
+                    if pool is not None:
+                        pool.close()
+                        pool = None
+                    self._apply_commands()
+                    continue
+                if not agent.id and not agent.register():
+                    self._stopped.wait(RECONNECT_DELAY)
+                    continue
+                if pulses.ident is None:
+                    pulses.start()
+                if not agent.broker and not agent.request_broker_data():
+                    self._stopped.wait(RECONNECT_DELAY)
+                    continue
+                if agent.control_host and control.ident is None:
+                    control.start()
+                if not agent.broker.connected and not agent.broker.connect():
+                    self._stopped.wait(agent.broker.backoff.remaining)
+                    continue
+                if pool is None:
+                    pool = TaskPool(agent.broker, agent.workers, agent.executor, agent.blob_store,
+                                    agent.result_cache)
+                # Generator is exhausted on inactivity timeout, so stop request is checked periodically
+                for task in agent.broker.pulling_generator():
+                    pool.submit(task)
+                    if not self._running or not self._commands.empty():
+                        break
+        finally:
+            self._running = False
+            self._stopped.set()
+            if pool is not None:
+                pool.close()
+            for thread in (pulses, control):
+                if thread.ident is not None:
+                    thread.join()
+        logger.info('Agent is stopped')
+
+    def stop(self):
+        """
+        Requests loop to stop. Could be called from any thread or signal handler.
+        """
+        self._running = False
+        self._stopped.set()
+
+    def _pulse_loop(self):
+        # Called from pulse thread
+        agent = self.agent
+        while not self._stopped.wait(self.pulse_period):
+            if not agent.id:
+                continue
+            try:
+                if not agent.pulse():
+                    # Agent is expired or dispatcher state is lost, registration is repeated by main loop
+                    logger.warning('Pulse is rejected by dispatcher, agent is registered again')
+                    self._commands.put(REGISTER)
+                elif agent.commands:
+                    commands, agent.commands = agent.commands, []
+                    self._commands.put(commands)
+            except Exception:
+                logger.exception('Pulse request has failed')
+
+    def _consume_control(self):
+        # Called from control thread, control broker is used only by it
+        agent = self.agent
+        broker = agent.broker_class(exchange=CONTROL_EXCHANGE_NAME, exchange_type=CONTROL_EXCHANGE_TYPE,
+                                    queue=f'{RoutingKeys.CONTROL}.{uuid4().hex}', host=agent.control_host,
+                                    exclusive=True, inactivity_timeout=self.CONTROL_POLL_PERIOD)
+        try:
+            while not self._stopped.is_set():
+                if not broker.connected and not broker.connect():
+                    self._stopped.wait(broker.backoff.remaining)
+                    continue
+                for message in broker.pulling_generator():
+                    commands = agent.receive_control(message)
+                    broker.set_task_done(message)
+                    if commands:
+                        self._commands.put(commands)
+                    if self._stopped.is_set():
+                        break
+        finally:
+            broker.close()
+
+    def _apply_commands(self):
+        agent = self.agent
+        while True:
+            try:
+                commands = self._commands.get_nowait()
+            except Empty:
+                return
+            if commands == REGISTER:
+                # Queues are requested again for the new agent id
+                agent.id = 0
+                if agent.broker:
+                    agent.broker.close()
+                    agent.broker = None
+                continue
+            logger.info('Applying commands: %s', commands)
+            agent.apply_commands(commands)
@@ -1 +1,2 @@
-from .client import Client
\ No newline at end of file
+from .client import Client
+from .async_client import AsyncClient
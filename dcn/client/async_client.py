@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Iterable
+
+from dcn.client.client import Client
+from dcn.common.async_broker import AsyncBroker
+from dcn.common.connection import AsyncRequestConnection
+from dcn.common.data_structures import compose_queue, compose_task
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncClient(Client):
+    """
+    Client for asyncio applications. Submitted tasks are represented by
+    futures that are completed by single consumer of client result queue.
+    """
+    connection_class = AsyncRequestConnection
+    broker_class = AsyncBroker
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncClient, self).__init__(*args, **kwargs)
+        self._consumer = None
+
+    async def __aenter__(self):
+        self.socket.establish()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+        self.__exit__()
+
+    async def get_client_queues(self) -> bool:
+        return self._client_queues_reply(await self.socket.send(self._client_queues_request()))
+
+    async def connect(self) -> bool:
+        """
+        Requests client queues if they are not known yet, connects to broker
+        and starts results consumption.
+
+        :return: connection status
+        """
+        if not self.broker and not await self.get_client_queues():
+            return False
+        if not await self.broker.connect():
+            return False
+        self._consumer = asyncio.ensure_future(self._consume_results())
+        return True
+
+    def submit(self, module: str, function: str, arguments=None, priority: int = 0) -> asyncio.Future:
+        """
+        Sends task for execution.
+
+        :param module: task module name
+        :param function: task function name
+        :param arguments: task function arguments
+        :param priority: task priority, higher one is executed earlier
+        :return: future with task result
+        """
+        task_id = next(self._task_ids)
+        correlation_id = self._correlation_id(task_id)
+        future = asyncio.get_running_loop().create_future()
+        with self._futures_lock:
+            self._futures[correlation_id] = future
+        task = compose_task(task_id, compose_queue(self.broker.queue), module, function, arguments, priority)
+        asyncio.ensure_future(self._publish(task, correlation_id))
+        return future
+
+    def map(self, module: str, function: str, arguments: Iterable, priority: int = 0) -> asyncio.Future:
+        """
+        Sends task for each of arguments.
+
+        :return: future with list of task results in arguments order
+        """
+        return asyncio.gather(*(self.submit(module, function, task_arguments, priority)
+                                for task_arguments in arguments))
+
+    async def _publish(self, task: dict, correlation_id: str):
+        if not await self.broker.publish(task, correlation_id=correlation_id, priority=task['priority']):
+            self._reject(correlation_id)
+
+    async def _consume_results(self):
+        async for message in self.broker.pulling_generator():
+            correlation_id = self.broker.correlation_id(message)
+            reports = self.assembler.reports(message) if self._is_submitted(correlation_id) else []
+            self.broker.set_task_done(message)
+            for report in reports:
+                self._resolve(self._report_correlation_id(message, correlation_id, report), report)
+        # Connection is lost, results of pending tasks would not be received
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Connection to broker is lost'))
+        self._futures.clear()
@@ -0,0 +1,113 @@
+import logging
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic
+from typing import Callable, Dict, List, Tuple, Union
+
+from dcn.common.broker import BrokerBase
+from dcn.common.constants import CLIENT, SECOND
+from dcn.common.data_structures import compose_batch, compose_queue
+from dcn.common.defaults import BATCH_LINGER, BATCH_SIZE
+
+logger = logging.getLogger(CLIENT)
+
+# Submitted item that requests publishing of all incomplete batches
+FLUSH = None
+
+
+class TaskBatcher:
+    """
+    Packs tasks into batch messages, so small tasks do not pay per message
+    costs of broker and agent. Batch is published once it is full or its
+    first task has waited for linger time. Tasks of different priorities
+    are packed into separate batches. Batches are published from batcher
+    thread that has its own broker connection.
+    """
+    def __init__(self,
+                 broker: BrokerBase,
+                 on_reject: Callable[[str], None],
+                 size: int = BATCH_SIZE,
+                 linger: Union[int, float] = BATCH_LINGER,
+                 name: str = 'batcher',
+                 correlation_id: str = None):
+        self.broker = broker
+        self.on_reject = on_reject
+        self.size = size
+        self.linger = linger
+        # Batch reports are delivered with the same correlation id
+        self.correlation_id = correlation_id
+        self._queue: Queue = Queue()
+        self._batch_ids = 0
+        # priority: (first task submission time, [(task, correlation id)])
+        self._pending: Dict[int, Tuple[float, List[Tuple[dict, str]]]] = {}
+        self._running = True
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, task: dict, correlation_id: str):
+        """
+        Adds task to the batch of its priority. Could be called from any thread.
+
+        :param task: task body
+        :param correlation_id: identifier of task result
+        """
+        self._queue.put((task, correlation_id))
+
+    def flush(self):
+        """
+        Requests publishing of incomplete batches without waiting for linger time.
+        """
+        self._queue.put(FLUSH)
+
+    def close(self):
+        """
+        Publishes incomplete batches and stops batcher thread.
+        """
+        self._running = False
+        self.flush()
+        self._thread.join()
+
+    def _run(self):
+        # Called from batcher thread
+        while self._running or not self._queue.empty():
+            try:
+                item = self._queue.get(timeout=self._wait_time())
+            except Empty:
+                item = ()
+            if item is FLUSH:
+                for priority in list(self._pending):
+                    self._publish(priority)
+            elif item:
+                self._add(*item)
+            now = monotonic()
+            for priority, (started, _) in list(self._pending.items()):
+                if now - started >= self.linger:
+                    self._publish(priority)
+        self.broker.close()
+
+    def _wait_time(self) -> float:
+        if not self._pending:
+            # Stop request is delivered with flush item, timeout is a safeguard
+            return SECOND
+        started = min(started for started, _ in self._pending.values())
+        return max(0, started + self.linger - monotonic())
+
+    def _add(self, task: dict, correlation_id: str):
+        priority = task['priority']
+        _, tasks = self._pending.setdefault(priority, (monotonic(), []))
+        tasks.append((task, correlation_id))
+        if len(tasks) >= self.size:
+            self._publish(priority)
+
+    def _publish(self, priority: int):
+        _, tasks = self._pending.pop(priority)
+        self._batch_ids += 1
+        batch = compose_batch(self._batch_ids, compose_queue(self.broker.queue),
+                              [task for task, _ in tasks], priority)
+        logger.debug('Publishing batch %d of %d tasks', self._batch_ids, len(tasks))
+        published = (self.broker.connected or self.broker.connect()) and \
+            self.broker.publish(batch, correlation_id=self.correlation_id, priority=priority)
+        if published:
+            return
+        for _, correlation_id in tasks:
+            self.on_reject(correlation_id)
@@ -1,50 +1,332 @@
+from concurrent.futures import Future
 from copy import deepcopy
+from itertools import count
 import logging
+from threading import Event, Lock, Thread
+from typing import Dict, Generator, Iterable, List, Optional, Type, Union
+from uuid import uuid4
 
-from dcn.common.broker import Broker
+from dcn.client.batching import TaskBatcher
+from dcn.common.blob_store import BlobStore
+from dcn.common.broker import Broker, BrokerBase
+from dcn.common.codec import available_codecs
 from dcn.common.connection import RequestConnection
+from dcn.common.data_structures import compose_queue, compose_task, is_batch
+from dcn.common.defaults import BATCH_LINGER, BATCH_SIZE
 from dcn.common.request_types import Client_queues
 
 logger = logging.getLogger(__name__)
 
 
+class TaskError(Exception):
+    """
+    Task is failed on agent. Failed task report is attached.
+    """
+    def __init__(self, report: dict):
+        super(TaskError, self).__init__(report['resolution'])
+        self.report = report
+
+
+def set_future_report(future, report: dict):
+    """
+    Completes task future with result from report or TaskError.
+
+    :param future: concurrent or asyncio future
+    :param report: task report
+    """
+    if future.done():
+        return
+    if report['status']:
+        future.set_result(report['result'])
+    else:
+        future.set_exception(TaskError(report))
+
+
+class ResultAssembler:
+    """
+    Restores task reports from result messages. Streamed results are
+    collected from chunks in sequence order and payloads passed by
+    reference are loaded from blob store.
+    """
+    def __init__(self, blob_store: BlobStore = None):
+        self.blob_store = blob_store
+        self._chunks: Dict[int, Dict[int, object]] = {}
+        self._last_chunks: Dict[int, dict] = {}
+
+    def feed(self, message: dict) -> Optional[dict]:
+        """
+        Processes result message.
+
+        :param message: message from client result queue
+        :return: task report if all its results are received
+        """
+        if 'chunk' not in message:
+            return self._resolve(message)
+        task_id = message['id']
+        if message['last']:
+            self._last_chunks[task_id] = message
+        else:
+            # Redelivered chunks are overwritten
+            self._chunks.setdefault(task_id, {})[message['chunk']] = self._resolve(message)['result']
+        last = self._last_chunks.get(task_id)
+        chunks = self._chunks.get(task_id, {})
+        if last is None or len(chunks) < last['chunk']:
+            return None
+        del self._last_chunks[task_id]
+        self._chunks.pop(task_id, None)
+        report = {key: last[key] for key in ('id', 'client', 'status', 'resolution')}
+        report['result'] = [chunks[sequence] for sequence in range(last['chunk'])]
+        return report
+
+    def reports(self, message: dict) -> List[dict]:
+        """
+        Processes result message that may carry reports of batched tasks.
+
+        :param message: message from client result queue
+        :return: task reports that are completed by message
+        """
+        if is_batch(message):
+            return self._resolve(message, 'batch')['batch']
+        report = self.feed(message)
+        return [] if report is None else [report]
+
+    def _resolve(self, message: dict, key: str = 'result') -> dict:
+        if self.blob_store:
+            self.blob_store.resolve(message, key)
+        return message
+
+
 class Client:
+    connection_class = RequestConnection
+    broker_class = Broker
+
     def __init__(self,
                  name: str,
                  token: str,
                  dsp_ip: str = 'localhost',
-                 dsp_port: int = 9999):
+                 dsp_port: int = 9999,
+                 blob_store: BlobStore = None,
+                 batch_size: int = BATCH_SIZE,
+                 batch_linger: Union[int, float] = BATCH_LINGER,
+                 broker_class: Type[BrokerBase] = None):
         logger.info('Starting Client')
+        if broker_class is not None:
+            self.broker_class = broker_class
         self.name = name
         self.token = token
-        self.socket = RequestConnection(dsp_ip, dsp_port)
+        self.socket = self.connection_class(dsp_ip, dsp_port)
         self.broker = None
+        self.assembler = ResultAssembler(blob_store)
+        # Correlation ids of task results are task ids prefixed by client session,
+        # so results left in result queue by previous client run are not matched
+        self._session = uuid4().hex
+        self._task_ids = count(1)
+        self._futures: Dict[str, Future] = {}
+        self._futures_lock = Lock()
+        self._consumer_thread = None
+        self._stop_consuming = Event()
+        # Tasks are packed into batch messages if batch size is above 1
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger
+        self._batcher = None
 
     def __enter__(self):
         self.socket.establish()
         return self
 
     def __exit__(self, *exc_info):
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
+        self._stop_results_consumer()
         if self.broker:
             self.broker.close()
         self.socket.close()
 
     def get_client_queues(self):
+        return self._client_queues_reply(self.socket.send(self._client_queues_request()))
+
+    def _client_queues_request(self) -> dict:
         request = deepcopy(Client_queues)
         request['name'] = self.name
         request['token'] = self.token
-        reply = self.socket.send(request)
+        request['codecs'] = available_codecs()
+        return request
+
+    def _client_queues_reply(self, reply: dict) -> bool:
         if reply['result']:
-            self.broker = Broker(
+            self.broker = self.broker_class(
                 queue=reply['broker']['result'],
-                host=reply['broker']['host']
+                host=reply['broker']['host'],
+                codec=reply['broker']['codec'],
+                max_priority=reply['broker'].get('max_priority', 0)
             )
             self.broker.output_routing_key = reply['broker']['task']
+            # Tasks are not dropped if they are published before agents declare task queue
+            self.broker.output_queues = [reply['broker']['task']]
             return True
         else:
             return False
             # ConnectionRefusedError('Invalid credentials or resource is busy')
 
+    def results(self) -> Generator[dict, None, None]:
+        """
+        Streams task reports from client result queue. Generator is
+        exhausted once no result arrives during broker inactivity timeout.
+
+        :return: generator of task reports
+        """
+        for message in self.broker.pulling_generator():
+            reports = self.assembler.reports(message)
+            self.broker.set_task_done(message)
+            yield from reports
+
+    def submit(self, module: str, function: str, arguments=None, priority: int = 0) -> Future:
+        """
+        Sends task for execution. Task result is delivered to returned
+        future by results consumer that is started with the first task.
+        Tasks should be submitted from the thread that created client,
+        results generator should not be used along with futures.
+        Task is packed into batch message if client batch size is above 1.
+
+        :param module: task module name
+        :param function: task function name
+        :param arguments: task function arguments
+        :param priority: task priority, higher one is executed earlier
+        :return: future with task result
+        """
+        task, correlation_id, future = self._prepare_task(module, function, arguments, priority)
+        if self._batcher is not None:
+            self._batcher.submit(task, correlation_id)
+        elif not self.broker.publish(task, correlation_id=correlation_id, priority=priority):
+            self._reject(correlation_id)
+        return future
+
+    def map(self, module: str, function: str, arguments: Iterable, priority: int = 0) -> List[Future]:
+        """
+        Sends task for each of arguments in a single batch. Tasks are
+        packed into messages of client batch size if it is above 1.
+
+        :param module: task module name
+        :param function: task function name
+        :param arguments: arguments of each task
+        :param priority: priority of tasks
+        :return: futures with task results in arguments order
+        """
+        tasks, correlation_ids, futures = [], [], []
+        for task_arguments in arguments:
+            task, correlation_id, future = self._prepare_task(module, function, task_arguments, priority)
+            tasks.append(task)
+            correlation_ids.append(correlation_id)
+            futures.append(future)
+        if self._batcher is not None:
+            for task, correlation_id in zip(tasks, correlation_ids):
+                self._batcher.submit(task, correlation_id)
+            # Arguments are exhausted, so last batch is not completed by more tasks
+            self._batcher.flush()
+            return futures
+        confirmed = self.broker.publish_many(tasks, correlation_ids=correlation_ids, priority=priority)
+        for correlation_id, is_confirmed in zip(correlation_ids, confirmed):
+            if not is_confirmed:
+                self._reject(correlation_id)
+        return futures
+
+    def _prepare_task(self, module: str, function: str, arguments=None, priority: int = 0):
+        if self._consumer_thread is None:
+            self._start_results_consumer()
+        if self._batcher is None and self.batch_size > 1:
+            self._start_batcher()
+        task_id = next(self._task_ids)
+        correlation_id = self._correlation_id(task_id)
+        future = Future()
+        with self._futures_lock:
+            self._futures[correlation_id] = future
+        task = compose_task(task_id, compose_queue(self.broker.queue), module, function, arguments, priority)
+        return task, correlation_id, future
+
+    def _correlation_id(self, task_id: int) -> str:
+        return f'{self._session}.{task_id}'
+
+    def _is_submitted(self, correlation_id: Optional[str]) -> bool:
+        """
+        Checks that result message belongs to task or batch submitted by this client instance.
+        """
+        if correlation_id is None or correlation_id.split('.')[0] != self._session:
+            logger.warning(f'Result of task submitted by other client run is dropped: {correlation_id}')
+            return False
+        return True
+
+    def _report_correlation_id(self, message: dict, correlation_id: str, report: dict) -> str:
+        # Reports of batched tasks are matched by their task ids
+        return self._correlation_id(report['id']) if is_batch(message) else correlation_id
+
+    def _reject(self, correlation_id: str):
+        with self._futures_lock:
+            future = self._futures.pop(correlation_id, None)
+        if future is not None and not future.done():
+            future.set_exception(ConnectionError(f'Task {correlation_id} is not accepted by broker'))
+
+    def _start_results_consumer(self):
+        # Blocking connection is not thread safe, so consumer has its own one
+        broker = self.broker_class(
+            queue=self.broker.queue,
+            host=self.broker.host,
+            codec=self.broker.codec.name
+        )
+        self._stop_consuming.clear()
+        self._consumer_thread = Thread(target=self._consume_results, args=[broker],
+                                       name=f'{self.name}-results', daemon=True)
+        self._consumer_thread.start()
+
+    def _start_batcher(self):
+        # Batches are published from batcher thread that has its own connection
+        broker = self.broker_class(
+            queue=self.broker.queue,
+            host=self.broker.host,
+            codec=self.broker.codec.name,
+            max_priority=self.broker.max_priority
+        )
+        broker.output_routing_key = self.broker.output_routing_key
+        broker.output_queues = self.broker.output_queues
+        self._batcher = TaskBatcher(broker, self._reject, self.batch_size, self.batch_linger,
+                                    name=f'{self.name}-batcher', correlation_id=self._session)
+
+    def _stop_results_consumer(self):
+        if self._consumer_thread is None:
+            return
+        self._stop_consuming.set()
+        self._consumer_thread.join()
+        self._consumer_thread = None
+        with self._futures_lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.cancel()
+
+    def _consume_results(self, broker: BrokerBase):
+        # Called from results consumer thread
+        while not self._stop_consuming.is_set():
+            if not broker.connected and not broker.connect():
+                self._stop_consuming.wait(broker.backoff.remaining)
+                continue
+            # Generator is exhausted on inactivity timeout, so stop request is checked periodically
+            for message in broker.pulling_generator():
+                correlation_id = broker.correlation_id(message)
+                reports = self.assembler.reports(message) if self._is_submitted(correlation_id) else []
+                broker.set_task_done(message)
+                for report in reports:
+                    self._resolve(self._report_correlation_id(message, correlation_id, report), report)
+                if self._stop_consuming.is_set():
+                    break
+        broker.close()
+
+    def _resolve(self, correlation_id: str, report: dict):
+        with self._futures_lock:
+            future = self._futures.pop(correlation_id, None)
+        if future is None:
+            logger.warning(f'Result of unknown task is received: {correlation_id}')
+            return
+        set_future_report(future, report)
+
 
 def main():
     ...
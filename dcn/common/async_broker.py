@@ -0,0 +1,331 @@
+import asyncio
+import logging
+from typing import AsyncGenerator, Callable, Dict, Iterable, List, Optional, Union
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from dcn.common.broker import Broker, ConnectionPool
+from dcn.common.constants import BROKER, EXCHANGE, QUEUE
+from dcn.common.defaults import CODEC, CONNECTION_RETRY_COUNT, EXCHANGE_NAME, EXCHANGE_TYPE, MAX_PRIORITY, PREFETCH_COUNT
+
+logger = logging.getLogger(BROKER)
+
+
+class AsyncBroker(Broker):
+    """
+    Broker wrapper for asyncio applications.
+    Connection is served by running event loop, so publishing and
+    consuming do not block it. Every published message is confirmed
+    by broker, confirmations of concurrent publishers are awaited together.
+    """
+    def __init__(self,
+                 exchange=EXCHANGE_NAME,
+                 exchange_type=EXCHANGE_TYPE,
+                 routing_key='',
+                 queue='',
+                 host='localhost',
+                 prefetch_count: int = PREFETCH_COUNT,
+                 inactivity_timeout: Union[int, float, None] = None,
+                 codec: str = CODEC,
+                 max_priority: int = MAX_PRIORITY,
+                 queue_weights: Dict[str, int] = None,
+                 exclusive: bool = False,
+                 pool: ConnectionPool = None):
+        # Connection is served by event loop, so blocking connections pool is not used
+        super(AsyncBroker, self).__init__(exchange, exchange_type, routing_key, queue, host,
+                                          prefetch_count, inactivity_timeout, codec,
+                                          max_priority, queue_weights, exclusive)
+        self._loop = None
+        self._confirms: Dict[int, asyncio.Future] = {}
+        self._consumer_queues: List[asyncio.Queue] = []
+
+    def _call(self, method: Callable, callback_name: str = 'callback', **kwargs) -> asyncio.Future:
+        # Completes future with the argument of operation completion callback
+        future = self._loop.create_future()
+
+        def callback(result):
+            if not future.done():
+                future.set_result(result)
+
+        method(**{callback_name: callback}, **kwargs)
+        return future
+
+    async def connect(self) -> bool:
+        """
+        Opens connection and declares exchange and queues.
+
+        :return: connection status
+        """
+        return await self._open() and await self.declare()
+
+    async def ensure_connection(self, retries: int = CONNECTION_RETRY_COUNT) -> bool:
+        """
+        Opens connection, failed attempts are retried after backoff delay
+        without blocking event loop. Exchange and queues should be declared afterwards.
+
+        :param retries: attempts limit
+        :return: connection status
+        """
+        for attempt in range(retries):
+            if attempt:
+                await asyncio.sleep(self.backoff.remaining)
+            if await self._open():
+                return True
+        logger.error('Unable to connect to broker on %s after %d attempts', self.host, retries)
+        return False
+
+    async def _reconnect(self) -> bool:
+        # Connection is restored on demand unless previous attempt has failed recently
+        return self.is_connected or (self.backoff.ready() and await self.connect())
+
+    async def _open(self) -> bool:
+        """
+        Opens connection and channel in confirm mode. Open connection is reused.
+        """
+        if self.is_connected:
+            return True
+        self._loop = asyncio.get_running_loop()
+        opened = self._loop.create_future()
+
+        def on_open_error(_, error):
+            if not opened.done():
+                opened.set_exception(pika.exceptions.AMQPConnectionError(error))
+
+        try:
+            self._connection = AsyncioConnection(
+                pika.ConnectionParameters(host=self.host),
+                on_open_callback=lambda _: opened.done() or opened.set_result(True),
+                on_open_error_callback=on_open_error,
+                on_close_callback=self._on_closed,
+                custom_ioloop=self._loop
+            )
+            await opened
+            self._channel = await self._call(self._connection.channel, 'on_open_callback')
+            self._channel.add_on_close_callback(self._on_closed)
+            self._reset_acks()
+            self._publish_tag = 0
+            await self._call(self._channel.confirm_delivery, ack_nack_callback=self._on_confirm)
+            self.is_connected = True
+            self.backoff.success()
+            return True
+        except (pika.exceptions.AMQPConnectionError, OSError):
+            self._connection_lost('connecting')
+            return False
+
+    async def declare(self) -> bool:
+        """
+        Declares exchange, input and output queues and sets prefetch window.
+
+        :return: declaration status
+        """
+        try:
+            await self._call(self._channel.exchange_declare,
+                             exchange=self.exchange, exchange_type=self.exchange_type)
+            for exchange, exchange_type in self.output_exchanges.items():
+                await self._call(self._channel.exchange_declare, exchange=exchange, exchange_type=exchange_type)
+            queues = [(self.queue, self.routing_key, self.exclusive)] if self.queue else []
+            queues.extend((queue, queue, False) for queue in self._extra_queues())
+            for queue, routing_key, exclusive in queues:
+                await self._call(self._channel.queue_declare, queue=queue, arguments=self.queue_arguments,
+                                 exclusive=exclusive)
+                await self._call(self._channel.queue_bind,
+                                 exchange=self.exchange, queue=queue, routing_key=routing_key)
+            await self._call(self._channel.basic_qos, prefetch_count=self.prefetch_count)
+            return True
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('declaring queues')
+            return False
+
+    def _connection_lost(self, action: str):
+        logger.warning('RabbitMQ on %s is not reachable while %s', self.host, action)
+        self.is_connected = False
+        delay = self.backoff.failure()
+        logger.info('Reconnection to %s is delayed for %.2f seconds', self.host, delay)
+
+    def _on_closed(self, _, reason: Exception):
+        logger.warning(f'Connection to {self.host} is closed: {reason}')
+        if self.is_connected:
+            # Connection is lost unexpectedly, closing by broker owner does not delay reconnection
+            self.backoff.failure()
+        self.is_connected = False
+        for future in self._confirms.values():
+            if not future.done():
+                future.set_result(False)
+        self._confirms.clear()
+        self.stop_consuming()
+
+    def _on_confirm(self, frame: pika.frame.Method):
+        method = frame.method
+        delivered = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._confirms if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        for tag in tags:
+            future = self._confirms.pop(tag, None)
+            if future is not None and not future.done():
+                future.set_result(delivered)
+
+    def _send(self,
+              message: dict,
+              routing_key: str = None,
+              exchange: str = None,
+              correlation_id: str = None,
+              priority: int = None) -> asyncio.Future:
+        future = self._loop.create_future()
+        if not self.is_connected:
+            future.set_result(False)
+            return future
+        logger.debug('sending: %s', message)
+        self._channel.basic_publish(
+            exchange=exchange if exchange else self.exchange,
+            routing_key=routing_key if routing_key else self.output_routing_key,
+            body=self.codec.encode(message),
+            properties=self._compose_properties(correlation_id, priority)
+        )
+        self._publish_tag += 1
+        self._confirms[self._publish_tag] = future
+        return future
+
+    async def publish(self,
+                      message: dict,
+                      routing_key: str = None,
+                      exchange: str = None,
+                      correlation_id: str = None,
+                      priority: int = None) -> bool:
+        """
+        Publishes message and waits for its confirmation by broker.
+
+        :return: delivery confirmation status
+        """
+        if not await self._reconnect():
+            return False
+        return await self._send(message, routing_key, exchange, correlation_id, priority)
+
+    async def publish_many(self,
+                           messages: Iterable[dict],
+                           routing_key: str = None,
+                           timeout: Union[int, float] = None,
+                           correlation_ids: Iterable[str] = None,
+                           priority: int = None) -> List[bool]:
+        """
+        Publishes batch of messages and waits for their confirmations.
+
+        :return: delivery confirmation status per message in original order
+        """
+        correlation_ids = iter(correlation_ids) if correlation_ids is not None else None
+        messages = list(messages)
+        if not await self._reconnect():
+            return [False] * len(messages)
+        futures = [self._send(message, routing_key,
+                              correlation_id=next(correlation_ids) if correlation_ids else None,
+                              priority=priority)
+                   for message in messages]
+        done, _ = await asyncio.wait(futures, timeout=timeout) if futures else (set(), set())
+        return [future.result() if future in done else False for future in futures]
+
+    async def push(self,
+                   message: dict,
+                   destination: Union[str, dict],
+                   correlation_id: str = None) -> bool:
+        if isinstance(destination, dict):
+            return await self.publish(message, destination[QUEUE], destination[EXCHANGE], correlation_id)
+        return await self.publish(message, destination, correlation_id=correlation_id)
+
+    def consume(self):
+        raise RuntimeError('Asynchronous broker delivers messages via pulling_generator')
+
+    async def pulling_generator(self) -> AsyncGenerator[dict, None]:
+        """
+        Streams messages from input queue that are pushed by the broker.
+        Generator is exhausted once no message arrives during inactivity
+        timeout, if one is set, or on connection loss.
+        Every yielded message stays unacknowledged until it is passed to
+        set_task_done or set_task_failed.
+
+        :return: asynchronous generator of received messages
+        """
+        if self.queue_weights:
+            raise RuntimeError('Weighted consumption of several queues is not supported by asynchronous broker')
+        deliveries = asyncio.Queue()
+        self._consumer_queues.append(deliveries)
+        consumer_tag = self._channel.basic_consume(
+            queue=self.queue,
+            on_message_callback=lambda _, *delivery: deliveries.put_nowait(delivery)
+        )
+        try:
+            while self.is_connected:
+                try:
+                    delivery = await asyncio.wait_for(deliveries.get(), self._inactivity_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if delivery is None:
+                    break
+                method_frame, properties, body = delivery
+                logger.debug('Message received: %s', body)
+                try:
+                    message = self._decode(properties, body)
+                except (ValueError, ImportError):
+                    logger.exception(f'Message with content type {properties.content_type} is dropped')
+                    self._channel.basic_nack(method_frame.delivery_tag, requeue=False)
+                    continue
+                self._deliveries[id(message)] = (method_frame.delivery_tag, properties)
+                self._unacked[method_frame.delivery_tag] = False
+                yield message
+        finally:
+            self._consumer_queues.remove(deliveries)
+            if self.is_connected:
+                self.flush_acks()
+                self._channel.basic_cancel(consumer_tag)
+                # Messages that were delivered but not yielded are requeued
+                while not deliveries.empty():
+                    delivery = deliveries.get_nowait()
+                    if delivery is not None:
+                        self._channel.basic_nack(delivery[0].delivery_tag, requeue=True)
+
+    def stop_consuming(self):
+        """
+        Exhausts active pulling generators.
+        """
+        for queue in self._consumer_queues:
+            queue.put_nowait(None)
+
+    def set_task_done(self, message: dict) -> bool:
+        if not self.is_connected:
+            # Broker requeues unacknowledged messages of closed channel
+            self._deliveries.pop(id(message), None)
+            return False
+        return super(AsyncBroker, self).set_task_done(message)
+
+    def set_task_failed(self, message: dict, requeue: bool = True) -> bool:
+        if not self.is_connected:
+            self._deliveries.pop(id(message), None)
+            return False
+        return super(AsyncBroker, self).set_task_failed(message, requeue)
+
+    def flush_acks(self, out_of_order: bool = False) -> bool:
+        if not self.is_connected:
+            return False
+        return super(AsyncBroker, self).flush_acks(out_of_order)
+
+    async def queue_depth(self, queue: str = None) -> Optional[int]:
+        if not self.is_connected:
+            return None
+        frame = await self._call(self._channel.queue_declare, queue=queue if queue else self.queue, passive=True)
+        return frame.method.message_count
+
+    def call_threadsafe(self, callback: Callable):
+        self._loop.call_soon_threadsafe(callback)
+
+    def process_events(self, time_limit: Union[int, float, None] = 0):
+        raise RuntimeError('Asynchronous broker events are processed by event loop')
+
+    def close(self):
+        """
+        Starts connection closing without waiting for its completion.
+        """
+        if self._connection is not None and not (self._connection.is_closed or self._connection.is_closing):
+            self.flush_acks(out_of_order=True)
+            self._connection.close()
+        self.is_connected = False
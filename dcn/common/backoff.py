@@ -0,0 +1,49 @@
+from random import uniform
+from time import monotonic
+from typing import Union
+
+from dcn.common.defaults import RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY
+
+# Doubling limit beyond it exceeds any practical maximal delay
+MAX_EXPONENT = 32
+
+
+class Backoff:
+    """
+    Exponential delay between attempts with full jitter. Delay limit is
+    doubled by every failure up to maximum, while actual delay is random
+    within the limit, so peers that failed together do not retry in step.
+    """
+    def __init__(self,
+                 base: Union[int, float] = RECONNECT_BASE_DELAY,
+                 maximum: Union[int, float] = RECONNECT_MAX_DELAY):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self._next_attempt = 0.0
+
+    def failure(self) -> float:
+        """
+        Registers failed attempt and schedules the next one.
+
+        :return: delay before next attempt
+        """
+        # Exponent is bounded, so long outages do not overflow delay limit
+        delay = uniform(0, min(self.maximum, self.base * 2 ** min(self.failures, MAX_EXPONENT)))
+        self.failures += 1
+        self._next_attempt = monotonic() + delay
+        return delay
+
+    def success(self):
+        self.failures = 0
+        self._next_attempt = 0.0
+
+    @property
+    def remaining(self) -> float:
+        """
+        Time left before next attempt.
+        """
+        return max(0.0, self._next_attempt - monotonic())
+
+    def ready(self) -> bool:
+        return self.remaining == 0
@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from threading import get_ident
+from typing import Union
+
+from dcn.common.codec import JSON_CONTENT_TYPE, codec_for_content_type
+from dcn.common.defaults import BLOB_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+BLOB_REFERENCE = '$blob'
+
+
+def is_blob_reference(value) -> bool:
+    return isinstance(value, dict) and BLOB_REFERENCE in value
+
+
+class BlobStore:
+    """
+    Content addressed storage for large message payloads.
+    Location should be shared by message producer and consumer,
+    so payloads are passed between them by reference.
+    """
+    def __init__(self,
+                 path: Union[str, Path],
+                 threshold: int = BLOB_THRESHOLD):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.codec = codec_for_content_type(JSON_CONTENT_TYPE)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.path / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        """
+        Stores data under its content hash.
+
+        :param data: payload
+        :return: payload digest
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # Writers of the same payload use their own temporary files
+            temp_path = path.with_name(f'{digest}.{os.getpid()}.{get_ident()}.tmp')
+            temp_path.write_bytes(data)
+            # Readers never observe partially written blob
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                temp_path.unlink(missing_ok=True)
+                # Blob stored by concurrent writer has the same content
+                if not path.exists():
+                    raise
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        return self._blob_path(digest).read_bytes()
+
+    def delete(self, digest: str):
+        self._blob_path(digest).unlink(missing_ok=True)
+
+    def spill(self, message: dict, key: str = 'result') -> dict:
+        """
+        Replaces message value with blob reference if encoded value size
+        exceeds store threshold.
+
+        :param message: message to process
+        :param key: message key of the payload
+        :return: processed message
+        """
+        value = message.get(key)
+        if value is None or is_blob_reference(value):
+            return message
+        data = self.codec.encode(value)
+        if len(data) > self.threshold:
+            message[key] = {BLOB_REFERENCE: self.put(data), 'size': len(data)}
+            logger.debug(f'{key} of {len(data)} bytes is moved to {message[key][BLOB_REFERENCE]}')
+        return message
+
+    def resolve(self, message: dict, key: str = 'result') -> dict:
+        """
+        Replaces blob reference in message with referenced value.
+
+        :param message: message to process
+        :param key: message key of the payload
+        :return: processed message
+        """
+        value = message.get(key)
+        if is_blob_reference(value):
+            message[key] = self.codec.decode(self.get(value[BLOB_REFERENCE]))
+        return message
@@ -1,27 +1,131 @@
-import json
+import abc
 import logging
-from time import sleep
-from typing import Generator, Union
+from collections import deque
+from functools import partial
+from threading import Lock, get_ident
+from time import monotonic, sleep, time
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Tuple, Union
 
 import pika
 from pika.exceptions import AMQPConnectionError
 
+from dcn.common.backoff import Backoff
+from dcn.common.codec import codec_for_content_type, get_codec
 from dcn.common.constants import BROKER, EXCHANGE, QUEUE, SECOND
-from dcn.common.defaults import EXCHANGE_NAME, EXCHANGE_TYPE, RoutingKeys
+from dcn.common.metrics import metrics
+from dcn.common.scheduling import WeightedRoundRobin
+from dcn.common.defaults import CODEC, CONNECTION_RETRY_COUNT, EXCHANGE_NAME, EXCHANGE_TYPE, INACTIVITY_TIMEOUT, \
+    MAX_PRIORITY, PREFETCH_COUNT, PUBLISH_CONFIRM_TIMEOUT, RoutingKeys
 
 logger = logging.getLogger(BROKER)
 logging.getLogger('pika').setLevel(logging.WARNING)
 # RabbitMQ running container is required for current module operations
 # sudo docker run -dit --rm --name rabbitmq -p 5672:5672 -p 15672:15672 rabbitmq:3.11-management
 
+# Message header with publishing time, it is set only if metrics are enabled
+ENQUEUED_HEADER = 'enqueued'
 
-class Broker:
+PUBLISHED = metrics.counter('dcn_broker_published_total', 'Published messages')
+PUBLISH_SECONDS = metrics.histogram('dcn_broker_publish_seconds', 'Duration of publishing call', ('method',))
+DELIVERED = metrics.counter('dcn_broker_delivered_total', 'Messages delivered to consumer', ('queue',))
+QUEUE_WAIT_SECONDS = metrics.histogram('dcn_broker_queue_wait_seconds',
+                                       'Time from message publishing to its delivery', ('queue',))
+SETTLED = metrics.counter('dcn_broker_settled_total', 'Delivered messages settled by consumer', ('outcome',))
+
+
+def open_connection(host: str) -> pika.BlockingConnection:
+    return pika.BlockingConnection(
+        pika.ConnectionParameters(
+            host=host,
+            # credentials=self.credentials
+        )
+    )
+
+
+class ConnectionPool:
+    """
+    Connections shared by brokers of the same host. Blocking connection is
+    not thread safe, so brokers share connection only with brokers that are
+    connected from the same thread and should be used from that thread.
+    Connection is closed once it is released by its last broker.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._connections: Dict[Tuple[str, int], pika.BlockingConnection] = {}  # (host, thread id): connection
+        self._users: Dict[int, int] = {}  # id(connection): brokers count
+
+    def acquire(self, host: str) -> pika.BlockingConnection:
+        """
+        Returns open connection to the host for current thread.
+
+        :param host: broker host
+        :return: shared connection
+        :raise AMQPConnectionError: if host is not reachable
+        """
+        key = (host, get_ident())
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is not None and connection.is_open:
+                self._users[id(connection)] += 1
+                return connection
+        connection = open_connection(host)
+        with self._lock:
+            self._connections[key] = connection
+            self._users[id(connection)] = 1
+        return connection
+
+    def release(self, connection: pika.BlockingConnection, lost: bool = False):
+        """
+        Returns connection that is no longer used by broker.
+
+        :param connection: connection from acquire
+        :param lost: connection is broken, so it is not handed out anymore
+        """
+        with self._lock:
+            users = self._users.get(id(connection), 1) - 1
+            if users > 0:
+                self._users[id(connection)] = users
+            else:
+                self._users.pop(id(connection), None)
+            if lost or not users:
+                for key, shared in list(self._connections.items()):
+                    if shared is connection:
+                        del self._connections[key]
+        if not users:
+            close_connection(connection)
+
+
+def close_connection(connection: pika.BlockingConnection):
+    try:
+        if connection.is_open:
+            connection.close()
+    except pika.exceptions.AMQPError:
+        # Connection is already broken
+        pass
+
+
+connection_pool = ConnectionPool()
+
+
+class BrokerBase:
+    """
+    Message transport interface. Messages are published to exchange with
+    routing key and consumed from input queue, every consumed message
+    stays unacknowledged until it is marked as done or failed.
+    """
     def __init__(self,
                  exchange=EXCHANGE_NAME,
                  exchange_type=EXCHANGE_TYPE,
                  routing_key='',
                  queue='',
                  host='localhost',
+                 prefetch_count: int = PREFETCH_COUNT,
+                 inactivity_timeout: Union[int, float, None] = INACTIVITY_TIMEOUT,
+                 codec: str = CODEC,
+                 max_priority: int = MAX_PRIORITY,
+                 queue_weights: Dict[str, int] = None,
+                 exclusive: bool = False,
+                 pool: ConnectionPool = None,
                  # credentials=None
                  ):
         self.exchange = exchange
@@ -30,59 +134,641 @@ class Broker:
         self.output_routing_key = None
         self.queue = queue
         self.host = host
+        self.prefetch_count = prefetch_count
+        # Declared queues support message priorities up to this level
+        self.max_priority = max_priority
+        # Input queues that are consumed in proportion to their weights
+        self.queue_weights = queue_weights
+        # Queues that are declared for published messages routing
+        self.output_queues: List[str] = []
+        # Exchanges that are declared for published messages, name: type
+        self.output_exchanges: Dict[str, str] = {}
+        # Input queue is deleted once its connection is closed
+        self.exclusive = exclusive
+        self.codec = get_codec(codec)
+        # Connections are shared with other brokers if pool is specified
+        self.pool = pool
         # self.credentials = credentials
         self.is_connected = False
+        # Delays reconnection attempts after failures
+        self.backoff = Backoff()
+        self._inactivity_timeout = inactivity_timeout
+
+    @property
+    def connected(self) -> bool:
+        return self.is_connected
+
+    def _extra_queues(self) -> List[str]:
+        queues = list(self.queue_weights) if self.queue_weights else []
+        queues.extend(self.output_queues)
+        return [queue for queue in dict.fromkeys(queues) if queue != self.queue]
+
+    # Measurements are called only if metrics are enabled
+    @staticmethod
+    def _observe_publish(method: str, started: float, count: int = 1):
+        PUBLISH_SECONDS.observe(monotonic() - started, method)
+        PUBLISHED.inc(value=count)
+
+    @staticmethod
+    def _observe_delivery(queue: str, enqueued: Optional[float]):
+        DELIVERED.inc(queue)
+        if enqueued is not None:
+            # Clocks of publisher and consumer hosts may differ
+            QUEUE_WAIT_SECONDS.observe(max(0.0, time() - enqueued), queue)
+
+    def connect(self) -> bool:
+        """
+        Opens connection and declares exchange and queues.
+
+        :return: connection status
+        """
+        return self._open() and self.declare()
+
+    def ensure_connection(self, retries: int = CONNECTION_RETRY_COUNT) -> bool:
+        """
+        Opens connection, failed attempts are retried after backoff delay.
+        Exchange and queues should be declared afterwards.
+
+        :param retries: attempts limit
+        :return: connection status
+        """
+        for attempt in range(retries):
+            if attempt:
+                sleep(self.backoff.remaining)
+            if self._open():
+                return True
+        logger.error('Unable to connect to broker on %s after %d attempts', self.host, retries)
+        return False
+
+    def _reconnect(self) -> bool:
+        # Connection is restored on demand unless previous attempt has failed recently
+        return self.is_connected or (self.backoff.ready() and self.connect())
+
+    @abc.abstractmethod
+    def _open(self) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def declare(self) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def publish(self,
+                message: dict,
+                routing_key: str = None,
+                exchange: str = None,
+                correlation_id: str = None,
+                priority: int = None) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def publish_many(self,
+                     messages: Iterable[dict],
+                     routing_key: str = None,
+                     timeout: Union[int, float] = PUBLISH_CONFIRM_TIMEOUT,
+                     correlation_ids: Iterable[str] = None,
+                     priority: int = None) -> List[bool]:
+        ...
+
+    def push(self,
+             message: dict,
+             destination: Union[str, dict],
+             correlation_id: str = None) -> bool:
+        """
+        Publishes message to destination queue.
+
+        :param message: message payload
+        :param destination: routing key or queue descriptor from compose_queue
+        :param correlation_id: identifier that links message with request
+        :return: publishing status
+        """
+        if isinstance(destination, dict):
+            return self.publish(message, destination[QUEUE], destination[EXCHANGE], correlation_id)
+        return self.publish(message, destination, correlation_id=correlation_id)
+
+    @abc.abstractmethod
+    def consume(self) -> Tuple[bool, dict]:
+        ...
+
+    @abc.abstractmethod
+    def pulling_generator(self) -> Generator[dict, None, None]:
+        ...
+
+    @abc.abstractmethod
+    def correlation_id(self, message: dict) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    def set_task_done(self, message: dict) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def set_task_failed(self, message: dict, requeue: bool = True) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def flush_acks(self, out_of_order: bool = False) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def queue_depth(self, queue: str = None) -> Optional[int]:
+        ...
+
+    @abc.abstractmethod
+    def call_threadsafe(self, callback: Callable):
+        ...
+
+    @abc.abstractmethod
+    def process_events(self, time_limit: Union[int, float, None] = 0):
+        ...
+
+    @abc.abstractmethod
+    def close(self):
+        ...
+
+
+class Broker(BrokerBase):
+    """
+    Transport over RabbitMQ
+    """
+    def __init__(self, *args, **kwargs):
+        super(Broker, self).__init__(*args, **kwargs)
+        self._properties = pika.BasicProperties(content_type=self.codec.content_type)
         self._connection = None
         self._channel = None
+        # Acknowledgement tracking
+        self.ack_batch = max(1, self.prefetch_count // 2)
+        self._deliveries: Dict[int, Tuple[int, pika.BasicProperties]] = {}  # id(message): delivery
+        self._unacked: Dict[int, bool] = {}  # delivery tag: is done, in delivery order
+        self._ack_tag = 0
+        self._ack_pending = 0
+        # Publisher confirms tracking
+        self._confirm_channel = None
+        self._publish_tag = 0
+        self._pending_confirms: Dict[int, int] = {}  # delivery tag: message index
+        self._confirm_results: List[bool] = []
 
-    def connect(self):
+    def _open(self) -> bool:
+        """
+        Opens connection and channel. Channel that is still open is reused.
+        """
         try:
-            self._connection = pika.BlockingConnection(
-                pika.ConnectionParameters(
-                    host=self.host,
-                    # credentials=self.credentials
-                )
-            )
-            self._channel = self._connection.channel()
-            self._channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
-            self._channel.queue_declare(queue=self.queue)
-            self._channel.queue_bind(exchange=self.exchange, queue=self.queue, routing_key=self.routing_key)
-            self._channel.basic_qos(prefetch_count=1)
+            if self._connection is None or not self._connection.is_open:
+                self._connection = self.pool.acquire(self.host) if self.pool else open_connection(self.host)
+            if self._channel is None or not self._channel.is_open:
+                self._channel = self._connection.channel()
+                self._reset_acks()
             self.is_connected = True
+            self.backoff.success()
+            return True
+        except (pika.exceptions.AMQPConnectionError, OSError):
+            # Host name may be not resolved yet while broker is starting
+            self._connection_lost('connecting')
+            return False
+
+    def declare(self) -> bool:
+        """
+        Declares exchange, input and output queues and sets prefetch window.
+
+        :return: declaration status
+        """
+        try:
+            self._channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+            for exchange, exchange_type in self.output_exchanges.items():
+                self._channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+            if self.queue:
+                self._declare_queue(self.queue, self.routing_key, self.exclusive)
+            for queue in self._extra_queues():
+                self._declare_queue(queue, queue)
+            self._channel.basic_qos(prefetch_count=self.prefetch_count)
             return True
         except pika.exceptions.AMQPConnectionError:
-            print('Unable to connect to RabbitMQ broker')
+            self._connection_lost('declaring queues')
             return False
 
-    def publish(self, message: dict, routing_key: str = None):
+    def _connection_lost(self, action: str):
+        """
+        Drops broken connection, so it is opened again on next attempt.
+        Unacknowledged messages are requeued by broker in this case.
+        """
+        logger.warning('RabbitMQ on %s is not reachable while %s', self.host, action)
+        self.is_connected = False
+        self._release_connection(lost=True)
+        delay = self.backoff.failure()
+        logger.info('Reconnection to %s is delayed for %.2f seconds', self.host, delay)
+
+    def _release_connection(self, lost: bool = False):
+        if self._connection is not None:
+            if self.pool:
+                self.pool.release(self._connection, lost)
+            else:
+                close_connection(self._connection)
+        self._connection = None
+        self._channel = None
+        self._confirm_channel = None
+        self._reset_acks()
+
+    @property
+    def queue_arguments(self) -> Optional[dict]:
+        # Queue arguments are fixed on declaration, queue should be deleted to change them
+        return {'x-max-priority': self.max_priority} if self.max_priority else None
+
+    def _declare_queue(self, queue: str, routing_key: str, exclusive: bool = False):
+        self._channel.queue_declare(queue=queue, arguments=self.queue_arguments, exclusive=exclusive)
+        self._channel.queue_bind(exchange=self.exchange, queue=queue, routing_key=routing_key)
+
+    def publish(self,
+                message: dict,
+                routing_key: str = None,
+                exchange: str = None,
+                correlation_id: str = None,
+                priority: int = None):
+        if not self._reconnect():
+            return False
         try:
-            msg_str = json.dumps(message, indent=4)
-            logger.debug(f'sending: {msg_str}')
+            logger.debug('sending: %s', message)
+            started = monotonic() if metrics.enabled else 0
             self._channel.basic_publish(
-                exchange=self.exchange,
+                exchange=exchange if exchange else self.exchange,
                 routing_key=routing_key if routing_key else self.output_routing_key,
-                body=msg_str
+                body=self.codec.encode(message),
+                properties=self._compose_properties(correlation_id, priority)
             )
+            if started:
+                self._observe_publish('publish', started)
             return True
         except pika.exceptions.AMQPConnectionError:
-            self.is_connected = False
-            print('Lost connection to RabbitMQ while publishing message')
+            self._connection_lost('publishing message')
             return False
 
+    def publish_many(self,
+                     messages: Iterable[dict],
+                     routing_key: str = None,
+                     timeout: Union[int, float] = PUBLISH_CONFIRM_TIMEOUT,
+                     correlation_ids: Iterable[str] = None,
+                     priority: int = None) -> List[bool]:
+        """
+        Publishes batch of messages on a channel in confirm mode. Messages are
+        sent without waiting for each other and broker confirmations are
+        awaited once for the whole batch.
+
+        :param messages: messages payload
+        :param routing_key: messages routing key
+        :param timeout: confirmations waiting limit
+        :param correlation_ids: identifiers of messages in the same order
+        :param priority: priority of messages
+        :return: delivery confirmation status per message in original order
+        """
+        routing_key = routing_key if routing_key else self.output_routing_key
+        correlation_ids = iter(correlation_ids) if correlation_ids is not None else None
+        messages = list(messages)
+        # Status is reported for every message, even if connection is lost in the middle of batch
+        self._confirm_results = [False] * len(messages)
+        if not self._reconnect():
+            return self._confirm_results
+        self._pending_confirms.clear()
+        started = monotonic() if metrics.enabled else 0
+        try:
+            # Asynchronous channel implementation is used directly, because
+            # blocking channel waits for confirmation of every message
+            channel = self._get_confirm_channel()._impl
+            for index, message in enumerate(messages):
+                channel.basic_publish(
+                    exchange=self.exchange,
+                    routing_key=routing_key,
+                    body=self.codec.encode(message),
+                    properties=self._compose_properties(next(correlation_ids) if correlation_ids else None,
+                                                        priority)
+                )
+                self._publish_tag += 1
+                self._pending_confirms[self._publish_tag] = index
+            logger.debug('%d messages are sent to %s', len(messages), routing_key)
+            deadline = monotonic() + timeout
+            while self._pending_confirms and monotonic() < deadline:
+                self._connection.process_data_events(time_limit=deadline - monotonic())
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('publishing messages')
+        if self._pending_confirms:
+            logger.warning(f'{len(self._pending_confirms)} messages are not confirmed by broker')
+            self._pending_confirms.clear()
+        if started:
+            self._observe_publish('publish_many', started, sum(self._confirm_results))
+        return self._confirm_results
+
+    def _get_confirm_channel(self):
+        if self._confirm_channel is None or self._confirm_channel.is_closed:
+            self._confirm_channel = self._connection.channel()
+            self._publish_tag = 0
+            selected = []
+            self._confirm_channel._impl.confirm_delivery(
+                ack_nack_callback=self._on_publish_confirm,
+                callback=selected.append
+            )
+            while not selected:
+                self._connection.process_data_events(time_limit=None)
+        return self._confirm_channel
+
+    def _on_publish_confirm(self, frame: pika.frame.Method):
+        method = frame.method
+        delivered = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._pending_confirms if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        for tag in tags:
+            index = self._pending_confirms.pop(tag, None)
+            if index is not None:
+                self._confirm_results[index] = delivered
+
+    def _compose_properties(self, correlation_id: str = None, priority: int = None) -> pika.BasicProperties:
+        headers = {ENQUEUED_HEADER: time()} if metrics.enabled else None
+        if correlation_id is None and not priority and headers is None:
+            return self._properties
+        return pika.BasicProperties(content_type=self.codec.content_type,
+                                    correlation_id=correlation_id,
+                                    priority=priority if priority else None,
+                                    headers=headers)
+
+    @staticmethod
+    def _enqueued(properties: pika.BasicProperties) -> Optional[float]:
+        return properties.headers.get(ENQUEUED_HEADER) if properties.headers else None
+
     def consume(self):
+        if not self._reconnect():
+            return False, {}
         try:
             method_frame, header_frame, body = self._channel.basic_get(queue=self.queue, auto_ack=True)
-            logger.debug(f'Message received: {body}')
+            logger.debug('Message received: %s', body)
             if body:
-                return True, json.loads(body)
+                return True, self._decode(header_frame, body)
             else:
                 return True, {}
         except pika.exceptions.AMQPConnectionError:
-            self.is_connected = False
-            print('Lost connection to RabbitMQ while consuming message')
+            self._connection_lost('consuming message')
             return False, {}
 
+    def pulling_generator(self) -> Generator[dict, None, None]:
+        """
+        Streams messages from input queue that are pushed by the broker.
+        Up to prefetch_count messages are delivered in advance, so no round
+        trip is spent per message. Generator is exhausted once no message
+        arrives during inactivity timeout.
+        Every yielded message stays unacknowledged until it is passed to
+        set_task_done or set_task_failed.
+
+        :return: generator of received messages
+        """
+        if not self._reconnect():
+            return
+        if self.queue_weights:
+            yield from self._fair_pulling_generator()
+            return
+        try:
+            for method_frame, properties, body in self._channel.consume(
+                    queue=self.queue,
+                    inactivity_timeout=self._inactivity_timeout):
+                if method_frame is None:
+                    break
+                logger.debug('Message received: %s', body)
+                try:
+                    message = self._decode(properties, body)
+                except (ValueError, ImportError):
+                    logger.exception(f'Message with content type {properties.content_type} is dropped')
+                    self._channel.basic_nack(method_frame.delivery_tag, requeue=False)
+                    continue
+                self._deliveries[id(message)] = (method_frame.delivery_tag, properties)
+                self._unacked[method_frame.delivery_tag] = False
+                if metrics.enabled:
+                    self._observe_delivery(self.queue, self._enqueued(properties))
+                yield message
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('consuming messages')
+        finally:
+            if self.is_connected:
+                self.flush_acks()
+                # Messages that were prefetched but not yielded are requeued
+                self._channel.cancel()
+
+    def _fair_pulling_generator(self) -> Generator[dict, None, None]:
+        """
+        Streams messages from weighted input queues. Queue of each next
+        message is selected by weighted round robin among queues that have
+        prefetched messages, so busy queue does not delay others.
+        """
+        buffers = {queue: deque() for queue in self.queue_weights}
+        scheduler = WeightedRoundRobin(self.queue_weights)
+        consumer_tags = []
+
+        def on_message(buffer: deque, _, method_frame, properties, body):
+            # Delivery is tracked on arrival, so batched acknowledgement
+            # does not cover buffered messages of other queues
+            self._unacked[method_frame.delivery_tag] = False
+            buffer.append((method_frame, properties, body))
+
+        try:
+            for queue, buffer in buffers.items():
+                consumer_tags.append(self._channel.basic_consume(queue, partial(on_message, buffer)))
+            last_delivery = monotonic()
+            while True:
+                queue = scheduler.next(lambda key: buffers[key])
+                if queue is None:
+                    if self._inactivity_timeout is None:
+                        time_limit = None
+                    else:
+                        time_limit = last_delivery + self._inactivity_timeout - monotonic()
+                        if time_limit <= 0:
+                            break
+                    self._connection.process_data_events(time_limit=time_limit)
+                    continue
+                last_delivery = monotonic()
+                method_frame, properties, body = buffers[queue].popleft()
+                logger.debug('Message received from %s: %s', queue, body)
+                try:
+                    message = self._decode(properties, body)
+                except (ValueError, ImportError):
+                    logger.exception(f'Message with content type {properties.content_type} is dropped')
+                    del self._unacked[method_frame.delivery_tag]
+                    self._channel.basic_nack(method_frame.delivery_tag, requeue=False)
+                    continue
+                self._deliveries[id(message)] = (method_frame.delivery_tag, properties)
+                if metrics.enabled:
+                    self._observe_delivery(queue, self._enqueued(properties))
+                yield message
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('consuming messages')
+        finally:
+            if self.is_connected:
+                for consumer_tag in consumer_tags:
+                    self._channel.basic_cancel(consumer_tag)
+                # Messages that were prefetched but not yielded are requeued
+                for buffer in buffers.values():
+                    for method_frame, _, _ in buffer:
+                        del self._unacked[method_frame.delivery_tag]
+                        self._channel.basic_nack(method_frame.delivery_tag, requeue=True)
+                self._advance_acks()
+                self.flush_acks()
+
+    @staticmethod
+    def _decode(properties: pika.BasicProperties, body: bytes) -> dict:
+        # Content type defines the codec, so peers with different codecs interoperate
+        return codec_for_content_type(properties.content_type).decode(body)
+
+    def correlation_id(self, message: dict) -> Optional[str]:
+        """
+        Returns correlation identifier of message received from
+        pulling_generator that is not completed yet.
+
+        :param message: message yielded by pulling_generator
+        :return: correlation identifier if message has one
+        """
+        delivery = self._deliveries.get(id(message))
+        return delivery[1].correlation_id if delivery else None
+
+    def set_task_done(self, message: dict) -> bool:
+        """
+        Marks message received from pulling_generator as processed.
+        Acknowledgements are sent in batches that cover every processed
+        message up to the first one that is still in progress.
+
+        :param message: message yielded by pulling_generator
+        :return: acknowledgement status
+        """
+        delivery = self._deliveries.pop(id(message), None)
+        if delivery is None:
+            # Message is received before connection loss and is requeued by broker
+            return False
+        tag, _ = delivery
+        self._unacked[tag] = True
+        if metrics.enabled:
+            SETTLED.inc('done')
+        self._advance_acks()
+        if self._ack_pending >= self.ack_batch:
+            return self.flush_acks()
+        # Messages completed out of order would otherwise exhaust prefetch window
+        if self._ack_pending + sum(self._unacked.values()) >= self.ack_batch:
+            return self.flush_acks(out_of_order=True)
+        return True
+
+    def set_task_failed(self, message: dict, requeue: bool = True) -> bool:
+        """
+        Rejects message received from pulling_generator.
+
+        :param message: message yielded by pulling_generator
+        :param requeue: return message to the queue for redelivery
+        :return: rejection status
+        """
+        delivery = self._deliveries.pop(id(message), None)
+        if delivery is None:
+            return False
+        tag, _ = delivery
+        del self._unacked[tag]
+        if metrics.enabled:
+            SETTLED.inc('requeued' if requeue else 'rejected')
+        self._advance_acks()
+        try:
+            self._channel.basic_nack(tag, requeue=requeue)
+            return True
+        except pika.exceptions.AMQPConnectionError:
+            # Unacknowledged messages are requeued by broker on connection loss
+            self._connection_lost('rejecting message')
+            return False
+
+    def flush_acks(self, out_of_order: bool = False) -> bool:
+        """
+        Sends acknowledgement for all processed messages that are not
+        acknowledged yet.
+
+        :param out_of_order: also acknowledge one by one processed messages
+            that follow ones still in progress
+        :return: acknowledgement status
+        """
+        try:
+            if self._ack_pending:
+                self._channel.basic_ack(self._ack_tag, multiple=True)
+                self._ack_pending = 0
+            if out_of_order:
+                for tag, done in list(self._unacked.items()):
+                    if done:
+                        self._channel.basic_ack(tag)
+                        del self._unacked[tag]
+            return True
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('acknowledging messages')
+            return False
+
+    def _advance_acks(self):
+        for tag, done in list(self._unacked.items()):
+            if not done:
+                break
+            del self._unacked[tag]
+            self._ack_tag = tag
+            self._ack_pending += 1
+
+    def _reset_acks(self):
+        # Delivery tags are scoped by channel
+        self._deliveries.clear()
+        self._unacked.clear()
+        self._ack_tag = 0
+        self._ack_pending = 0
+
+    def queue_depth(self, queue: str = None) -> Optional[int]:
+        """
+        Returns number of messages that are ready for delivery in the queue.
+
+        :param queue: queue name, input queue if not specified
+        :return: messages count or None if broker is not reachable
+        """
+        if not self._reconnect():
+            return None
+        try:
+            # Broker closes channel if queue does not exist yet, so consuming channel is not used
+            channel = self._connection.channel()
+            try:
+                # Passive declaration does not depend on queue arguments
+                frame = channel.queue_declare(queue=queue if queue else self.queue, passive=True)
+            finally:
+                if channel.is_open:
+                    channel.close()
+            return frame.method.message_count
+        except pika.exceptions.ChannelClosedByBroker:
+            # Queue does not exist yet
+            return 0
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('measuring queue depth')
+            return None
+
+    def call_threadsafe(self, callback: Callable):
+        """
+        Schedules callback execution in the thread that operates connection.
+        Callback is called during next events processing.
+
+        :param callback: function without arguments
+        """
+        connection = self._connection
+        if connection is None:
+            raise AMQPConnectionError(f'Connection to {self.host} is lost')
+        connection.add_callback_threadsafe(callback)
+
+    def process_events(self, time_limit: Union[int, float, None] = 0):
+        """
+        Processes connection events and scheduled callbacks.
+
+        :param time_limit: processing time limit
+        """
+        if self._connection is None:
+            return
+        try:
+            self._connection.process_data_events(time_limit=time_limit)
+        except pika.exceptions.AMQPConnectionError:
+            self._connection_lost('processing events')
+
     def close(self):
-        if self._connection is not None and not self._connection.is_closed:
-            self._connection.close()
+        if self._connection is not None and self._connection.is_open:
+            self.flush_acks(out_of_order=True)
+            # Shared connection stays open for other brokers, while
+            # unacknowledged messages of closed channel are requeued
+            for channel in (self._channel, self._confirm_channel):
+                if channel is not None and channel.is_open:
+                    channel.close()
+        self._release_connection()
         self.is_connected = False
@@ -0,0 +1,154 @@
+import abc
+import json
+from typing import List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'json'
+ORJSON = 'orjson'
+MSGPACK = 'msgpack'
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+
+class Codec:
+    """
+    Base wire format of messages
+    """
+    name = ''
+    content_type = ''
+    available = True
+
+    @abc.abstractmethod
+    def encode(self, message) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def decode(self, data: bytes):
+        ...
+
+    def __str__(self):
+        return f'Codec({self.name})'
+
+
+class JsonCodec(Codec):
+    """
+    Compact JSON encoded with standard library
+    """
+    name = JSON
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, message) -> bytes:
+        return json.dumps(message, separators=(',', ':')).encode()
+
+    def decode(self, data: bytes):
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """
+    JSON encoded with orjson backend. Output is compatible with JsonCodec.
+    """
+    name = ORJSON
+    content_type = JSON_CONTENT_TYPE
+    available = orjson is not None
+
+    def encode(self, message) -> bytes:
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data: bytes):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    Binary MessagePack encoding
+    """
+    name = MSGPACK
+    content_type = MSGPACK_CONTENT_TYPE
+    available = msgpack is not None
+
+    def encode(self, message) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data: bytes):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS = {codec.name: codec() for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+# JSON leading bytes, MessagePack maps and arrays never start with them
+JSON_LEADING_BYTES = b'{["'
+
+
+def available_codecs() -> List[str]:
+    """
+    Lists codecs which backends are installed.
+
+    :return: codec names
+    """
+    return [name for name, codec in CODECS.items() if codec.available]
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Returns codec by its name.
+
+    :param name: codec name
+    :return: codec instance
+    """
+    if name not in CODECS:
+        raise ValueError(f'Unknown codec "{name}". Expected one of: {list(CODECS)}')
+    codec = CODECS[name]
+    if not codec.available:
+        raise ImportError(f'Backend for codec "{name}" is not installed')
+    return codec
+
+
+def codec_for_content_type(content_type: str) -> Codec:
+    """
+    Returns codec that decodes messages of specified content type.
+    Messages without content type are treated as JSON.
+
+    :param content_type: AMQP message content type
+    :return: codec instance
+    """
+    if content_type == MSGPACK_CONTENT_TYPE:
+        return get_codec(MSGPACK)
+    if content_type in (JSON_CONTENT_TYPE, None, ''):
+        return CODECS[ORJSON] if CODECS[ORJSON].available else CODECS[JSON]
+    raise ValueError(f'Unsupported content type "{content_type}"')
+
+
+def detect_codec(data: bytes) -> Codec:
+    """
+    Detects codec of raw message that is received without content type.
+
+    :param data: encoded message
+    :return: codec instance
+    """
+    if data[:1] and data[:1] in JSON_LEADING_BYTES:
+        return codec_for_content_type(JSON_CONTENT_TYPE)
+    return get_codec(MSGPACK)
+
+
+def negotiate_codec(preferred: str, supported: List[str]) -> str:
+    """
+    Selects codec for the peer according to list of codecs it supports.
+    Falls back to JSON, since it is always available.
+
+    :param preferred: codec configured for deployment
+    :param supported: codec names available on the peer
+    :return: codec name
+    """
+    if preferred in supported and CODECS[preferred].available:
+        return preferred
+    return JSON
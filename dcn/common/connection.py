@@ -1,12 +1,16 @@
 import abc
+import asyncio
 import logging
 import socket
+from threading import Event, Thread
 from typing import Union, Callable
 
 import zmq
+import zmq.asyncio
 
+from dcn.common.codec import detect_codec, get_codec
 from dcn.common.constants import SECOND
-from dcn.common.defaults import DISPATCHER_PORT
+from dcn.common.defaults import CODEC, DISPATCHER_PORT, DISPATCHER_WORKERS
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +25,10 @@ class Connection:
     Base connection class
     """
     port = DISPATCHER_PORT
+    context_class = zmq.Context
 
     def __init__(self, ip: str, port: Union[int, str, None]):
-        self.context = zmq.Context()
+        self.context = self.context_class()
         self.ip = ip
         self.port = str(port) if port else Connection._get_free_port()
         self.socket = None
@@ -72,9 +77,11 @@ class RequestConnection(Connection):
     """
     def __init__(self,
                  ip: str = 'localhost',
-                 port: Union[int, str] = ''):
+                 port: Union[int, str] = '',
+                 codec: str = CODEC):
         super(RequestConnection, self).__init__(ip, port)
         self.socket = self.context.socket(zmq.REQ)
+        self.codec = get_codec(codec)
 
     def establish(self):
         """
@@ -90,7 +97,7 @@ class RequestConnection(Connection):
 
         :param message: request payload
         """
-        self.socket.send_json(message)
+        self.socket.send(self.codec.encode(message))
 
     def _in(self, timeout: int) -> dict:
         """
@@ -100,7 +107,8 @@ class RequestConnection(Connection):
         :return: reply from remote host
         """
         if self.socket.poll(timeout * 1000):  # milliseconds
-            return self.socket.recv_json()
+            data = self.socket.recv()
+            return detect_codec(data).decode(data)
         else:
             return {}
 
@@ -149,14 +157,16 @@ class ReplyConnection(Connection):
         """
         Performs incoming requests listening, calls request handler with
         request as an argument and replies with result.
+        Reply is encoded with the same codec as request.
 
         :param request_handler: Requests handling callback
         :param timeout: listening poll period
         :return: True if there was incoming request during poll period
         """
         if self.socket.poll(timeout * 1000):
-            request = self.socket.recv_json()
-            self.socket.send_json(request_handler(request))
+            data = self.socket.recv()
+            codec = detect_codec(data)
+            self.socket.send(codec.encode(request_handler(codec.decode(data))))
             return True
         else:
             return False
@@ -167,3 +177,173 @@ class ReplyConnection(Connection):
 
     def __str__(self):
         return f'ReplyConnection({self.ip}:{self.port})'
+
+
+class RouterConnection(Connection):
+    """
+    Socket for incoming requests listening that serves requests of many
+    peers concurrently. Requests are forwarded from ROUTER socket to worker
+    threads via in-process DEALER socket and replies are routed back to
+    their peers, so RequestConnection peers are served the same way as by
+    ReplyConnection.
+    """
+    # Period of worker threads stop request check
+    WORKER_POLL_PERIOD = 0.1 * SECOND
+
+    def __init__(self,
+                 ip: str = '*',
+                 port: Union[int, str] = '',
+                 workers: int = DISPATCHER_WORKERS):
+        super(RouterConnection, self).__init__(ip, port)
+        self.workers = workers
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.backend = self.context.socket(zmq.DEALER)
+        self.backend_address = f'inproc://workers-{id(self)}'
+        self.poller = zmq.Poller()
+        self._request_handler = None
+        self._threads = []
+        self._stop = Event()
+
+    def __exit__(self, *exc_info):
+        self.close()
+        self.context.term()
+
+    def establish(self):
+        """
+        Bind socket on host for listening and in-process socket for workers
+        """
+        address = f'tcp://{self.ip}:{self.port}'
+        logger.info(f'Binding port for listening: {address}')
+        self.socket.bind(address)
+        self.backend.bind(self.backend_address)
+        self.poller.register(self.socket, zmq.POLLIN)
+        self.poller.register(self.backend, zmq.POLLIN)
+
+    def listen(self,
+               request_handler: Callable,
+               timeout: int = 30 * SECOND) -> bool:
+        """
+        Forwards incoming requests to workers and their replies back to peers.
+        Request handler is called by worker threads, so it should be thread safe.
+
+        :param request_handler: Requests handling callback
+        :param timeout: listening poll period
+        :return: True if there was incoming request during poll period
+        """
+        self._request_handler = request_handler
+        if not self._threads:
+            self._start_workers()
+        events = dict(self.poller.poll(timeout * 1000))
+        if self.backend in events:
+            self.socket.send_multipart(self.backend.recv_multipart())
+        if self.socket in events:
+            # Peer identity and envelope delimiter are kept for reply routing
+            self.backend.send_multipart(self.socket.recv_multipart())
+            return True
+        return False
+
+    def _start_workers(self):
+        for i in range(self.workers):
+            thread = Thread(target=self._serve, name=f'{self}-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _serve(self):
+        # Called from worker thread
+        socket = self.context.socket(zmq.REP)
+        socket.connect(self.backend_address)
+        try:
+            while not self._stop.is_set():
+                if socket.poll(self.WORKER_POLL_PERIOD * 1000):
+                    data = socket.recv()
+                    codec = detect_codec(data)
+                    socket.send(codec.encode(self._handle(codec.decode(data))))
+        finally:
+            socket.close()
+
+    def _handle(self, request: dict) -> dict:
+        try:
+            return self._request_handler(request)
+        except Exception:
+            # Peer waits for reply, so failure is reported instead of worker crash
+            logger.exception(f'Request handling has failed: {request}')
+            request['result'] = False
+            return request
+
+    def close(self):
+        logger.info(f'Closing {self}')
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        self.backend.close()
+        self.socket.close()
+
+    def __str__(self):
+        return f'RouterConnection({self.ip}:{self.port})'
+
+
+class AsyncRequestConnection(RequestConnection):
+    """
+    Outgoing requests socket for asyncio applications.
+    """
+    context_class = zmq.asyncio.Context
+
+    def __init__(self,
+                 ip: str = 'localhost',
+                 port: Union[int, str] = '',
+                 codec: str = CODEC):
+        super(AsyncRequestConnection, self).__init__(ip, port, codec)
+        # Request socket requires strict send/receive alternation.
+        # Lock is created in running event loop.
+        self._lock = None
+
+    async def send(self, message: dict, timeout: int = 30 * SECOND) -> dict:
+        """
+        Sends request(message) via established connection and returns its reply.
+
+        :param message: request payload
+        :param timeout: timeout for message transmission
+        :return: reply from remote host
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self.socket.send(self.codec.encode(message))
+            if await self.socket.poll(timeout * 1000):  # milliseconds
+                data = await self.socket.recv()
+                return detect_codec(data).decode(data)
+            else:
+                return {}
+
+    def __str__(self):
+        return f'AsyncRequestConnection({self.ip}:{self.port})'
+
+
+class AsyncReplyConnection(ReplyConnection):
+    """
+    Socket for incoming requests listening in asyncio applications
+    """
+    context_class = zmq.asyncio.Context
+
+    async def listen(self,
+                     request_handler: Callable,
+                     timeout: int = 30 * SECOND) -> bool:
+        """
+        Performs incoming requests listening, calls request handler with
+        request as an argument and replies with result.
+
+        :param request_handler: Requests handling callback
+        :param timeout: listening poll period
+        :return: True if there was incoming request during poll period
+        """
+        if await self.socket.poll(timeout * 1000):
+            data = await self.socket.recv()
+            codec = detect_codec(data)
+            await self.socket.send(codec.encode(request_handler(codec.decode(data))))
+            return True
+        else:
+            return False
+
+    def __str__(self):
+        return f'AsyncReplyConnection({self.ip}:{self.port})'
@@ -1,5 +1,3 @@
-from copy import deepcopy
-
 from dcn.common.constants import EXCHANGE, QUEUE
 from dcn.common.defaults import EXCHANGE_NAME
 
@@ -10,9 +8,7 @@ queue_template = {
 
 
 def compose_queue(name: str):
-    queue = deepcopy(queue_template)
-    queue[QUEUE] = name
-    return queue
+    return {EXCHANGE: EXCHANGE_NAME, QUEUE: name}
 
 
 task_body = {
@@ -20,10 +16,25 @@ task_body = {
     'client': compose_queue('flush'),
     'module': 'builtin',
     'function': 'relay',
-    'arguments': None
+    'arguments': None,
+    'priority': 0
 }
 
 
+def compose_task(task_id: int, client, module: str, function: str, arguments=None, priority: int = 0) -> dict:
+    """
+    Creates new task with task_body content.
+    """
+    return {
+        'id': task_id,
+        'client': client,
+        'module': module,
+        'function': function,
+        'arguments': arguments,
+        'priority': priority
+    }
+
+
 task_report = {
     'id': 0,
     'client': compose_queue('flush'),
@@ -31,3 +42,63 @@ task_report = {
     'status': False,
     'resolution': 'Unhandled error',
 }
+
+
+def compose_report(task_id: int = 0, client=None) -> dict:
+    """
+    Creates new report with task_report content.
+    """
+    return {
+        'id': task_id,
+        'client': client if client is not None else compose_queue('flush'),
+        'result': '',
+        'status': False,
+        'resolution': 'Unhandled error',
+    }
+
+
+def compose_chunk(report: dict, sequence: int, result, last: bool = False) -> dict:
+    """
+    Creates message with part of streamed task result.
+    Last chunk carries no result and completes the stream with its sequence
+    equal to the number of preceding chunks.
+    """
+    return {
+        'id': report['id'],
+        'client': report['client'],
+        'chunk': sequence,
+        'last': last,
+        'result': result,
+        'status': report['status'],
+        'resolution': report['resolution'],
+    }
+
+
+def compose_batch(batch_id: int, client, tasks: list, priority: int = 0) -> dict:
+    """
+    Creates message that carries several tasks of the same client.
+    Tasks are executed one by one and reported with a single batch report.
+    """
+    return {
+        'id': batch_id,
+        'client': client,
+        'batch': tasks,
+        'priority': priority
+    }
+
+
+def compose_batch_report(batch: dict, reports: list) -> dict:
+    """
+    Creates message with reports of all tasks from the batch.
+    """
+    return {
+        'id': batch['id'],
+        'client': batch['client'],
+        'batch': reports,
+        'status': True,
+        'resolution': '',
+    }
+
+
+def is_batch(message: dict) -> bool:
+    return 'batch' in message
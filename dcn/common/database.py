@@ -1,4 +1,19 @@
+import abc
+import json
+import logging
+import sqlite3
+from copy import deepcopy
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple, Union
 
+from dcn.common.cache import TTLCache
+from dcn.common.defaults import DB_CACHE_SIZE, DB_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+AGENTS = 'agents'
+CLIENTS = 'clients'
 
 FAKE_DB = {
     'agents': {
@@ -20,12 +35,209 @@ FAKE_DB = {
 }
 
 
-class Database:
-    def __init__(self):
+class DatabaseBackend:
+    """
+    Storage of token parameters and dispatcher state
+    """
+    @abc.abstractmethod
+    def get_params(self, kind: str, token: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    def set_params(self, kind: str, token: str, params: dict):
+        ...
+
+    @abc.abstractmethod
+    def save_agent(self, agent_id: int, name: str, token: str):
+        ...
+
+    @abc.abstractmethod
+    def delete_agent(self, agent_id: int):
+        ...
+
+    @abc.abstractmethod
+    def load_agents(self) -> List[Tuple[int, str, str]]:
+        ...
+
+    @abc.abstractmethod
+    def get_state(self, key: str) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    def set_state(self, key: str, value: str):
+        ...
+
+    def close(self):
         pass
 
-    def get_client_param(token: str):
-        return FAKE_DB['clients'].get(token)
 
-    def get_agent_param(token: str):
-        return FAKE_DB['agents'].get(token)
+class MemoryBackend(DatabaseBackend):
+    """
+    Non persistent storage. Token parameters are taken from FAKE_DB by default.
+    """
+    def __init__(self, params: dict = None):
+        self._params = deepcopy(FAKE_DB if params is None else params)
+        self._agents: Dict[int, Tuple[int, str, str]] = {}
+        self._state: Dict[str, str] = {}
+
+    def get_params(self, kind: str, token: str) -> Optional[dict]:
+        return self._params.get(kind, {}).get(token)
+
+    def set_params(self, kind: str, token: str, params: dict):
+        self._params.setdefault(kind, {})[token] = params
+
+    def save_agent(self, agent_id: int, name: str, token: str):
+        self._agents[agent_id] = (agent_id, name, token)
+
+    def delete_agent(self, agent_id: int):
+        self._agents.pop(agent_id, None)
+
+    def load_agents(self) -> List[Tuple[int, str, str]]:
+        return list(self._agents.values())
+
+    def get_state(self, key: str) -> Optional[str]:
+        return self._state.get(key)
+
+    def set_state(self, key: str, value: str):
+        self._state[key] = value
+
+
+class SQLiteBackend(DatabaseBackend):
+    """
+    Persistent storage in SQLite file. Single connection is reused by all
+    threads and journal is written ahead, so readers are not blocked by writes.
+    """
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS params ('
+        'kind TEXT NOT NULL, token TEXT NOT NULL, params TEXT NOT NULL, PRIMARY KEY (kind, token))',
+        'CREATE TABLE IF NOT EXISTS agents ('
+        'id INTEGER PRIMARY KEY, name TEXT NOT NULL, token TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    )
+    # Statements are constant, so they are prepared once by connection statement cache
+    GET_PARAMS = 'SELECT params FROM params WHERE kind = ? AND token = ?'
+    SET_PARAMS = 'INSERT OR REPLACE INTO params (kind, token, params) VALUES (?, ?, ?)'
+    ADD_PARAMS = 'INSERT OR IGNORE INTO params (kind, token, params) VALUES (?, ?, ?)'
+    SAVE_AGENT = 'INSERT OR REPLACE INTO agents (id, name, token) VALUES (?, ?, ?)'
+    DELETE_AGENT = 'DELETE FROM agents WHERE id = ?'
+    LOAD_AGENTS = 'SELECT id, name, token FROM agents ORDER BY id'
+    GET_STATE = 'SELECT value FROM state WHERE key = ?'
+    SET_STATE = 'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)'
+
+    def __init__(self,
+                 path: Union[str, Path],
+                 params: dict = None):
+        """
+        :param path: database file
+        :param params: token parameters that are added if missing,
+            structured as FAKE_DB
+        """
+        self.path = Path(path)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self._connection.execute(statement)
+        if params:
+            with self._lock, self._connection:
+                self._connection.executemany(self.ADD_PARAMS, [
+                    (kind, token, json.dumps(token_params))
+                    for kind, tokens in params.items()
+                    for token, token_params in tokens.items()
+                ])
+
+    def _fetch_value(self, statement: str, *parameters):
+        with self._lock:
+            row = self._connection.execute(statement, parameters).fetchone()
+        return row[0] if row else None
+
+    def _execute(self, statement: str, *parameters):
+        with self._lock:
+            self._connection.execute(statement, parameters)
+
+    def get_params(self, kind: str, token: str) -> Optional[dict]:
+        params = self._fetch_value(self.GET_PARAMS, kind, token)
+        return json.loads(params) if params is not None else None
+
+    def set_params(self, kind: str, token: str, params: dict):
+        self._execute(self.SET_PARAMS, kind, token, json.dumps(params))
+
+    def save_agent(self, agent_id: int, name: str, token: str):
+        self._execute(self.SAVE_AGENT, agent_id, name, token)
+
+    def delete_agent(self, agent_id: int):
+        self._execute(self.DELETE_AGENT, agent_id)
+
+    def load_agents(self) -> List[Tuple[int, str, str]]:
+        with self._lock:
+            return self._connection.execute(self.LOAD_AGENTS).fetchall()
+
+    def get_state(self, key: str) -> Optional[str]:
+        return self._fetch_value(self.GET_STATE, key)
+
+    def set_state(self, key: str, value: str):
+        self._execute(self.SET_STATE, key, value)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class Database:
+    """
+    Dispatcher storage access. Token parameters are read through
+    the cache, so repeated lookups do not reach the backend.
+    """
+    def __init__(self,
+                 backend: DatabaseBackend = None,
+                 cache_size: int = DB_CACHE_SIZE,
+                 cache_ttl: Union[int, float, None] = DB_CACHE_TTL):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    def _get_params(self, kind: str, token: str) -> Optional[dict]:
+        key = (kind, token)
+        params = self.cache.get(key, key)
+        if params is key:
+            # Unknown tokens are cached as well
+            params = self.backend.get_params(kind, token)
+            self.cache.set(key, params)
+        return params
+
+    def _set_params(self, kind: str, token: str, params: dict):
+        self.backend.set_params(kind, token, params)
+        self.cache.pop((kind, token))
+
+    def get_client_param(self, token: str) -> Optional[dict]:
+        return self._get_params(CLIENTS, token)
+
+    def get_agent_param(self, token: str) -> Optional[dict]:
+        return self._get_params(AGENTS, token)
+
+    def set_client_param(self, token: str, params: dict):
+        self._set_params(CLIENTS, token, params)
+
+    def set_agent_param(self, token: str, params: dict):
+        self._set_params(AGENTS, token, params)
+
+    def save_agent(self, agent_id: int, name: str, token: str):
+        self.backend.save_agent(agent_id, name, token)
+
+    def delete_agent(self, agent_id: int):
+        self.backend.delete_agent(agent_id)
+
+    def load_agents(self) -> List[Tuple[int, str, str]]:
+        """
+        :return: id, name and token of each saved agent
+        """
+        return self.backend.load_agents()
+
+    def get_state(self, key: str) -> Optional[str]:
+        return self.backend.get_state(key)
+
+    def set_state(self, key: str, value: str):
+        self.backend.set_state(key, value)
+
+    def close(self):
+        self.backend.close()
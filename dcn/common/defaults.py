@@ -4,15 +4,32 @@ from dcn.common.constants import SECOND
 # connection
 CONNECTION_RETRY_COUNT = 10
 RECONNECT_DELAY = 5 * SECOND
+# Reconnection delay limit grows exponentially from base to max
+RECONNECT_BASE_DELAY = 0.5 * SECOND
+RECONNECT_MAX_DELAY = 30 * SECOND
+# consuming
+PREFETCH_COUNT = 10
+INACTIVITY_TIMEOUT = 1 * SECOND
+# Priority levels of declared queues, 0 disables priorities.
+# Queue should be deleted on broker to change its priority levels.
+MAX_PRIORITY = 0
+# publishing
+CODEC = 'json'
+PUBLISH_CONFIRM_TIMEOUT = 30 * SECOND
 # exchange
 EXCHANGE_NAME = 'DCN'
 EXCHANGE_TYPE = 'direct'
+# Commands are broadcast to every agent queue bound to control exchange
+CONTROL_EXCHANGE_NAME = 'DCN.control'
+CONTROL_EXCHANGE_TYPE = 'fanout'
 
 
 # routing
 class RoutingKeys:
     AGENT_LITE = 'lite'
     AGENT_ON_BE = 'backend'
+    # Prefix of agent queues bound to control exchange
+    CONTROL = 'control'
     DISPATCHER = 'dispatcher'
     RESULTS = 'results'
     TASK = 'task'
@@ -20,6 +37,47 @@ class RoutingKeys:
     ALL_QUEUES = [AGENT_LITE, AGENT_ON_BE, DISPATCHER, RESULTS, TASK]
 
 
+# payload
+BLOB_THRESHOLD = 1024 * 1024  # bytes
+
+
+# METRICS
+METRICS_ENABLED = False
+# Upper bounds of duration histogram buckets
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+# AGENT
+PULSE_PERIOD = 10 * SECOND
+AGENT_WORKERS = 1
+# Agent is removed from dispatcher if it has not pulsed during this period
+AGENT_EXPIRY = 3 * PULSE_PERIOD
+AGENT_EXECUTOR = 'thread'
+# Cached results of pure task functions
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 60 * 60 * SECOND
+
+
+# CLIENT
+# Tasks packed into a single message, 1 disables batching
+BATCH_SIZE = 1
+# Time that incomplete batch waits for more tasks before it is published
+BATCH_LINGER = 0.01 * SECOND
+
+
 # DISPATCHER
+# Share of agents capacity for client tasks under fair scheduling
+CLIENT_WEIGHT = 1
 DISPATCHER_PORT = 9999
 INIT_AGENT_ID = 1001
+# Threads that handle requests concurrently, single one keeps REQ/REP lockstep.
+# Router workers add a hop per request, so they pay off only for slow handlers
+DISPATCHER_WORKERS = 1
+# Token parameters lookup cache
+DB_CACHE_SIZE = 1024
+DB_CACHE_TTL = 60 * SECOND
+# Task queue shards assignment
+SHARD_STRATEGY = 'hash'
+SHARD_VIRTUAL_NODES = 64
+# Agents moved between shards per rebalance round
+REBALANCE_MOVES = 4
@@ -1,23 +1,42 @@
+import atexit
 import logging
 import datetime
 
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from queue import SimpleQueue
+from typing import List
 
 default_log_folder = Path('/tmp/dcn/log.txt')
 default_log_folder.parent.mkdir(parents=True, exist_ok=True)
 formatter = logging.Formatter('%(asctime)s-%(name)s:%(lineno)d-'
                               '%(levelname)s-%(message)s')
+# Listeners that write records of asynchronous module loggers
+_listeners: List[QueueListener] = []
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queues records without formatting, so message is formatted by listener
+    thread. Queue is not shared with other processes, so records are not
+    pickled. Logged arguments should not be modified after logging call.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
 
 def setup_module_logger(module_name: str,
                         level: int,
-                        file_pah: Path = default_log_folder):
+                        file_pah: Path = default_log_folder,
+                        asynchronous: bool = False):
     """
     Starts logging collection for specified module.
 
     :param module_name: Logged module name
     :param level: module logging detailization
     :param file_pah: location for module logging
+    :param asynchronous: records are only queued by logging thread and
+        formatted and written by listener thread
     """
     logger = logging.getLogger(module_name)
     logger.setLevel(level)
@@ -28,12 +47,29 @@ def setup_module_logger(module_name: str,
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    if asynchronous:
+        queue = SimpleQueue()
+        listener = QueueListener(queue, file_handler, stream_handler, respect_handler_level=True)
+        listener.start()
+        if not _listeners:
+            atexit.register(stop_logging)
+        _listeners.append(listener)
+        logger.addHandler(DeferredQueueHandler(queue))
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(stream_handler)
 
     logger.info(f'Logger for {module_name} is started with level {level}')
 
 
+def stop_logging():
+    """
+    Writes queued records of asynchronous module loggers and stops their listeners.
+    """
+    while _listeners:
+        _listeners.pop().stop()
+
+
 def get_datetime_stamp(for_filename=True):
     stamp = datetime.datetime.now().isoformat()
     if for_filename:
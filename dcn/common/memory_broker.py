@@ -0,0 +1,323 @@
+import logging
+from collections import deque
+from itertools import count
+from threading import Condition, Lock
+from time import monotonic, time
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Set, Tuple, Union
+
+from dcn.common.broker import SETTLED, BrokerBase
+from dcn.common.constants import BROKER
+from dcn.common.defaults import PUBLISH_CONFIRM_TIMEOUT
+from dcn.common.metrics import metrics
+from dcn.common.scheduling import WeightedRoundRobin
+
+logger = logging.getLogger(BROKER)
+
+FANOUT = 'fanout'
+
+
+# Message with its correlation id, priority and publishing time if metrics are enabled
+Delivery = Tuple[dict, Optional[str], Optional[int], Optional[float]]
+
+
+class MemoryQueue:
+    """
+    Queue of deliveries. Messages of higher priority are delivered first
+    if queue is declared with priorities.
+    """
+    def __init__(self, max_priority: int = 0):
+        self.max_priority = max_priority
+        self._levels: Dict[int, deque] = {}
+
+    def put(self, delivery: Delivery, front: bool = False):
+        level = min(delivery[2] or 0, self.max_priority)
+        messages = self._levels.setdefault(level, deque())
+        if front:
+            messages.appendleft(delivery)
+        else:
+            messages.append(delivery)
+
+    def get(self) -> Optional[Delivery]:
+        for level in sorted(self._levels, reverse=True):
+            if self._levels[level]:
+                return self._levels[level].popleft()
+        return None
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._levels.values())
+
+
+class MemoryHost:
+    """
+    Exchanges and queues of single virtual broker host. Every operation is
+    done under host condition, so waiting consumers are woken on changes.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.condition = Condition()
+        self.exchanges: Dict[str, Tuple[str, Dict[str, Set[str]]]] = {}  # name: (type, {routing key: queues})
+        self.queues: Dict[str, MemoryQueue] = {}
+
+    def declare_exchange(self, exchange: str, exchange_type: str):
+        with self.condition:
+            self.exchanges.setdefault(exchange, (exchange_type, {}))
+
+    def declare_queue(self, queue: str, exchange: str, routing_key: str, max_priority: int = 0):
+        with self.condition:
+            # Queue arguments are fixed on declaration as in RabbitMQ
+            self.queues.setdefault(queue, MemoryQueue(max_priority))
+            _, bindings = self.exchanges[exchange]
+            bindings.setdefault(routing_key, set()).add(queue)
+
+    def route(self, exchange: str, routing_key: str) -> List[str]:
+        if exchange not in self.exchanges:
+            return []
+        exchange_type, bindings = self.exchanges[exchange]
+        if exchange_type == FANOUT:
+            return list(set().union(*bindings.values()))
+        return list(bindings.get(routing_key, ()))
+
+    def publish(self, exchange: str, routing_key: str, delivery: Delivery):
+        with self.condition:
+            queues = self.route(exchange, routing_key)
+            if not queues:
+                logger.debug('Message to %s:%s is not routed to any queue', exchange, routing_key)
+            for queue in queues:
+                self.queues[queue].put(delivery)
+            self.condition.notify_all()
+
+    def delete_queue(self, queue: str):
+        with self.condition:
+            self.queues.pop(queue, None)
+            for _, bindings in self.exchanges.values():
+                for queues in bindings.values():
+                    queues.discard(queue)
+
+    def requeue(self, queue: str, delivery: Delivery):
+        with self.condition:
+            if queue in self.queues:
+                self.queues[queue].put(delivery, front=True)
+                self.condition.notify_all()
+
+
+_hosts: Dict[str, MemoryHost] = {}
+_hosts_lock = Lock()
+
+
+def get_host(name: str) -> MemoryHost:
+    """
+    Returns process wide virtual host, brokers with the same host share queues.
+    """
+    with _hosts_lock:
+        if name not in _hosts:
+            _hosts[name] = MemoryHost(name)
+        return _hosts[name]
+
+
+def reset_hosts():
+    """
+    Drops all virtual hosts with their queues and messages.
+    """
+    with _hosts_lock:
+        _hosts.clear()
+
+
+class MemoryBroker(BrokerBase):
+    """
+    In-process transport with RabbitMQ exchange, routing key and queue
+    semantics. Messages are passed between threads as objects without
+    encoding, so they should not be modified after they are published.
+    Every delivery yields own shallow copy of message, so message published
+    twice is settled per delivery. Unacknowledged messages are returned to
+    their queues on close.
+    """
+    def __init__(self, *args, **kwargs):
+        super(MemoryBroker, self).__init__(*args, **kwargs)
+        self._host: Optional[MemoryHost] = None
+        self._delivery_tags = count(1)
+        self._deliveries: Dict[int, int] = {}  # id(message): delivery tag
+        # delivery tag: (queue, delivery, yielded message), message is kept, so its id is not reused
+        self._unacked: Dict[int, Tuple[str, Delivery, dict]] = {}
+        self._callbacks: deque = deque()
+
+    def _open(self) -> bool:
+        self._host = get_host(self.host)
+        self.is_connected = True
+        return True
+
+    def declare(self) -> bool:
+        self._host.declare_exchange(self.exchange, self.exchange_type)
+        for exchange, exchange_type in self.output_exchanges.items():
+            self._host.declare_exchange(exchange, exchange_type)
+        if self.queue:
+            self._host.declare_queue(self.queue, self.exchange, self.routing_key, self.max_priority)
+        for queue in self._extra_queues():
+            self._host.declare_queue(queue, self.exchange, queue, self.max_priority)
+        return True
+
+    def publish(self,
+                message: dict,
+                routing_key: str = None,
+                exchange: str = None,
+                correlation_id: str = None,
+                priority: int = None) -> bool:
+        if not self.is_connected:
+            return False
+        logger.debug('sending: %s', message)
+        started = monotonic() if metrics.enabled else 0
+        self._host.publish(exchange if exchange else self.exchange,
+                           routing_key if routing_key else self.output_routing_key,
+                           (message, correlation_id, priority, time() if started else None))
+        if started:
+            self._observe_publish('publish', started)
+        return True
+
+    def publish_many(self,
+                     messages: Iterable[dict],
+                     routing_key: str = None,
+                     timeout: Union[int, float] = PUBLISH_CONFIRM_TIMEOUT,
+                     correlation_ids: Iterable[str] = None,
+                     priority: int = None) -> List[bool]:
+        """
+        Publishes batch of messages. Messages are accepted once they are
+        placed to queues, so no confirmation is awaited.
+        """
+        correlation_ids = iter(correlation_ids) if correlation_ids is not None else None
+        return [self.publish(message, routing_key,
+                             correlation_id=next(correlation_ids) if correlation_ids else None,
+                             priority=priority)
+                for message in messages]
+
+    def consume(self) -> Tuple[bool, dict]:
+        if not self.is_connected:
+            return False, {}
+        with self._host.condition:
+            messages = self._host.queues.get(self.queue)
+            delivery = messages.get() if messages is not None else None
+        return True, delivery[0] if delivery else {}
+
+    def pulling_generator(self) -> Generator[dict, None, None]:
+        """
+        Streams messages from input queues, weighted queues are consumed
+        by weighted round robin. Up to prefetch_count yielded messages may
+        stay unacknowledged. Generator is exhausted once no message arrives
+        during inactivity timeout.
+        Every yielded message stays unacknowledged until it is passed to
+        set_task_done or set_task_failed.
+
+        :return: generator of received messages
+        """
+        weights = self.queue_weights if self.queue_weights else {self.queue: 1}
+        scheduler = WeightedRoundRobin(weights)
+        queues = self._host.queues
+        last_delivery = monotonic()
+        while self.is_connected:
+            self._run_callbacks()
+            with self._host.condition:
+                if len(self._unacked) < self.prefetch_count:
+                    queue = scheduler.next(lambda key: len(queues[key]))
+                else:
+                    queue = None
+                if queue is None:
+                    if self._inactivity_timeout is None:
+                        time_limit = None
+                    else:
+                        time_limit = last_delivery + self._inactivity_timeout - monotonic()
+                        if time_limit <= 0:
+                            break
+                    if not self._callbacks:
+                        self._host.condition.wait(time_limit)
+                    continue
+                delivery = queues[queue].get()
+            message = dict(delivery[0])
+            last_delivery = monotonic()
+            logger.debug('Message received from %s: %s', queue, message)
+            tag = next(self._delivery_tags)
+            self._deliveries[id(message)] = tag
+            self._unacked[tag] = (queue, delivery, message)
+            if metrics.enabled:
+                self._observe_delivery(queue, delivery[3])
+            yield message
+
+    def correlation_id(self, message: dict) -> Optional[str]:
+        tag = self._deliveries.get(id(message))
+        return self._unacked[tag][1][1] if tag else None
+
+    def set_task_done(self, message: dict) -> bool:
+        tag = self._deliveries.pop(id(message), None)
+        if tag is None:
+            return False
+        del self._unacked[tag]
+        if metrics.enabled:
+            SETTLED.inc('done')
+        self._notify()
+        return True
+
+    def set_task_failed(self, message: dict, requeue: bool = True) -> bool:
+        tag = self._deliveries.pop(id(message), None)
+        if tag is None:
+            return False
+        queue, delivery, _ = self._unacked.pop(tag)
+        if metrics.enabled:
+            SETTLED.inc('requeued' if requeue else 'rejected')
+        if requeue:
+            self._host.requeue(queue, delivery)
+        else:
+            self._notify()
+        return True
+
+    def flush_acks(self, out_of_order: bool = False) -> bool:
+        # Messages are acknowledged immediately
+        return True
+
+    def queue_depth(self, queue: str = None) -> Optional[int]:
+        if not self.is_connected:
+            return None
+        with self._host.condition:
+            messages = self._host.queues.get(queue if queue else self.queue)
+            return len(messages) if messages is not None else 0
+
+    def call_threadsafe(self, callback: Callable):
+        """
+        Schedules callback execution in the thread that consumes messages.
+        Callback is called during next events processing.
+
+        :param callback: function without arguments
+        """
+        self._callbacks.append(callback)
+        self._notify()
+
+    def process_events(self, time_limit: Union[int, float, None] = 0):
+        """
+        Runs scheduled callbacks, waits for them up to time limit if
+        there are none yet.
+
+        :param time_limit: processing time limit
+        """
+        if not self._callbacks and time_limit != 0 and self._host is not None:
+            with self._host.condition:
+                if not self._callbacks:
+                    self._host.condition.wait(time_limit)
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        while self._callbacks:
+            self._callbacks.popleft()()
+
+    def _notify(self):
+        if self._host is not None:
+            with self._host.condition:
+                self._host.condition.notify_all()
+
+    def close(self):
+        if self.is_connected:
+            self._run_callbacks()
+            # Unacknowledged messages are redelivered as on connection loss
+            # Messages are put in front of queues, so they keep delivery order
+            for queue, delivery, _ in reversed(list(self._unacked.values())):
+                self._host.requeue(queue, delivery)
+            if self.exclusive and self.queue:
+                self._host.delete_queue(self.queue)
+        self._deliveries.clear()
+        self._unacked.clear()
+        self.is_connected = False
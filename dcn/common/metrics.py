@@ -0,0 +1,186 @@
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Sequence, Tuple, Union
+
+from dcn.common.defaults import METRICS_BUCKETS, METRICS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """
+    Base metric with values per label values combination.
+    """
+    kind = ''
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = Lock()
+
+    def _label_text(self, values: LabelValues, extra: str = '') -> str:
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+    def snapshot(self) -> dict:
+        ...
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value
+    """
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, value: Union[int, float] = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self) -> List[str]:
+        lines = super(Counter, self).render()
+        with self._lock:
+            lines.extend(f'{self.name}{self._label_text(values)} {value}' for values, value in self._values.items())
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(Counter):
+    """
+    Value that may go up and down
+    """
+    kind = 'gauge'
+
+    def set(self, value: Union[int, float], *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed buckets
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, List[float]] = {}  # label values: [bucket counts..., overflow count, sum]
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            # Value falls to the first bucket which upper bound is not less than value
+            values[bisect_left(self.buckets, value)] += 1
+            values[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super(Histogram, self).render()
+        with self._lock:
+            for label_values, values in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    bucket = self._label_text(label_values, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+                count = sum(values[:-1])
+                bucket = self._label_text(label_values, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{bucket} {count}')
+                lines.append(f'{self.name}_count{self._label_text(label_values)} {count}')
+                lines.append(f'{self.name}_sum{self._label_text(label_values)} {values[-1]}')
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {values: {'count': sum(counts[:-1]), 'sum': counts[-1]}
+                    for values, counts in self._values.items()}
+
+
+class MetricsRegistry:
+    """
+    Process wide collection of metrics. Metrics are declared on module
+    import, while measurements are taken only if registry is enabled,
+    so disabled instrumentation costs a single attribute check.
+    """
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = METRICS_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def render(self) -> str:
+        """
+        Returns metrics in Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        Returns current values of metrics by metric name and label values.
+        """
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def serve(self, port: int, host: str = '') -> ThreadingHTTPServer:
+        """
+        Enables metrics and serves them over HTTP in background thread.
+
+        :param port: listening port
+        :param host: listening interface, all interfaces if not specified
+        :return: server that could be stopped with shutdown
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.enabled = True
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        logger.info(f'Metrics are served on port {server.server_port}')
+        return server
+
+
+metrics = MetricsRegistry()
@@ -1,4 +1,5 @@
 class Commands:
+    Agent_commands = 'agent_commands'
     Agent_queues = 'agent_queues'
     Client_queues = 'client_queues'
     Disconnect = 'disconnect'
@@ -7,14 +8,43 @@ class Commands:
     Relay = 'relay'
 
 
+# Control message that is published to dispatcher queue on broker.
+# Commands are delivered to agents that match all specified targets:
+# listed agent ids, token and tags. All agents match empty targets.
+Agent_commands = {
+    'command': Commands.Agent_commands,
+    'commands': [],
+    'agents': [],
+    'token': '',
+    'tags': []
+}
+
+# Commands broadcast by dispatcher over control exchange. Agent applies
+# commands once, broadcast with version that is not newer than already
+# applied one is skipped.
+Agent_control = {
+    'epoch': '',
+    'version': 0,
+    'commands': [],
+    'agents': [],
+    'token': '',
+    'tags': []
+}
+
+
 Agent_queues = {
     'id': 0,
     'command': Commands.Agent_queues,
     'broker': {
         'host': '',
         'task': '',
-        'result': ''
+        'result': '',
+        'codec': '',
+        'max_priority': 0,
+        'queues': {},
+        'control': ''
     },
+    'codecs': [],
     'result': False
 }
 
@@ -25,8 +55,11 @@ Client_queues = {
     'broker': {
         'host': '',
         'task': '',
-        'result': ''
+        'result': '',
+        'codec': '',
+        'max_priority': 0
     },
+    'codecs': [],
     'result': False
 }
 
@@ -48,6 +81,7 @@ Register_agent = {
     'command': Commands.Register_agent,
     'token': 'unified',
     'name': '',
+    'tags': [],
     'broker': {
         'host': '',
         'task': '',
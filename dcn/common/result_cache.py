@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+from contextlib import suppress
+from pathlib import Path
+from threading import get_ident
+from time import time
+from typing import Any, Optional, Tuple, Union
+
+from dcn.common.cache import TTLCache
+from dcn.common.codec import JSON_CONTENT_TYPE, codec_for_content_type
+from dcn.common.defaults import RESULT_CACHE_SIZE, RESULT_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def task_key(module: str, function: str, arguments) -> Optional[str]:
+    """
+    Returns hash of task call that does not depend on arguments keys order.
+
+    :param module: task module name
+    :param function: task function name
+    :param arguments: task arguments
+    :return: call digest or None if arguments are not JSON serializable
+    """
+    try:
+        data = json.dumps([module, function, arguments], sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Results of pure task functions by task call hash. Recently used results
+    are kept in memory with least recently used eviction. If path is
+    specified, results are also stored there, so agents of the same host
+    share them, the oldest stored results are removed above cache size.
+    Results are dropped once their time to live is over.
+    """
+    def __init__(self,
+                 path: Union[str, Path, None] = None,
+                 maxsize: int = RESULT_CACHE_SIZE,
+                 ttl: Union[int, float, None] = RESULT_CACHE_TTL):
+        self.path = Path(path) if path else None
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.codec = codec_for_content_type(JSON_CONTENT_TYPE)
+        self._memory = TTLCache(maxsize, ttl)
+        self._writes = 0
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        # Worker processes get empty memory layer and share stored results only
+        state = self.__dict__.copy()
+        del state['_memory']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._memory = TTLCache(self.maxsize, self.ttl)
+
+    def _result_path(self, key: str) -> Path:
+        return self.path / key[:2] / key
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Looks up cached result.
+
+        :param key: task call hash
+        :return: lookup status and result
+        """
+        result = self._memory.get(key, _MISSING)
+        if result is not _MISSING:
+            return True, result
+        if self.path is None:
+            return False, None
+        path = self._result_path(key)
+        try:
+            if self.ttl is not None and path.stat().st_mtime + self.ttl < time():
+                path.unlink(missing_ok=True)
+                return False, None
+            result = self.codec.decode(path.read_bytes())
+        except (OSError, ValueError):
+            return False, None
+        self._memory.set(key, result)
+        return True, result
+
+    def set(self, key: str, result):
+        """
+        Caches result. Result stays in memory if it could not be stored.
+
+        :param key: task call hash
+        :param result: task result
+        """
+        self._memory.set(key, result)
+        if self.path is None:
+            return
+        try:
+            data = self.codec.encode(result)
+        except (TypeError, ValueError):
+            logger.debug('Result of %s is not stored, it is not JSON serializable', key)
+            return
+        path = self._result_path(key)
+        temp_path = path.with_name(f'{key}.{os.getpid()}.{get_ident()}.tmp')
+        try:
+            path.parent.mkdir(exist_ok=True)
+            temp_path.write_bytes(data)
+            # Readers never observe partially written result
+            os.replace(temp_path, path)
+        except OSError as error:
+            logger.warning('Result of %s is not stored: %s', key, error)
+            with suppress(OSError):
+                temp_path.unlink()
+            return
+        self._writes += 1
+        # Stored results are trimmed once per tenth of cache size writes
+        if self._writes >= max(1, self.maxsize // 10):
+            self._writes = 0
+            self.trim()
+
+    def trim(self):
+        """
+        Removes expired stored results and the oldest ones above cache size.
+        """
+        entries = []
+        for path in self.path.glob('*/*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        entries.sort(reverse=True)
+        expiration = time() - self.ttl if self.ttl is not None else None
+        for index, (modified, path) in enumerate(entries):
+            if index >= self.maxsize or (expiration is not None and modified < expiration):
+                path.unlink(missing_ok=True)
+
+    def clear(self):
+        self._memory.clear()
+        if self.path is not None:
+            for path in self.path.glob('*/*'):
+                path.unlink(missing_ok=True)
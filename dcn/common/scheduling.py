@@ -0,0 +1,34 @@
+from typing import Callable, Dict, Hashable, Optional
+
+
+class WeightedRoundRobin:
+    """
+    Smooth weighted round robin selection. Every key is selected in
+    proportion to its weight and selections of a key are interleaved with
+    other keys instead of going in a row.
+    """
+    def __init__(self, weights: Dict[Hashable, int]):
+        if any(weight <= 0 for weight in weights.values()):
+            raise ValueError(f'Weights should be positive: {weights}')
+        self.weights = dict(weights)
+        self._current = {key: 0 for key in weights}
+
+    def next(self, is_ready: Callable[[Hashable], bool] = None) -> Optional[Hashable]:
+        """
+        Selects next key.
+
+        :param is_ready: predicate that excludes keys from current selection
+        :return: selected key or None if no key is ready
+        """
+        total = 0
+        selected = None
+        for key, weight in self.weights.items():
+            if is_ready is not None and not is_ready(key):
+                continue
+            self._current[key] += weight
+            total += weight
+            if selected is None or self._current[key] > self._current[selected]:
+                selected = key
+        if selected is not None:
+            self._current[selected] -= total
+        return selected
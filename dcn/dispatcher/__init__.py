@@ -1 +1,2 @@
 from .dispatcher import Dispatcher
+from .async_dispatcher import AsyncDispatcher
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from typing import Iterable, List, Union
+
+from dcn.common.async_broker import AsyncBroker
+from dcn.common.connection import AsyncReplyConnection
+from dcn.common.constants import DISPATCHER, SECOND
+from dcn.common.defaults import CONNECTION_RETRY_COUNT, CONTROL_EXCHANGE_NAME, CONTROL_EXCHANGE_TYPE, RoutingKeys
+from dcn.dispatcher.dispatcher import Dispatcher
+
+logger = logging.getLogger(DISPATCHER)
+
+
+class AsyncDispatcher(Dispatcher):
+    """
+    Dispatcher for asyncio applications. Requests are handled by the same
+    handlers as in Dispatcher, while waiting for them does not block event loop.
+    """
+    connection_class = AsyncReplyConnection
+    broker_class = AsyncBroker
+
+    def _create_socket(self, ip: str, port: Union[int, str], workers: int):
+        # Requests are served by event loop, so worker threads are not used
+        return self.connection_class(ip, port)
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncDispatcher, self).__init__(*args, **kwargs)
+        self._loop = None
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self.socket.establish()
+        # Requests are served while broker is down, listen loop reconnects with backoff
+        await self.configure_broker(retries=1)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__()
+
+    async def configure_broker(self, retries: int = CONNECTION_RETRY_COUNT):
+        self.broker.queue = RoutingKeys.DISPATCHER
+        self.broker.routing_key = RoutingKeys.DISPATCHER
+        self.broker.output_exchanges[CONTROL_EXCHANGE_NAME] = CONTROL_EXCHANGE_TYPE
+        if await self.broker.ensure_connection(retries):
+            await self.broker.declare()
+
+    async def listen(self, polling_timeout: int = 60 * SECOND):
+        while self._listen:
+            expired = await self.socket.listen(self.request_handler, polling_timeout)
+            if self._interrupt and self._interrupt(expired):
+                break
+            if not self.broker.connected and self.broker.backoff.ready():
+                await self.broker.connect()
+            self.expire_agents()
+
+    def broadcast(self,
+                  commands: List[str],
+                  agents: Iterable[int] = (),
+                  token: str = '',
+                  tags: Iterable[str] = ()) -> int:
+        """
+        Publishes commands from event loop, could be called from any thread.
+        Commands are delivered with pulse replies if broker is not reachable.
+
+        :return: broadcast version
+        """
+        message = self._compose_control(commands, agents, token, tags)
+        if self._loop is None or self._loop.is_closed():
+            logger.warning('Event loop is not running, commands are delivered with pulses')
+            self._queue_commands(message)
+        else:
+            asyncio.run_coroutine_threadsafe(self._publish_control(message), self._loop)
+        return message['version']
+
+    async def _publish_control(self, message: dict):
+        if await self.broker.publish(message, RoutingKeys.CONTROL, CONTROL_EXCHANGE_NAME):
+            logger.info('Commands %s are broadcast with version %d', message['commands'], message['version'])
+        else:
+            self._queue_commands(message)
@@ -1,49 +1,153 @@
 import logging
+from copy import deepcopy
+from functools import partial
+from threading import Event, Lock, Thread
 from time import monotonic
-from typing import Callable, Union
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
+from uuid import uuid4
 
 from dcn.agent.agent import RemoteAgent
-from dcn.common.broker import Broker
-from dcn.common.connection import ReplyConnection
+from dcn.common.broker import Broker, BrokerBase
+from dcn.common.codec import negotiate_codec
+from dcn.common.connection import ReplyConnection, RouterConnection
 from dcn.common.constants import DISPATCHER, SECOND
 # from dcn.common.data_structures import compose_queue
-from dcn.common.defaults import EXCHANGE_NAME, INIT_AGENT_ID, RoutingKeys
-from dcn.common.request_types import Commands
+from dcn.common.defaults import AGENT_EXPIRY, CLIENT_WEIGHT, CODEC, CONNECTION_RETRY_COUNT, CONTROL_EXCHANGE_NAME, \
+    CONTROL_EXCHANGE_TYPE, DISPATCHER_WORKERS, EXCHANGE_NAME, INIT_AGENT_ID, MAX_PRIORITY, SHARD_STRATEGY, RoutingKeys
+from dcn.common.request_types import Agent_control, Commands
 from dcn.common.database import Database
+from dcn.common.metrics import metrics
+from dcn.dispatcher.registry import AgentRegistry
+from dcn.dispatcher.sharding import Shard, ShardManager
 
 logger = logging.getLogger(DISPATCHER)
 
+NEXT_FREE_ID = 'next_free_id'
+COMMAND_VERSION = 'command_version'
+COMMAND_EPOCH = 'command_epoch'
+# Agent method that requests agent queues again
+REBALANCE_COMMAND = 'rebalance'
+
+REQUESTS = metrics.counter('dcn_dispatcher_requests_total', 'Handled requests', ('command',))
+REQUEST_SECONDS = metrics.histogram('dcn_dispatcher_request_seconds', 'Duration of request handling', ('command',))
+AGENTS = metrics.gauge('dcn_dispatcher_agents', 'Registered agents')
+
 
 class Dispatcher:
+    connection_class = ReplyConnection
+    router_class = RouterConnection
+    broker_class = Broker
+    # Period of control consumer stop request check
+    CONTROL_POLL_PERIOD = 0.1 * SECOND
+
     def __init__(self,
                  ip: str = '*',
                  port: Union[int, str] = '',
-                 broker_host: str = ''):
+                 broker_host: str = '',
+                 codec: str = CODEC,
+                 workers: int = DISPATCHER_WORKERS,
+                 agent_expiry: Union[int, float] = AGENT_EXPIRY,
+                 database: Database = None,
+                 shards: List[Shard] = None,
+                 shard_strategy: str = SHARD_STRATEGY,
+                 max_priority: int = MAX_PRIORITY,
+                 fair_scheduling: bool = False,
+                 broker_class: Type[BrokerBase] = None):
         logger.info('Starting Dispatcher')
-        self.socket = ReplyConnection(ip, port)
-        self.broker = Broker(broker_host if broker_host else ip)
-        self.agents = {}
+        if broker_class is not None:
+            self.broker_class = broker_class
+        self.socket = self._create_socket(ip, port, workers)
+        self.broker = self.broker_class(host=broker_host if broker_host else ip,
+                                        inactivity_timeout=self.CONTROL_POLL_PERIOD)
+        self.agents = AgentRegistry()
+        self.agent_expiry = agent_expiry
+        self.codec = codec
         self.request_handler = self.default_request_handler
+        self.control_handler = self.default_control_handler
+        self._control_consumer: Optional[Thread] = None
+        self._stop_consuming = Event()
         self._next_free_id = INIT_AGENT_ID
+        self._command_version = 0
+        # Broadcast versions are compared by agents within the same epoch only
+        self._command_epoch = uuid4().hex
         self._listen = True
         self._interrupt: Union[None, Callable] = None
+        # Requests are handled concurrently by router workers
+        self._lock = Lock()
+        self.database = database if database is not None else Database()
+        # Broker host from token parameters and common task queue are used without shards
+        self.shards = ShardManager(shards, shard_strategy, self.broker_class) if shards else None
+        self.max_priority = max_priority
+        # Each client gets own task queue, agents consume them by client weights
+        self.fair_scheduling = fair_scheduling
+        self.client_queues: Dict[Tuple[str, str], Dict[str, int]] = {}  # (host, task queue): {queue: weight}
+        self._restore_agents()
+
+    def _create_socket(self, ip: str, port: Union[int, str], workers: int):
+        if workers > 1:
+            return self.router_class(ip, port, workers)
+        return self.connection_class(ip, port)
 
     def __enter__(self):
         self.socket.establish()
-        self.configure_broker()
+        # Requests are served while broker is down, control consumer reconnects with backoff
+        self.configure_broker(retries=1)
+        self._start_control_consumer()
         return self
 
     def __exit__(self, *exc_info):
         logger.info(f'Closing Dispatcher connection:{self.socket}')
         self.socket.close()
+        self._stop_control_consumer()
         self.broker.close()
+        self.database.close()
+        if self.shards:
+            self.shards.close()
+
+    def _restore_agents(self):
+        """
+        Registers agents saved by previous dispatcher run. They are expired
+        as usual if they do not pulse anymore.
+        """
+        for agent_id, name, token in self.database.load_agents():
+            agent = RemoteAgent(agent_id)
+            agent.name = name
+            agent.token = token
+            self.agents.add(agent)
+        next_free_id = self.database.get_state(NEXT_FREE_ID)
+        if next_free_id is not None:
+            self._next_free_id = max(self._next_free_id, int(next_free_id))
+        command_version = self.database.get_state(COMMAND_VERSION)
+        command_epoch = self.database.get_state(COMMAND_EPOCH)
+        if command_version is not None and command_epoch is not None:
+            self._command_version = int(command_version)
+            self._command_epoch = command_epoch
+        else:
+            # Versions start over, so agents are told to forget versions of previous run
+            self.database.set_state(COMMAND_EPOCH, self._command_epoch)
+        if self.agents:
+            logger.info(f'{len(self.agents)} agents are restored, next agent id={self._next_free_id}')
+
+    def expire_agents(self):
+        for agent in self.agents.expire(self.agent_expiry):
+            self.database.delete_agent(agent.id)
+            if self.shards:
+                self.shards.release_agent(agent.id)
 
-    def configure_broker(self):
+    def rebalance_agents(self):
+        """
+        Moves agents between shards according to measured queue depth.
+        Moved agents are requested to get their queues again on next pulse.
+        """
+        self.shards.measure()
+        self.agents.add_commands([REBALANCE_COMMAND], [agent_id for agent_id, _ in self.shards.rebalance()])
+
+    def configure_broker(self, retries: int = CONNECTION_RETRY_COUNT):
         self.broker.queue = RoutingKeys.DISPATCHER
         self.broker.routing_key = RoutingKeys.DISPATCHER
-        for i in range(12):
-            if self.broker.connect():
-                return
+        self.broker.output_exchanges[CONTROL_EXCHANGE_NAME] = CONTROL_EXCHANGE_TYPE
+        if self.broker.ensure_connection(retries):
+            self.broker.declare()
 
     def listen(self, polling_timeout: int = 60 * SECOND):
         ts = monotonic()
@@ -51,14 +155,121 @@ class Dispatcher:
             expired = self.socket.listen(self.request_handler, polling_timeout)
             if self._interrupt and self._interrupt(expired):
                 break
-            if monotonic() > ts + 60 * SECOND:
-                if not self.broker.is_connected:
-                    self.configure_broker()
-                else:
-                    for task in self.broker.consume():
-                        logger.warning(f'Got dispatcher task {task}')
+            self.expire_agents()
+            if self.shards and monotonic() > ts + 60 * SECOND:
+                self.rebalance_agents()
                 ts = monotonic()
 
+    def _start_control_consumer(self):
+        self._stop_consuming.clear()
+        self._control_consumer = Thread(target=self._consume_control, name='dispatcher-control', daemon=True)
+        self._control_consumer.start()
+
+    def _stop_control_consumer(self):
+        if self._control_consumer is None:
+            return
+        self._stop_consuming.set()
+        self._control_consumer.join()
+        self._control_consumer = None
+
+    def _consume_control(self):
+        # Called from control consumer thread, it is the only user of dispatcher broker
+        broker = self.broker
+        while not self._stop_consuming.is_set():
+            if not broker.connected and not broker.connect():
+                self._stop_consuming.wait(broker.backoff.remaining)
+                continue
+            # Generator is exhausted on inactivity timeout, so stop request is checked periodically
+            for message in broker.pulling_generator():
+                try:
+                    self.control_handler(message)
+                except Exception:
+                    logger.exception(f'Control message handling has failed: {message}')
+                broker.set_task_done(message)
+                if self._stop_consuming.is_set():
+                    break
+
+    def default_control_handler(self, message: dict):
+        """
+        Handles control message received from dispatcher queue on broker.
+
+        :param message: control message
+        """
+        commands = {
+            Commands.Agent_commands: self._agent_commands_handler,
+        }
+        command = commands.get(message.get('command'))
+        if command is None:
+            logger.warning(f'Unknown control message is dropped: {message}')
+            return
+        if not metrics.enabled:
+            command(message)
+            return
+        started = monotonic()
+        command(message)
+        REQUEST_SECONDS.observe(monotonic() - started, message['command'])
+        REQUESTS.inc(message['command'])
+
+    def _agent_commands_handler(self, message: dict):
+        self._publish_control(self._compose_control(message['commands'], message.get('agents'),
+                                                    message.get('token'), message.get('tags')))
+
+    def broadcast(self,
+                  commands: List[str],
+                  agents: Iterable[int] = (),
+                  token: str = '',
+                  tags: Iterable[str] = ()) -> int:
+        """
+        Sends commands to agents over control exchange. Commands are
+        delivered with pulse replies if broker is not reachable.
+        Could be called from any thread.
+
+        :param commands: names of agent methods
+        :param agents: ids of target agents
+        :param token: token of target agents
+        :param tags: tags that target agents should have
+        :return: broadcast version
+        """
+        message = self._compose_control(commands, agents, token, tags)
+        try:
+            # Dispatcher broker is used by control consumer thread only
+            self.broker.call_threadsafe(partial(self._publish_control, message))
+        except Exception:
+            logger.exception('Broadcast is not scheduled, commands are delivered with pulses')
+            self._queue_commands(message)
+        return message['version']
+
+    def _compose_control(self,
+                         commands: List[str],
+                         agents: Iterable[int] = (),
+                         token: str = '',
+                         tags: Iterable[str] = ()) -> dict:
+        message = deepcopy(Agent_control)
+        message['commands'] = list(commands)
+        message['agents'] = list(agents or ())
+        message['token'] = token or ''
+        message['tags'] = list(tags or ())
+        with self._lock:
+            self._command_version += 1
+            message['epoch'] = self._command_epoch
+            message['version'] = self._command_version
+            self.database.set_state(COMMAND_VERSION, str(self._command_version))
+        return message
+
+    def _publish_control(self, message: dict):
+        # Called from control consumer thread
+        if self.broker.publish(message, RoutingKeys.CONTROL, CONTROL_EXCHANGE_NAME):
+            logger.info('Commands %s are broadcast with version %d', message['commands'], message['version'])
+        else:
+            self._queue_commands(message)
+
+    def _queue_commands(self, message: dict):
+        """
+        Queues commands for target agents, they are delivered with pulse replies.
+        """
+        count = self.agents.add_commands(message['commands'], select=lambda agent: agent.is_target(message))
+        logger.info('Commands %s are queued for %d agents', message['commands'], count)
+
     def default_request_handler(self, request: dict):
         commands = {
             Commands.Register_agent: self._register_agent_handler,
@@ -71,58 +282,122 @@ class Dispatcher:
         assert request['command'] in commands, 'Command ' \
             f'{request["command"]} is not registered in dispatcher request handler'
         command = commands[request['command']]
-        return command(request)
+        if not metrics.enabled:
+            return command(request)
+        started = monotonic()
+        reply = command(request)
+        REQUEST_SECONDS.observe(monotonic() - started, request['command'])
+        REQUESTS.inc(request['command'])
+        AGENTS.set(len(self.agents))
+        return reply
 
     def _register_agent_handler(self, request: dict):
-        logger.info(f'Registration request received {request["name"]}({self._next_free_id})')
-        request['id'] = self._next_free_id
-        agent = RemoteAgent(self._next_free_id)
-        agent.name = request['name']
-        agent.token = request['token']
-        self.agents[self._next_free_id] = agent
-        logger.info(f'New agent id={agent.id}')
-        request['result'] = True
-        self._next_free_id += 1
+        with self._lock:
+            logger.info('Registration request received %s(%d)', request['name'], self._next_free_id)
+            request['id'] = self._next_free_id
+            agent = RemoteAgent(self._next_free_id)
+            agent.name = request['name']
+            agent.token = request['token']
+            agent.tags = request.get('tags', [])
+            self.agents.add(agent)
+            logger.info('New agent id=%d', agent.id)
+            request['result'] = True
+            self._next_free_id += 1
+            self.database.save_agent(agent.id, agent.name, agent.token)
+            self.database.set_state(NEXT_FREE_ID, str(self._next_free_id))
         return request
 
     def _agent_queues_handler(self, request: dict):
         """
         Returns Host and queues that agent should connect to.
         """
-        agent = self.agents[request['id']]
-        logger.info(f'Agent queues request received from {agent}')
+        agent = self.agents.get(request['id'])
+        if agent is None:
+            # Agent is expired or not registered, it should register again
+            logger.warning(f'Agent queues request from unknown agent {request["id"]}')
+            request['result'] = False
+            return request
+        logger.info('Agent queues request received from %s', agent)
         if self.broker.is_connected:
-            config = Database.get_agent_param(agent.token)
-            request['broker']['host'] = config['broker']
-            request['broker']['queue'] = RoutingKeys.TASK
+            if self.shards:
+                shard = self.shards.agent_shard(agent.id)
+                request['broker']['host'] = shard.host
+                request['broker']['queue'] = shard.queue
+            else:
+                config = self.database.get_agent_param(agent.token)
+                request['broker']['host'] = config['broker']
+                request['broker']['queue'] = RoutingKeys.TASK
+            request['broker']['codec'] = negotiate_codec(self.codec, request.get('codecs', []))
+            request['broker']['max_priority'] = self.max_priority
+            # Commands are broadcast on dispatcher broker
+            request['broker']['control'] = self.broker.host
+            if self.fair_scheduling:
+                key = (request['broker']['host'], request['broker']['queue'])
+                # Common task queue is served for clients that publish to it directly
+                request['broker']['queues'] = {key[1]: CLIENT_WEIGHT, **self.client_queues.get(key, {})}
             # request['broker']['exchange'] = EXCHANGE_NAME
             # request['broker']['result'] = compose_queue(RoutingKeys.RESULTS)
             request['result'] = True
         return request
 
     def _pulse_handler(self, request: dict):
-        logger.info(f'Pulse request received {request["id"]}')
-        agent = self.agents[request['id']]
-        reply = agent.sync(request)
+        logger.debug('Pulse request received %d', request['id'])
+        reply = self.agents.sync(request['id'], request)
+        if reply is None:
+            logger.warning(f'Pulse from unknown agent {request["id"]}')
+            request['result'] = False
+            return request
         return reply
 
     def _client_handler(self, request: dict):
-        logger.info(f'Client queues are requested by: {request["name"]}')
+        logger.info('Client queues are requested by: %s', request['name'])
         if self.broker.is_connected:
-            config = Database.get_client_param(request['token'])
-            request['broker']['host'] = config['broker']
-            request['broker']['task'] = RoutingKeys.TASK
+            if self.shards:
+                shard = self.shards.client_shard(request['name'])
+                request['broker']['host'] = shard.host
+                request['broker']['task'] = shard.queue
+            else:
+                config = self.database.get_client_param(request['token'])
+                request['broker']['host'] = config['broker']
+                request['broker']['task'] = RoutingKeys.TASK
             request['broker']['result'] = request['name']
+            request['broker']['codec'] = negotiate_codec(self.codec, request.get('codecs', []))
+            request['broker']['max_priority'] = self.max_priority
+            if self.fair_scheduling:
+                request['broker']['task'] = self._register_client_queue(request)
             request['result'] = True
         return request
 
+    def _register_client_queue(self, request: dict) -> str:
+        """
+        Adds client task queue to queues consumed by agents of client
+        task queue host. Agents are requested to get their queues again
+        once new client queue appears.
+
+        :return: client task queue
+        """
+        key = (request['broker']['host'], request['broker']['task'])
+        queue = f'{key[1]}.{request["name"]}'
+        config = self.database.get_client_param(request['token']) or {}
+        weight = config.get('weight', CLIENT_WEIGHT)
+        with self._lock:
+            queues = self.client_queues.setdefault(key, {})
+            if queues.get(queue) == weight:
+                return queue
+            queues[queue] = weight
+        logger.info(f'Client task queue {queue} is added with weight {weight}')
+        self.agents.add_commands([REBALANCE_COMMAND])
+        return queue
+
     def _disconnect_handler(self, request: dict):
         """
         Removes agent instance on dispatcher.
         """
-        logger.info(f'Disconnect request received {request["id"]}')
-        if request['id'] in self.agents:
-            self.agents.pop(request['id'])
+        logger.info('Disconnect request received %d', request['id'])
+        self.agents.pop(request['id'])
+        self.database.delete_agent(request['id'])
+        if self.shards:
+            self.shards.release_agent(request['id'])
         request['result'] = True
         return request
 
@@ -130,5 +405,5 @@ class Dispatcher:
         """
         Returns received request.
         """
-        logger.debug(f'Relay request called')
+        logger.debug('Relay request called')
         return request
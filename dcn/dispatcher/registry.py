@@ -0,0 +1,152 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from threading import RLock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from dcn.agent.agent import RemoteAgent
+from dcn.common.constants import DISPATCHER
+
+logger = logging.getLogger(DISPATCHER)
+
+# Outdated liveness entries that are tolerated per registered agent
+# before the index is rebuilt
+STALE_ENTRIES_RATIO = 2
+
+
+class AgentRegistry:
+    """
+    Registered agents indexed by id, name and token.
+    Liveness index is a heap ordered by agent last sync time, so agents
+    that have not pulsed for a while are found without registry scan.
+    Pulse does not update heap entry in place, new entry is pushed instead
+    and outdated ones are skipped during expiry.
+    """
+    def __init__(self):
+        self._agents: Dict[int, RemoteAgent] = {}
+        self._by_name: Dict[str, Dict[int, RemoteAgent]] = {}
+        self._by_token: Dict[str, Dict[int, RemoteAgent]] = {}
+        self._liveness: List[Tuple[datetime, int]] = []
+        # Registry is accessed by concurrent dispatcher request handlers
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def __contains__(self, agent_id: int) -> bool:
+        return agent_id in self._agents
+
+    def __getitem__(self, agent_id: int) -> RemoteAgent:
+        return self._agents[agent_id]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(list(self._agents))
+
+    def get(self, agent_id: int) -> Optional[RemoteAgent]:
+        return self._agents.get(agent_id)
+
+    def by_name(self, name: str) -> List[RemoteAgent]:
+        return list(self._by_name.get(name, {}).values())
+
+    def by_token(self, token: str) -> List[RemoteAgent]:
+        return list(self._by_token.get(token, {}).values())
+
+    def add(self, agent: RemoteAgent):
+        """
+        Registers agent. Agent with the same id is replaced.
+
+        :param agent: agent instance
+        """
+        with self._lock:
+            self.pop(agent.id)
+            self._agents[agent.id] = agent
+            self._by_name.setdefault(agent.name, {})[agent.id] = agent
+            self._by_token.setdefault(agent.token, {})[agent.id] = agent
+            self._push(agent)
+
+    def pop(self, agent_id: int) -> Optional[RemoteAgent]:
+        """
+        Removes agent from registry. Its liveness entries are dropped lazily.
+
+        :param agent_id: agent id
+        :return: removed agent if it was registered
+        """
+        with self._lock:
+            agent = self._agents.pop(agent_id, None)
+            if agent is None:
+                return None
+            for index, key in ((self._by_name, agent.name), (self._by_token, agent.token)):
+                agents = index[key]
+                del agents[agent_id]
+                if not agents:
+                    del index[key]
+            return agent
+
+    def sync(self, agent_id: int, request: dict) -> Optional[dict]:
+        """
+        Synchronizes agent on pulse request.
+
+        :param agent_id: agent id
+        :param request: pulse request
+        :return: pulse reply or None if agent is not registered
+        """
+        with self._lock:
+            agent = self._agents.get(agent_id)
+            if agent is None:
+                return None
+            reply = agent.sync(request)
+            self._push(agent)
+            return reply
+
+    def add_commands(self,
+                     commands: Iterable[str],
+                     agent_ids: Iterable[int] = None,
+                     select: Callable[[RemoteAgent], bool] = None) -> int:
+        """
+        Queues commands for agents, they are delivered with pulse replies.
+        Commands that are already queued for agent are not repeated.
+
+        :param commands: names of agent methods
+        :param agent_ids: ids of target agents, all agents if not specified
+        :param select: condition that target agents should match
+        :return: number of target agents
+        """
+        count = 0
+        with self._lock:
+            # Pulse replies take queued commands under the same lock
+            for agent_id in list(self._agents) if agent_ids is None else agent_ids:
+                agent = self._agents.get(agent_id)
+                if agent is None or (select is not None and not select(agent)):
+                    continue
+                count += 1
+                for command in commands:
+                    if command not in agent.commands:
+                        agent.commands.append(command)
+        return count
+
+    def expire(self, timeout: Union[int, float]) -> List[RemoteAgent]:
+        """
+        Removes agents that have not been synchronized during timeout.
+
+        :param timeout: agent liveness period in seconds
+        :return: removed agents
+        """
+        deadline = datetime.utcnow() - timedelta(seconds=timeout)
+        expired = []
+        with self._lock:
+            while self._liveness and self._liveness[0][0] < deadline:
+                last_sync, agent_id = heapq.heappop(self._liveness)
+                agent = self._agents.get(agent_id)
+                # Entry is outdated if agent is removed or synchronized later
+                if agent is not None and agent.last_sync == last_sync:
+                    logger.warning(f'{agent} is expired, last sync: {last_sync}')
+                    expired.append(self.pop(agent_id))
+        return expired
+
+    def _push(self, agent: RemoteAgent):
+        if len(self._liveness) < STALE_ENTRIES_RATIO * len(self._agents):
+            heapq.heappush(self._liveness, (agent.last_sync, agent.id))
+            return
+        # Rebuilt index contains current entry of the agent as well
+        self._liveness = [(registered.last_sync, agent_id) for agent_id, registered in self._agents.items()]
+        heapq.heapify(self._liveness)
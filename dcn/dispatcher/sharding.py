@@ -0,0 +1,217 @@
+import hashlib
+import logging
+from bisect import bisect
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from dcn.common.broker import Broker, connection_pool
+from dcn.common.constants import DISPATCHER
+from dcn.common.defaults import REBALANCE_MOVES, SHARD_STRATEGY, SHARD_VIRTUAL_NODES, RoutingKeys
+
+logger = logging.getLogger(DISPATCHER)
+
+HASH = 'hash'
+DEPTH = 'depth'
+STRATEGIES = (HASH, DEPTH)
+
+
+class Shard:
+    """
+    Task queue on a broker host. Clients publish tasks to the shard queue
+    and receive results on the same host, agents consume the shard queue.
+    """
+    __slots__ = ('host', 'queue', 'depth', 'agents')
+
+    def __init__(self, host: str, queue: str = RoutingKeys.TASK):
+        self.host = host
+        self.queue = queue
+        self.depth = 0
+        self.agents = 0
+
+    @property
+    def key(self) -> str:
+        return f'{self.host}/{self.queue}'
+
+    def load(self, agents: int = None) -> float:
+        """
+        Waiting tasks per consuming agent.
+
+        :param agents: agents count, current one if not specified
+        :return: shard load, infinite if tasks are not consumed at all
+        """
+        agents = self.agents if agents is None else agents
+        if not agents:
+            return float('inf') if self.depth else 0.0
+        return self.depth / agents
+
+    def __str__(self):
+        return f'Shard({self.key})'
+
+
+def parse_shards(description: str) -> List[Shard]:
+    """
+    Creates shards from comma separated list of "host" or "host/queue" items.
+
+    :param description: shards list, e.g. "rabbit1/task_0,rabbit2/task_1"
+    :return: shards
+    """
+    shards = []
+    for item in description.split(','):
+        host, _, queue = item.strip().partition('/')
+        if host:
+            shards.append(Shard(host, queue) if queue else Shard(host))
+    return shards
+
+
+class HashRing:
+    """
+    Consistent hashing ring. Every node is placed on the ring several
+    times, so keys are spread evenly and only keys of changed nodes move.
+    """
+    def __init__(self, nodes: List[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted((self._hash(f'{node}#{i}'), node) for node in nodes for i in range(virtual_nodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def get(self, key: str) -> str:
+        index = bisect(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[index]
+
+
+class ShardManager:
+    """
+    Assigns clients and agents to task queue shards. With hash strategy
+    assignment is defined by consistent hashing of client name or agent id.
+    With depth strategy new peers are assigned by measured queue depth
+    and agents are moved to shards with most waiting tasks per agent.
+    Assignments are kept until peer is released.
+    """
+    def __init__(self,
+                 shards: List[Shard],
+                 strategy: str = SHARD_STRATEGY,
+                 broker_class=Broker,
+                 virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown sharding strategy "{strategy}". Expected one of: {STRATEGIES}')
+        if not shards:
+            raise ValueError('At least one shard is required')
+        self.shards: Dict[str, Shard] = {shard.key: shard for shard in shards}
+        self.strategy = strategy
+        self.broker_class = broker_class
+        self.ring = HashRing(list(self.shards), virtual_nodes)
+        self.agents: Dict[int, Shard] = {}
+        self.clients: Dict[str, Shard] = {}
+        self._brokers: Dict[str, Broker] = {}  # host: broker used for queue depth measurement
+        # Assignment is requested by concurrent dispatcher request handlers
+        self._lock = Lock()
+
+    def client_shard(self, name: str) -> Shard:
+        """
+        Returns shard of client. Client results are delivered to the
+        shard host, so client keeps its shard once assigned.
+
+        :param name: client name
+        :return: assigned shard
+        """
+        with self._lock:
+            shard = self.clients.get(name)
+            if shard is None:
+                if self.strategy == HASH:
+                    shard = self.shards[self.ring.get(name)]
+                else:
+                    # Tasks are directed to shard that is served best
+                    shard = min(self.shards.values(),
+                                key=lambda item: (item.depth / (item.agents + 1), -item.agents))
+                self.clients[name] = shard
+            return shard
+
+    def agent_shard(self, agent_id: int) -> Shard:
+        """
+        Returns shard of agent, assigns one if agent has no shard yet.
+
+        :param agent_id: agent id
+        :return: assigned shard
+        """
+        with self._lock:
+            shard = self.agents.get(agent_id)
+            if shard is None:
+                if self.strategy == HASH:
+                    shard = self.shards[self.ring.get(str(agent_id))]
+                else:
+                    shard = max(self.shards.values(),
+                                key=lambda item: (item.depth / (item.agents + 1), -item.agents))
+                self._assign(agent_id, shard)
+            return shard
+
+    def release_agent(self, agent_id: int):
+        with self._lock:
+            shard = self.agents.pop(agent_id, None)
+            if shard is not None:
+                shard.agents -= 1
+
+    def release_client(self, name: str):
+        with self._lock:
+            self.clients.pop(name, None)
+
+    def _assign(self, agent_id: int, shard: Shard):
+        previous = self.agents.get(agent_id)
+        if previous is not None:
+            previous.agents -= 1
+        self.agents[agent_id] = shard
+        shard.agents += 1
+
+    def measure(self):
+        """
+        Updates depth of shard queues.
+        """
+        for shard in self.shards.values():
+            broker = self._brokers.get(shard.host)
+            if broker is None:
+                # Shard brokers are used from listening thread only, so they share connections
+                broker = self._brokers[shard.host] = self.broker_class(host=shard.host, pool=connection_pool)
+            if not broker.connected and not broker.connect():
+                continue
+            depth = broker.queue_depth(shard.queue)
+            if depth is not None:
+                shard.depth = depth
+        logger.debug('Shards depth: ' + ', '.join(f'{shard.key}={shard.depth}' for shard in self.shards.values()))
+
+    def rebalance(self, moves: int = REBALANCE_MOVES) -> List[Tuple[int, Shard]]:
+        """
+        Reassigns agents from least loaded shards to most loaded ones.
+        Agents should request their queues again to follow new assignment.
+
+        :param moves: maximal number of reassigned agents
+        :return: reassigned agent ids with their new shards
+        """
+        moved = []
+        if self.strategy != DEPTH:
+            return moved
+        with self._lock:
+            for _ in range(moves):
+                # Last agent of shard is kept, so no shard is left unserved
+                source = min((shard for shard in self.shards.values() if shard.agents > 1),
+                             key=lambda item: item.load(), default=None)
+                target = max(self.shards.values(), key=lambda item: item.load())
+                if source is None or source is target:
+                    break
+                # Move should not make source shard as loaded as target one is
+                if source.load(source.agents - 1) >= target.load():
+                    break
+                agent_id = next(agent_id for agent_id, shard in self.agents.items() if shard is source)
+                self._assign(agent_id, target)
+                moved.append((agent_id, target))
+        for agent_id, shard in moved:
+            logger.info(f'Agent {agent_id} is moved to {shard}')
+        return moved
+
+    def get(self, agent_id: int) -> Optional[Shard]:
+        return self.agents.get(agent_id)
+
+    def close(self):
+        for broker in self._brokers.values():
+            broker.close()
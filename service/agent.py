@@ -1,48 +1,42 @@
 import logging
+import os
+import signal
 import sys
 
 from pathlib import Path
-from time import sleep, monotonic
 
-from dcn.agent import Agent, TaskRunner
-from dcn.common.constants import AGENT, BROKER, SECOND
+from dcn.agent import Agent, AgentRuntime
+from dcn.common.blob_store import BlobStore
+from dcn.common.constants import AGENT, BROKER
+from dcn.common.defaults import AGENT_EXECUTOR, AGENT_WORKERS
 from dcn.common.logging_tools import get_datetime_stamp, setup_module_logger
-
-PULSE_PERIOD = 10 * SECOND
+from dcn.common.metrics import metrics
+from dcn.common.result_cache import ResultCache
 
 logger = logging.getLogger(__name__)
 
 
 def main():
     dispatcher_host, token = sys.argv[1:]
-    with Agent(dsp_host=dispatcher_host, token=token) as agent:
-        logger.info('Registering')
-        registered = False
+    workers = int(os.getenv('DCN_AGENT_WORKERS', AGENT_WORKERS))
+    executor = os.getenv('DCN_AGENT_EXECUTOR', AGENT_EXECUTOR)
+    blob_path = os.getenv('DCN_BLOB_STORE')
+    blob_store = BlobStore(blob_path) if blob_path else None
+    # Results of pure tasks are cached if cache size is set, path shares them between agents of host
+    cache_size = int(os.getenv('DCN_RESULT_CACHE_SIZE', 0))
+    result_cache = ResultCache(os.getenv('DCN_RESULT_CACHE'), cache_size) if cache_size else None
+    tags = [tag for tag in os.getenv('DCN_AGENT_TAGS', '').split(',') if tag]
+    metrics_port = os.getenv('DCN_METRICS_PORT')
+    if metrics_port:
+        metrics.serve(int(metrics_port))
+    with Agent(dsp_host=dispatcher_host, token=token, workers=workers, executor=executor,
+               blob_store=blob_store, tags=tags, result_cache=result_cache) as agent:
+        runtime = AgentRuntime(agent)
+        # Tasks in progress are completed before exit
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: runtime.stop())
         logger.info('Starting processing')
-        while True:
-            timestamp = monotonic()
-
-            if not registered:
-                registered = agent.register()
-            if registered and not agent.broker:
-                agent.request_broker_data()
-            if agent.broker and not agent.broker.connected:
-                if agent.broker.ensure_connection():
-                    agent.broker.declare()
-            if agent.broker and agent.broker.connected:
-                for task in agent.broker.pulling_generator():
-                    runner = TaskRunner(task)
-                    runner.run()
-                    agent.broker.push(runner.report, runner.report['client'])
-                    agent.broker.set_task_done(task)
-            delta = monotonic() - timestamp
-            logger.debug(f'Exit task loop after {delta:.3f} seconds')
-            if delta < PULSE_PERIOD:
-                delay = PULSE_PERIOD - delta
-                logger.debug(f'Sleep for {delay} seconds')
-                sleep(delay)
-            if registered:
-                agent.pulse()
+        runtime.run()
 
 
 if __name__ == '__main__':
@@ -54,5 +48,5 @@ if __name__ == '__main__':
         (BROKER, logging.INFO)
     ]
     for module_name, level in log_config:
-        setup_module_logger(module_name, level, log_folder)
+        setup_module_logger(module_name, level, log_folder, asynchronous=True)
     main()
@@ -1,18 +1,35 @@
 import logging
+import os
 import sys
 
 from pathlib import Path
 
 from dcn.dispatcher import Dispatcher
+from dcn.dispatcher.sharding import parse_shards
 from dcn.common.constants import BROKER, DISPATCHER
+from dcn.common.database import FAKE_DB, Database, SQLiteBackend
+from dcn.common.defaults import DISPATCHER_WORKERS, MAX_PRIORITY, SHARD_STRATEGY
 from dcn.common.logging_tools import get_datetime_stamp, setup_module_logger
+from dcn.common.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
 def main():
     broker_host = sys.argv[1]
-    with Dispatcher(broker_host=broker_host) as dispatcher:
+    workers = int(os.getenv('DCN_DISPATCHER_WORKERS', DISPATCHER_WORKERS))
+    database_path = os.getenv('DCN_DATABASE')
+    database = Database(SQLiteBackend(database_path, FAKE_DB)) if database_path else None
+    shards = parse_shards(os.getenv('DCN_SHARDS', ''))
+    shard_strategy = os.getenv('DCN_SHARD_STRATEGY', SHARD_STRATEGY)
+    max_priority = int(os.getenv('DCN_MAX_PRIORITY', MAX_PRIORITY))
+    fair_scheduling = bool(os.getenv('DCN_FAIR_SCHEDULING'))
+    metrics_port = os.getenv('DCN_METRICS_PORT')
+    if metrics_port:
+        metrics.serve(int(metrics_port))
+    with Dispatcher(broker_host=broker_host, workers=workers, database=database,
+                    shards=shards, shard_strategy=shard_strategy,
+                    max_priority=max_priority, fair_scheduling=fair_scheduling) as dispatcher:
         logger.info('Start listening')
         dispatcher.listen()
 
@@ -22,5 +39,5 @@ if __name__ == '__main__':
     log_folder.parent.mkdir(parents=True, exist_ok=True)
     modules = [__name__, BROKER, DISPATCHER]
     for module_name in modules:
-        setup_module_logger(module_name, logging.DEBUG, log_folder)
+        setup_module_logger(module_name, logging.DEBUG, log_folder, asynchronous=True)
     main()
@@ -7,6 +7,9 @@ setup(
         'pika==1.3.1',
         'pyzmq==24.0.1'
     ],
+    extras_require={
+        'fast': ['orjson', 'msgpack']
+    },
     version='0.0.1',
     description='Distributed computations network',
     author='Vadym Kovalchuk',
@@ -5,7 +5,6 @@ from pathlib import Path
 from threading import Thread
 from time import sleep
 
-import docker
 import pytest
 
 from dcn.agent.agent import Agent
@@ -13,6 +12,7 @@ from dcn.client.client import Client
 from dcn.common.broker import Broker
 from dcn.common.constants import SECOND
 from dcn.common.defaults import RoutingKeys
+from dcn.common.memory_broker import MemoryBroker, reset_hosts
 from dcn.dispatcher.dispatcher import Dispatcher
 from tests.settings import AGENT_TEST_TOKEN, CLIENT_TEST_TOKEN,\
     DISPATCHER_PORT
@@ -114,6 +114,38 @@ def client_on_dispatcher(client: Client, dispatcher: Dispatcher):
     yield client
 
 
+@pytest.fixture
+def memory_dispatcher():
+    reset_hosts()
+    with Dispatcher(port=DISPATCHER_PORT, broker_class=MemoryBroker) as dispatcher:
+        listener = Thread(target=dispatcher.listen, args=[DISPATCHER_LISTEN_TIMEOUT])
+        listener.start()
+        yield dispatcher
+        dispatcher._listen = False
+        listener.join()
+    reset_hosts()
+
+
+@pytest.fixture()
+def memory_agent(memory_dispatcher: Dispatcher):
+    with Agent(token=AGENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT, broker_class=MemoryBroker) as agent:
+        assert agent.register(), 'Agent registration on dispatcher has failed'
+        assert agent.request_broker_data(), 'Failed to get agent queues'
+        assert agent.broker.connect(), 'Connection to broker is not reached on agent'
+        agent.broker._inactivity_timeout = 0.1 * SECOND
+        yield agent
+
+
+@pytest.fixture()
+def memory_client(memory_dispatcher: Dispatcher):
+    with Client(name='test_client', token=CLIENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT,
+                broker_class=MemoryBroker) as client:
+        assert client.get_client_queues(), 'Failed to get client queues'
+        assert client.broker.connect(), 'Connection to broker is not reached on client'
+        client.broker._inactivity_timeout = 0.1 * SECOND
+        yield client
+
+
 # PYTEST HOOKS
 def pytest_sessionstart(session):
     global log_file_formatter
@@ -1,12 +1,20 @@
+import asyncio
 from copy import deepcopy
-from time import sleep
+from threading import Thread
+from time import monotonic, sleep
 import logging
 
 from dcn.agent.agent import Agent, RemoteAgent
+from dcn.agent.async_agent import AsyncAgent
+from dcn.agent.runtime import AgentRuntime
+from dcn.client.client import Client
 from dcn.dispatcher.dispatcher import Dispatcher
+from dcn.common.async_broker import AsyncBroker
 from dcn.common.broker import Broker
 from dcn.common.data_structures import compose_queue, task_body
-from dcn.common.defaults import RoutingKeys
+from dcn.common.defaults import CONTROL_EXCHANGE_NAME, CONTROL_EXCHANGE_TYPE, RoutingKeys
+from dcn.common.memory_broker import MemoryBroker, reset_hosts
+from tests.settings import AGENT_TEST_TOKEN, DISPATCHER_PORT
 
 logger = logging.getLogger(__name__)
 
@@ -80,3 +88,113 @@ def test_agent_command_apply(dispatcher: Dispatcher, agent_on_dispatcher: Agent)
     agent.pulse()
     assert agent.apply_commands(), 'Agent command execution failure'
     assert agent.id == 0, 'Agent is not dropped'
+
+
+def test_agent_runtime(memory_dispatcher: Dispatcher, memory_client: Client):
+    with Agent(token=AGENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT, broker_class=MemoryBroker) as agent:
+        runtime = AgentRuntime(agent, pulse_period=0.05)
+        thread = Thread(target=runtime.run)
+        thread.start()
+        deadline = monotonic() + 5
+        while not (agent.broker and agent.broker.connected) and monotonic() < deadline:
+            sleep(0.01)
+        # Task submitted to idle agent is picked up without waiting for pulse period
+        sleep(0.2)
+        future = memory_client.submit('builtin', 'relay', {'test_arg': 1})
+        assert future.result(timeout=0.5) == {'test_arg': 1}, 'Task is not processed by idle agent'
+        broker = agent.broker
+        memory_dispatcher.agents[agent.id].commands = ['rebalance']
+        deadline = monotonic() + 5
+        while agent.broker is broker and monotonic() < deadline:
+            sleep(0.01)
+        assert agent.broker is not broker, 'Command received with pulse is not applied'
+        futures = memory_client.map('builtin', 'relay', [{'test_arg': i} for i in range(5)])
+        assert [future.result(timeout=5) for future in futures] == [{'test_arg': i} for i in range(5)], \
+            'Tasks are not processed after command is applied'
+        runtime.stop()
+        thread.join(timeout=5)
+        assert not thread.is_alive(), 'Agent runtime is not stopped'
+
+
+def test_agent_runtime_registration_lost(memory_dispatcher: Dispatcher, memory_client: Client):
+    with Agent(token=AGENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT, broker_class=MemoryBroker) as agent:
+        runtime = AgentRuntime(agent, pulse_period=0.05)
+        thread = Thread(target=runtime.run)
+        thread.start()
+        deadline = monotonic() + 5
+        while not (agent.broker and agent.broker.connected) and monotonic() < deadline:
+            sleep(0.01)
+        agent_id = agent.id
+        # Agent is expired by dispatcher
+        memory_dispatcher.agents.pop(agent_id)
+        deadline = monotonic() + 5
+        while agent.id in (0, agent_id) and monotonic() < deadline:
+            sleep(0.01)
+        assert agent.id in memory_dispatcher.agents, 'Agent is not registered again'
+        future = memory_client.submit('builtin', 'relay', {'test_arg': 1})
+        assert future.result(timeout=5) == {'test_arg': 1}, 'Task is not processed after registration'
+        runtime.stop()
+        thread.join(timeout=5)
+        assert not thread.is_alive(), 'Agent runtime is not stopped'
+
+
+def test_agent_broadcast_commands(memory_dispatcher: Dispatcher):
+    with Agent(token=AGENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT, broker_class=MemoryBroker,
+               tags=['gpu']) as agent:
+        # Long pulse period, so commands could arrive only by broadcast
+        runtime = AgentRuntime(agent, pulse_period=60)
+        thread = Thread(target=runtime.run)
+        thread.start()
+        deadline = monotonic() + 5
+        while not (agent.broker and agent.control_host) and monotonic() < deadline:
+            sleep(0.01)
+        sleep(0.2)
+        broker = agent.broker
+        memory_dispatcher.broadcast(['rebalance'], tags=['cpu'])
+        version = memory_dispatcher.broadcast(['rebalance'], token=AGENT_TEST_TOKEN, tags=['gpu'])
+        deadline = monotonic() + 5
+        while agent.broker is broker and monotonic() < deadline:
+            sleep(0.01)
+        assert agent.broker is not broker, 'Broadcast command is not applied'
+        assert agent.command_version == version, 'Broadcast version is not accepted'
+        runtime.stop()
+        thread.join(timeout=5)
+        assert not thread.is_alive(), 'Agent runtime is not stopped'
+    epoch = agent.command_epoch
+    assert agent.receive_control({'epoch': epoch, 'version': version, 'commands': ['rebalance']}) == [], \
+        'Redelivered broadcast is accepted'
+    assert agent.receive_control({'epoch': epoch, 'version': version + 1, 'commands': ['rebalance'],
+                                  'tags': ['cpu']}) == [], 'Broadcast for other tags is accepted'
+
+
+def test_agent_broadcast_dispatcher_restart():
+    reset_hosts()
+    agent = Agent(token=AGENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT, broker_class=MemoryBroker)
+    epochs = []
+    # Dispatcher without persistent database starts broadcast versions over
+    for _ in range(2):
+        with Dispatcher(port=DISPATCHER_PORT, broker_class=MemoryBroker) as dispatcher:
+            control = MemoryBroker(exchange=CONTROL_EXCHANGE_NAME, exchange_type=CONTROL_EXCHANGE_TYPE,
+                                   queue=f'{RoutingKeys.CONTROL}.test', host=dispatcher.broker.host,
+                                   exclusive=True, inactivity_timeout=5)
+            assert control.connect(), 'Control queue is not declared'
+            assert dispatcher.broadcast(['rebalance']) == 1, 'Broadcast version is not started over'
+            message = next(control.pulling_generator())
+            control.set_task_done(message)
+            control.close()
+        assert agent.receive_control(message) == ['rebalance'], 'Broadcast after dispatcher restart is dropped'
+        epochs.append(agent.command_epoch)
+    assert epochs[0] != epochs[1], 'Dispatcher epoch is not changed on restart'
+    reset_hosts()
+
+
+def test_async_agent_broker_data(memory_dispatcher: Dispatcher):
+    async def scenario():
+        async with AsyncAgent(token=AGENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT) as agent:
+            assert await agent.register(), 'Agent registration on dispatcher has failed'
+            assert await agent.request_broker_data(), 'Failed to get agent queues'
+            return agent.broker
+
+    broker = asyncio.run(scenario())
+    assert isinstance(broker, AsyncBroker), 'Asynchronous broker is not created'
+    assert broker.queue == RoutingKeys.TASK, 'Wrong agent task queue'
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+import logging
+
+from dcn.agent.agent import TaskRunner
+from dcn.client.client import ResultAssembler
+from dcn.common.blob_store import BLOB_REFERENCE, BlobStore, is_blob_reference
+from dcn.common.data_structures import task_body
+
+logger = logging.getLogger(__name__)
+
+LARGE_PAYLOAD = {'values': list(range(1000))}
+
+
+def test_blob_store_spill(tmp_path):
+    store = BlobStore(tmp_path, threshold=100)
+    message = {'result': LARGE_PAYLOAD}
+    store.spill(message)
+    assert is_blob_reference(message['result']), 'Large payload is not spilled'
+    digest = message['result'][BLOB_REFERENCE]
+    assert store.put(store.get(digest)) == digest, 'Blob is not content addressed'
+    store.resolve(message)
+    assert message['result'] == LARGE_PAYLOAD, 'Payload is modified by blob store'
+    small = {'result': 'small'}
+    assert store.spill(small) == {'result': 'small'}, 'Small payload is spilled'
+
+
+def test_blob_store_task_flow(tmp_path):
+    store = BlobStore(tmp_path, threshold=100)
+    test_task = deepcopy(task_body)
+    test_task['arguments'] = LARGE_PAYLOAD
+    store.spill(test_task, 'arguments')
+    runner = TaskRunner(test_task, store)
+    assert runner.run(), 'Error occur during task execution'
+    message, = runner.messages()
+    assert is_blob_reference(message['result']), 'Large result is not spilled'
+    report = ResultAssembler(store).feed(message)
+    assert report['result'] == LARGE_PAYLOAD, 'Wrong result is restored from blob store'
+
+
+def test_blob_store_concurrent_put(tmp_path):
+    store = BlobStore(tmp_path)
+    data = bytes(1024 * 1024)
+    with ThreadPoolExecutor(8) as executor:
+        digests = set(executor.map(lambda _: store.put(data), range(40)))
+    assert len(digests) == 1, 'Same payload is stored under different digests'
+    assert store.get(digests.pop()) == data, 'Blob is corrupted by concurrent writers'
+    assert not list(tmp_path.glob('*/*.tmp')), 'Temporary files are left behind'
@@ -1,9 +1,17 @@
+import asyncio
 import logging
 
 from random import random
-from dcn.common.broker import Broker
+
+import pika
+
+from dcn.common import backoff
+from dcn.common.async_broker import AsyncBroker
+from dcn.common.backoff import Backoff
+from dcn.common.broker import Broker, ConnectionPool
 from dcn.common.data_structures import compose_queue
 from dcn.common.defaults import RoutingKeys
+from dcn.common.scheduling import WeightedRoundRobin
 
 logger = logging.getLogger(__name__)
 
@@ -48,3 +56,189 @@ def test_broker_smoke():
     for task in test_tasks:
         validator_callback(validator.consume())
     validator.close()
+
+
+def test_broker_pulling_generator():
+    client = Broker()
+    client.output_routing_key = RoutingKeys.TASK
+    client.connect()
+    for i in test_tasks:
+        client.publish(test_tasks[i])
+    client.close()
+    agent = Broker(queue=RoutingKeys.TASK, prefetch_count=3, inactivity_timeout=0.1)
+    agent.connect()
+    logger.info('Streaming tasks')
+    received = [task['id'] for task in agent.pulling_generator()]
+    assert received == list(test_tasks), 'Streamed tasks differ from published ones'
+    assert agent.consume() == (True, {}), 'Task queue is not drained by generator'
+    agent.close()
+
+
+def test_broker_unacknowledged_redelivery():
+    client = Broker()
+    client.output_routing_key = RoutingKeys.TASK
+    client.connect()
+    for i in test_tasks:
+        client.publish(test_tasks[i])
+    client.close()
+    agent = Broker(queue=RoutingKeys.TASK, prefetch_count=4, inactivity_timeout=0.1)
+    agent.connect()
+    for task in agent.pulling_generator():
+        if task['id'] % 2:
+            assert agent.set_task_done(task), 'Task acknowledgement has failed'
+        elif task['id'] == 0:
+            assert agent.set_task_failed(task), 'Task rejection has failed'
+        # Remaining tasks are left in progress and lost on connection close
+    agent.close()
+    redelivered = Broker(queue=RoutingKeys.TASK, inactivity_timeout=0.1)
+    redelivered.connect()
+    received = []
+    for task in redelivered.pulling_generator():
+        received.append(task['id'])
+        redelivered.set_task_done(task)
+    redelivered.close()
+    assert sorted(received) == [i for i in test_tasks if not i % 2], \
+        'Only unacknowledged tasks are expected to be redelivered'
+
+
+def test_broker_publish_many():
+    client = Broker()
+    client.output_routing_key = RoutingKeys.TASK
+    client.connect()
+    statuses = client.publish_many(test_tasks[i] for i in test_tasks)
+    client.close()
+    assert statuses == [True] * len(test_tasks), 'Batch delivery is not confirmed'
+    agent = Broker(queue=RoutingKeys.TASK, inactivity_timeout=0.1)
+    agent.connect()
+    received = []
+    for task in agent.pulling_generator():
+        received.append(task)
+        agent.set_task_done(task)
+    agent.close()
+    assert received == list(test_tasks.values()), 'Batch content differs from published'
+
+
+def test_weighted_round_robin():
+    scheduler = WeightedRoundRobin({'bulk': 1, 'interactive': 3})
+    selected = [scheduler.next() for _ in range(8)]
+    assert selected.count('interactive') == 6, 'Keys are not selected by weights'
+    assert 'bulk' in selected[:4], 'Selection of light key is not interleaved'
+    assert scheduler.next(lambda key: key == 'bulk') == 'bulk', 'Ready key is not selected'
+    assert scheduler.next(lambda key: False) is None, 'Key is selected while none is ready'
+
+
+def test_broker_priority():
+    queue = 'priority_test'
+    client = Broker(max_priority=10)
+    client.output_routing_key = queue
+    client.output_queues = [queue]
+    client.connect()
+    for i in test_tasks:
+        client.publish(test_tasks[i], priority=i % 2 * 5)
+    client.close()
+    agent = Broker(queue=queue, max_priority=10, inactivity_timeout=0.1)
+    agent.connect()
+    received = []
+    for task in agent.pulling_generator():
+        received.append(task['id'])
+        agent.set_task_done(task)
+    agent.close()
+    assert received == [i for i in test_tasks if i % 2] + [i for i in test_tasks if not i % 2], \
+        'Tasks with higher priority are not delivered first'
+
+
+def test_broker_fair_consumption():
+    queues = {'fair_bulk': 1, 'fair_interactive': 1}
+    client = Broker()
+    client.output_queues = list(queues)
+    client.connect()
+    for i in test_tasks:
+        client.publish(test_tasks[i], 'fair_bulk')
+    client.publish({'id': 'interactive'}, 'fair_interactive')
+    client.close()
+    agent = Broker(queue='fair_bulk', queue_weights=queues, prefetch_count=20, inactivity_timeout=0.1)
+    agent.connect()
+    received = []
+    for task in agent.pulling_generator():
+        received.append(task['id'])
+        agent.set_task_done(task)
+    agent.close()
+    assert len(received) == len(test_tasks) + 1, 'Not all tasks are received'
+    assert received.index('interactive') < 2, 'Task of other queue waits behind bulk tasks'
+
+
+def test_broker_shared_connection():
+    pool = ConnectionPool()
+    client = Broker(pool=pool)
+    client.output_routing_key = RoutingKeys.TASK
+    agent = Broker(queue=RoutingKeys.TASK, pool=pool)
+    assert client.connect() and agent.connect(), 'Brokers are not connected'
+    assert client._connection is agent._connection, 'Connection is not shared by brokers of the same thread'
+    assert client._channel is not agent._channel, 'Channel is shared by brokers'
+    connection = client._connection
+    client.close()
+    assert connection.is_open, 'Connection is closed while it is used by other broker'
+    assert agent.publish({'id': 'shared'}, RoutingKeys.TASK), 'Message is not published on shared connection'
+    _, message = agent.consume()
+    assert message == {'id': 'shared'}, 'Message is not received on shared connection'
+    agent.close()
+    assert connection.is_closed, 'Connection is not closed by its last broker'
+
+
+def test_broker_reconnection_backoff(monkeypatch):
+    # Maximal delay within limit is chosen instead of random one
+    monkeypatch.setattr(backoff, 'uniform', lambda low, high: high)
+    delays = Backoff(base=1, maximum=5)
+    assert [delays.failure() for _ in range(5)] == [1, 2, 4, 5, 5], 'Delay limit is not grown exponentially'
+    assert not delays.ready(), 'Attempt is allowed during backoff delay'
+    delays.success()
+    assert delays.ready() and delays.failures == 0, 'Backoff is not reset on success'
+    delays.failures = 2000
+    assert delays.failure() == 5, 'Delay limit is not capped after long outage'
+    delays.success()
+    broker = Broker(host='unreachable.invalid')
+    assert not broker.connect(), 'Connection to unreachable host is reported'
+    assert broker.backoff.failures == 1
+    assert not broker.publish({'id': 0}), 'Message is published without connection'
+    assert broker.backoff.failures == 1, 'Reconnection is attempted during backoff delay'
+    broker.backoff.success()
+    assert not broker.ensure_connection(retries=2)
+    assert broker.backoff.failures == 2, 'Failed connection attempts are not retried'
+
+
+def test_broker_publish_many_connection_loss(monkeypatch):
+    class LostChannel:
+        # Connection is lost on the third published message
+        def __init__(self):
+            self._impl = self
+            self.published = 0
+
+        def basic_publish(self, **kwargs):
+            if self.published == 2:
+                raise pika.exceptions.AMQPConnectionError('Connection is lost')
+            self.published += 1
+
+    broker = Broker(host='unreachable.invalid')
+    monkeypatch.setattr(broker, '_reconnect', lambda: True)
+    monkeypatch.setattr(broker, '_get_confirm_channel', LostChannel)
+    confirmed = broker.publish_many([{'id': i} for i in range(5)], RoutingKeys.TASK)
+    assert confirmed == [False] * 5, 'Status is not reported for every message of the batch'
+    assert not broker.connected and broker.backoff.failures == 1, 'Connection loss is not handled'
+
+
+def test_async_broker_reconnection_backoff(monkeypatch):
+    monkeypatch.setattr(backoff, 'uniform', lambda low, high: high / 10)
+
+    async def scenario():
+        broker = AsyncBroker(host='unreachable.invalid')
+        assert not await broker.connect(), 'Connection to unreachable host is reported'
+        assert broker.backoff.failures == 1
+        assert not await broker.publish({'id': 0}), 'Message is published without connection'
+        assert broker.backoff.failures == 1, 'Reconnection is attempted during backoff delay'
+        assert await broker.publish_many([{'id': 0}, {'id': 1}]) == [False, False], \
+            'Status is not reported for every message'
+        broker.backoff.success()
+        assert not await broker.ensure_connection(retries=2)
+        assert broker.backoff.failures == 2, 'Failed connection attempts are not retried'
+
+    asyncio.run(scenario())
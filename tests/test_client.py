@@ -1,9 +1,13 @@
+import asyncio
 from copy import deepcopy
 from time import sleep
 import logging
 
+from dcn.client.async_client import AsyncClient
+from dcn.common.async_broker import AsyncBroker
 from dcn.common.data_structures import compose_queue, task_body
 from dcn.common.defaults import RoutingKeys
+from tests.settings import CLIENT_TEST_TOKEN, DISPATCHER_PORT
 
 logger = logging.getLogger(__name__)
 
@@ -40,3 +44,14 @@ def test_client_queues(dispatcher, client, broker):
     _, result = client.broker.consume()
     assert result['arguments'] == 'client_task_result', \
         'Client result name mismatch'
+
+
+def test_async_client_queues(memory_dispatcher):
+    async def scenario():
+        async with AsyncClient(name='async_test_client', token=CLIENT_TEST_TOKEN, dsp_port=DISPATCHER_PORT) as client:
+            assert await client.get_client_queues(), 'Failed to get client queues'
+            return client.broker
+
+    broker = asyncio.run(scenario())
+    assert isinstance(broker, AsyncBroker), 'Asynchronous broker is not created'
+    assert broker.queue == 'async_test_client', 'Wrong client result queue'
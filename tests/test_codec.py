@@ -0,0 +1,55 @@
+import logging
+from threading import Thread
+
+import pytest
+
+from dcn.common.codec import CODECS, JSON, MSGPACK, ORJSON, available_codecs, \
+    codec_for_content_type, detect_codec, get_codec, negotiate_codec
+from dcn.common.connection import ReplyConnection, RequestConnection
+from dcn.common.data_structures import task_body
+
+logger = logging.getLogger(__name__)
+
+TEST_MESSAGE = dict(task_body, arguments={'values': [1, 2.5, None, True], 'name': 'test'})
+
+
+@pytest.mark.parametrize('name', list(CODECS))
+def test_codec_round_trip(name):
+    if name not in available_codecs():
+        pytest.skip(f'Backend for {name} is not installed')
+    codec = get_codec(name)
+    data = codec.encode(TEST_MESSAGE)
+    assert isinstance(data, bytes), 'Codec output is not bytes'
+    assert codec.decode(data) == TEST_MESSAGE, 'Message is modified by codec'
+    assert codec_for_content_type(codec.content_type).decode(data) == TEST_MESSAGE, \
+        'Message is not decoded according to its content type'
+    assert detect_codec(data).decode(data) == TEST_MESSAGE, \
+        'Message codec is not detected'
+
+
+def test_codec_json_is_compact():
+    assert b' ' not in get_codec(JSON).encode(TEST_MESSAGE), \
+        'JSON codec output contains whitespaces'
+
+
+def test_codec_negotiation():
+    assert negotiate_codec(ORJSON, [JSON]) == JSON, 'Unsupported codec is selected'
+    assert negotiate_codec(MSGPACK, []) == JSON, 'Legacy peer is not served with JSON'
+    if ORJSON in available_codecs():
+        assert negotiate_codec(ORJSON, [JSON, ORJSON]) == ORJSON, \
+            'Preferred codec is not selected'
+
+
+@pytest.mark.parametrize('name', list(CODECS))
+def test_codec_request_reply(name):
+    if name not in available_codecs():
+        pytest.skip(f'Backend for {name} is not installed')
+    with ReplyConnection() as reply_connection, \
+            RequestConnection(port=reply_connection.port, codec=name) as request_connection:
+        reply_connection.establish()
+        request_connection.establish()
+        listener = Thread(target=reply_connection.listen, args=[lambda request: request, 1])
+        listener.start()
+        reply = request_connection.send(TEST_MESSAGE, 1)
+        listener.join()
+        assert reply == TEST_MESSAGE, 'Message is modified between request and reply'
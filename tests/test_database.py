@@ -0,0 +1,45 @@
+import logging
+from copy import deepcopy
+
+from dcn.common.database import FAKE_DB, Database, SQLiteBackend
+from dcn.common.request_types import Commands, Register_agent
+from dcn.dispatcher.dispatcher import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+def test_database_sqlite_params(tmp_path):
+    backend = SQLiteBackend(tmp_path / 'dcn.db', FAKE_DB)
+    database = Database(backend)
+    assert database.get_agent_param('localhost') == FAKE_DB['agents']['localhost'], \
+        'Agent parameters are not stored'
+    assert database.get_client_param('unknown') is None, 'Unknown token is found'
+    backend.set_params('agents', 'localhost', {'broker': 'changed'})
+    assert database.get_agent_param('localhost') == FAKE_DB['agents']['localhost'], \
+        'Cached parameters are not used'
+    database.set_agent_param('localhost', {'broker': 'updated'})
+    assert database.get_agent_param('localhost') == {'broker': 'updated'}, \
+        'Cached parameters are not invalidated on update'
+    database.close()
+    database = Database(SQLiteBackend(tmp_path / 'dcn.db', FAKE_DB))
+    assert database.get_agent_param('localhost') == {'broker': 'updated'}, \
+        'Parameters are not persisted or overwritten by defaults'
+    database.close()
+
+
+def test_database_dispatcher_restart(tmp_path):
+    def register(dispatcher: Dispatcher, name: str) -> int:
+        request = deepcopy(Register_agent)
+        request['name'] = name
+        request['token'] = 'localhost'
+        return dispatcher.default_request_handler(request)['id']
+
+    with Dispatcher(workers=1, database=Database(SQLiteBackend(tmp_path / 'dcn.db'))) as dispatcher:
+        first_id = register(dispatcher, 'first')
+        second_id = register(dispatcher, 'second')
+        dispatcher.default_request_handler({'command': Commands.Disconnect, 'id': first_id})
+    dispatcher = Dispatcher(workers=1, database=Database(SQLiteBackend(tmp_path / 'dcn.db')))
+    assert list(dispatcher.agents) == [second_id], 'Registered agents are not restored'
+    assert dispatcher.agents[second_id].name == 'second', 'Agent name is not restored'
+    assert register(dispatcher, 'third') == second_id + 1, 'Agent id is reused after restart'
+    dispatcher.__exit__()
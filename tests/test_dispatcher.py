@@ -1,12 +1,21 @@
+import asyncio
 import logging
 from copy import deepcopy
 from datetime import datetime
+from threading import Thread
+from time import monotonic, sleep
 
-from dcn.common.connection import RequestConnection
+from dcn.agent.agent import RemoteAgent
+from dcn.common.connection import AsyncRequestConnection, RequestConnection, RouterConnection
 from dcn.common.data_structures import QUEUE
-from dcn.common.defaults import RoutingKeys
-from dcn.common.request_types import Register_agent, Pulse, Client_queues, Commands
+from dcn.common.defaults import CONTROL_EXCHANGE_NAME, CONTROL_EXCHANGE_TYPE, RoutingKeys
+from dcn.common.memory_broker import MemoryBroker
+from dcn.common.request_types import Agent_commands, Agent_queues, Register_agent, Pulse, Client_queues, Commands
+from dcn.dispatcher.async_dispatcher import AsyncDispatcher
+from dcn.dispatcher.registry import AgentRegistry
+from dcn.dispatcher.sharding import DEPTH, Shard, ShardManager, parse_shards
 
+from tests.conftest import DISPATCHER_LISTEN_TIMEOUT
 from tests.settings import CLIENT_TEST_TOKEN, DISPATCHER_PORT
 
 logger = logging.getLogger(__name__)
@@ -81,3 +90,166 @@ def test_dsp_client_queue(dispatcher):
             'Wrong result queue name is defined by dispatcher'
         assert reply['broker']['task'] == RoutingKeys.TASK, \
             f'Task queue is not "{RoutingKeys.TASK}"'
+
+
+def test_dsp_unknown_agent_queues(memory_dispatcher):
+    request = deepcopy(Agent_queues)
+    request['id'] = 100
+    reply = memory_dispatcher.default_request_handler(request)
+    assert not reply['result'], 'Queues are returned for unknown agent'
+
+
+def test_dsp_control_messages(memory_dispatcher):
+    dispatcher = memory_dispatcher
+    for agent_id, token in ((1, 'first'), (2, 'second')):
+        agent = RemoteAgent(agent_id)
+        agent.token = token
+        dispatcher.agents.add(agent)
+    subscriber = MemoryBroker(exchange=CONTROL_EXCHANGE_NAME, exchange_type=CONTROL_EXCHANGE_TYPE,
+                              queue='control.test', host=dispatcher.broker.host, exclusive=True,
+                              inactivity_timeout=1)
+    subscriber.connect()
+    publisher = MemoryBroker(host=dispatcher.broker.host)
+    publisher.connect()
+    message = deepcopy(Agent_commands)
+    message['commands'] = ['rebalance']
+    message['token'] = 'first'
+    assert publisher.publish(message, RoutingKeys.DISPATCHER)
+    broadcast = next(subscriber.pulling_generator())
+    assert broadcast['commands'] == ['rebalance'] and broadcast['token'] == 'first', \
+        'Control message is not broadcast on arrival'
+    assert dispatcher.broadcast(['rebalance'], tags=['gpu']) == broadcast['version'] + 1, \
+        'Broadcast version is not incremented'
+    subscriber.close()
+    # Commands are delivered with pulses if broadcast is not published
+    dispatcher._queue_commands(dispatcher._compose_control(['rebalance'], token='first'))
+    assert dispatcher.agents[1].commands == ['rebalance'], 'Command is not queued for target agent'
+    assert not dispatcher.agents[2].commands, 'Command is queued for agent of other token'
+
+
+def test_async_dsp_register():
+    async def scenario():
+        async with AsyncDispatcher(port=DISPATCHER_PORT) as dispatcher:
+            listener = asyncio.ensure_future(dispatcher.listen(DISPATCHER_LISTEN_TIMEOUT))
+            with AsyncRequestConnection(port=DISPATCHER_PORT) as request_connection:
+                request_connection.establish()
+                register_req = deepcopy(Register_agent)
+                register_req['name'] = 'this_is_async_test'
+                register_req['token'] = CLIENT_TEST_TOKEN
+                expected_id = dispatcher._next_free_id
+                reply = await request_connection.send(register_req, 1)
+            dispatcher._listen = False
+            await listener
+        assert reply['result'], 'Registration was not successful'
+        assert reply['id'] == expected_id, 'Wrong agent id is assigned'
+        assert expected_id in dispatcher.agents, 'Agent is missing in ' \
+                                                 'dispatcher agents list'
+
+    asyncio.run(scenario())
+
+
+def test_async_dsp_broadcast():
+    async def scenario():
+        async with AsyncDispatcher(port=DISPATCHER_PORT, broker_host='unreachable.invalid') as dispatcher:
+            assert dispatcher.broker.output_exchanges == {CONTROL_EXCHANGE_NAME: CONTROL_EXCHANGE_TYPE}, \
+                'Control exchange is not declared'
+            for agent_id, token in ((1, 'first'), (2, 'second')):
+                agent = RemoteAgent(agent_id)
+                agent.token = token
+                dispatcher.agents.add(agent)
+            version = dispatcher.broadcast(['rebalance'], token='first')
+            listener = asyncio.ensure_future(dispatcher.listen(DISPATCHER_LISTEN_TIMEOUT))
+            deadline = monotonic() + 5
+            while not dispatcher.agents[1].commands and monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            dispatcher._listen = False
+            await listener
+        return dispatcher, version
+
+    dispatcher, version = asyncio.run(scenario())
+    assert version == 1, 'Broadcast version is not incremented'
+    # Broker is not reachable, so commands are delivered with pulses
+    assert dispatcher.agents[1].commands == ['rebalance'], 'Command is not queued for target agent'
+    assert not dispatcher.agents[2].commands, 'Command is queued for agent of other token'
+    assert dispatcher.broker.backoff.failures >= 1, 'Broker reconnection is not delayed'
+
+
+def test_router_concurrent_requests():
+    def slow_handler(request: dict):
+        sleep(0.2)
+        return request
+
+    with RouterConnection(workers=4) as router:
+        router.establish()
+        replies = []
+
+        def request(index: int):
+            with RequestConnection(port=router.port) as request_connection:
+                request_connection.establish()
+                replies.append(request_connection.send({'command': Commands.Relay, 'test': index}, 2))
+
+        peers = [Thread(target=request, args=[i]) for i in range(4)]
+        for peer in peers:
+            peer.start()
+        started = monotonic()
+        while any(peer.is_alive() for peer in peers) and monotonic() - started < 2:
+            router.listen(slow_handler, DISPATCHER_LISTEN_TIMEOUT)
+        elapsed = monotonic() - started
+    assert sorted(reply['test'] for reply in replies) == list(range(4)), \
+        'Replies are not routed to their peers'
+    assert elapsed < 0.6, 'Requests are not handled concurrently'
+
+
+def test_agent_registry_expiry():
+    registry = AgentRegistry()
+    for agent_id in range(3):
+        agent = RemoteAgent(agent_id)
+        agent.name = f'agent_{agent_id}'
+        agent.token = CLIENT_TEST_TOKEN
+        registry.add(agent)
+    assert len(registry.by_token(CLIENT_TEST_TOKEN)) == 3, 'Agents are not indexed by token'
+    assert registry.by_name('agent_1') == [registry[1]], 'Agent is not indexed by name'
+    sleep(0.05)
+    for _ in range(10):
+        assert registry.sync(1, deepcopy(Pulse))['result'], 'Agent pulse has failed'
+    assert registry.sync(100, deepcopy(Pulse)) is None, 'Unknown agent is synchronized'
+    expired = registry.expire(0.04)
+    assert sorted(agent.id for agent in expired) == [0, 2], 'Wrong agents are expired'
+    assert list(registry) == [1], 'Expired agents are still registered'
+    assert not registry.by_name('agent_0'), 'Expired agent is still indexed by name'
+    assert not hasattr(registry[1], '__dict__'), 'Remote agent instance has attribute dictionary'
+    registry.add(RemoteAgent(2))
+    assert registry.add_commands(['rebalance'], [1, 2, 100]) == 2, 'Commands are queued for unknown agent'
+    assert registry.add_commands(['rebalance', 'shutdown'], select=lambda agent: agent.id == 2) == 1, \
+        'Commands are queued for not selected agent'
+    assert (registry[1].commands, registry[2].commands) == (['rebalance'], ['rebalance', 'shutdown']), \
+        'Queued commands are repeated'
+    reply = registry.sync(2, deepcopy(Pulse))
+    assert reply['reply']['commands'] == ['rebalance', 'shutdown'] and not registry[2].commands, \
+        'Queued commands are not delivered with pulse'
+
+
+def test_shard_assignment():
+    shards = parse_shards('host_a/task_0,host_a/task_1,host_b')
+    assert [shard.key for shard in shards] == ['host_a/task_0', 'host_a/task_1', f'host_b/{RoutingKeys.TASK}'], \
+        'Shards are not parsed'
+    manager = ShardManager(shards)
+    assigned = {manager.agent_shard(agent_id).key for agent_id in range(100)}
+    assert assigned == {shard.key for shard in shards}, 'Agents are not spread over all shards'
+    assert manager.client_shard('client').key == ShardManager(shards).client_shard('client').key, \
+        'Client assignment is not consistent'
+    assert not manager.rebalance(), 'Agents are moved with hash strategy'
+
+
+def test_shard_rebalance():
+    busy, idle = Shard('host_a'), Shard('host_b')
+    manager = ShardManager([busy, idle], strategy=DEPTH)
+    for agent_id in range(4):
+        assert manager.agent_shard(agent_id) is (idle if agent_id % 2 else busy), \
+            'Agents are not spread by load'
+    busy.depth = 100
+    moved = manager.rebalance(moves=10)
+    assert moved and all(shard is busy for _, shard in moved), 'Agents are not moved to loaded shard'
+    assert (busy.agents, idle.agents) == (3, 1), 'Idle shard is left without agents'
+    manager.release_agent(moved[0][0])
+    assert busy.agents == 2, 'Released agent is still counted'
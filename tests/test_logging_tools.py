@@ -0,0 +1,19 @@
+import logging
+
+from dcn.common.logging_tools import setup_module_logger, stop_logging
+
+logger = logging.getLogger(__name__)
+
+
+def test_asynchronous_module_logger(tmp_path):
+    log_file = tmp_path / 'log.txt'
+    setup_module_logger('dcn_test_async', logging.INFO, log_file, asynchronous=True)
+    module_logger = logging.getLogger('dcn_test_async')
+    module_logger.info('Lazy %s message', 'formatted')
+    module_logger.debug('Filtered %s message', 'debug')
+    stop_logging()
+    for handler in module_logger.handlers[:]:
+        module_logger.removeHandler(handler)
+    content = log_file.read_text()
+    assert 'Lazy formatted message' in content, 'Queued record is not written by listener'
+    assert 'Filtered' not in content, 'Record below logger level is written'
@@ -0,0 +1,122 @@
+import logging
+
+import pytest
+
+from dcn.agent.agent import Agent
+from dcn.agent.pool import TaskPool
+from dcn.client.client import Client
+from dcn.common.data_structures import compose_batch_report, compose_queue, compose_report
+from dcn.common.defaults import RoutingKeys
+from dcn.common.memory_broker import MemoryBroker, reset_hosts
+
+logger = logging.getLogger(__name__)
+
+test_tasks = [{'id': i, 'task': i * 10} for i in range(10)]
+
+
+@pytest.fixture
+def memory_brokers():
+    reset_hosts()
+    client = MemoryBroker(queue=RoutingKeys.RESULTS, inactivity_timeout=0.1)
+    client.output_routing_key = RoutingKeys.TASK
+    client.output_queues = [RoutingKeys.TASK]
+    agent = MemoryBroker(queue=RoutingKeys.TASK, prefetch_count=4, inactivity_timeout=0.1)
+    assert client.connect() and agent.connect(), 'Memory broker is not connected'
+    yield client, agent
+    reset_hosts()
+
+
+def test_memory_broker_routing(memory_brokers):
+    client, agent = memory_brokers
+    assert all(client.publish_many(test_tasks)), 'Tasks are not published'
+    assert client.publish({'id': 'lost'}, 'not_bound_routing_key'), 'Unroutable message is not accepted'
+    assert agent.queue_depth() == len(test_tasks), 'Tasks are not routed to task queue'
+    for task in test_tasks:
+        _, message = agent.consume()
+        assert message is task, 'Message is copied by memory broker'
+        agent.publish(message, RoutingKeys.RESULTS)
+    assert agent.consume() == (True, {}), 'Task queue is not drained'
+    assert [task['id'] for task in client.pulling_generator()] == [task['id'] for task in test_tasks], \
+        'Results are not delivered in publishing order'
+
+
+def test_memory_broker_redelivery(memory_brokers):
+    client, agent = memory_brokers
+    client.publish_many(test_tasks, correlation_ids=[str(task['id']) for task in test_tasks])
+    received = []
+    for task in agent.pulling_generator():
+        assert agent.correlation_id(task) == str(task['id']), 'Correlation id is lost'
+        received.append(task['id'])
+        # First task stays unacknowledged
+        if task['id'] % 2:
+            agent.set_task_done(task)
+        elif task['id']:
+            agent.set_task_failed(task, requeue=False)
+    assert len(received) == len(test_tasks), 'Tasks are not delivered through prefetch window'
+    assert not agent.set_task_done(test_tasks[1]), 'Unknown delivery is acknowledged'
+    assert not agent.set_task_failed(test_tasks[1]), 'Unknown delivery is rejected'
+    agent.close()
+    assert agent.queue_depth() is None, 'Closed broker reports queue depth'
+    assert client.queue_depth(RoutingKeys.TASK) == 1, 'Unacknowledged task is not requeued on close'
+
+
+def test_memory_broker_same_message(memory_brokers):
+    client, _ = memory_brokers
+    agent = MemoryBroker(queue=RoutingKeys.TASK, prefetch_count=2, inactivity_timeout=0.1)
+    assert agent.connect(), 'Memory broker is not connected'
+    message = {'id': 0}
+    for _ in range(4):
+        client.publish(message)
+    received, pending = 0, []
+    for delivery in agent.pulling_generator():
+        assert delivery == message, 'Wrong message is delivered'
+        received += 1
+        pending.append(delivery)
+        # Deliveries are acknowledged once prefetch window is full
+        if len(pending) == 2:
+            for delivery_ in pending:
+                assert agent.set_task_done(delivery_), 'Delivery of the same message is not acknowledged'
+            pending.clear()
+    assert received == 4, 'Prefetch window is exhausted by deliveries of the same message'
+    agent.close()
+
+
+def test_memory_broker_priority():
+    reset_hosts()
+    broker = MemoryBroker(queue=RoutingKeys.TASK, max_priority=5, inactivity_timeout=0.1)
+    broker.output_routing_key = RoutingKeys.TASK
+    broker.connect()
+    for priority in (0, 3, 1, 9):
+        broker.publish({'priority': priority}, priority=priority)
+    received = [task['priority'] for task in broker.pulling_generator() if broker.set_task_done(task)]
+    assert received == [9, 3, 1, 0], 'Tasks are not delivered by priority'
+
+
+def test_memory_chain(memory_agent: Agent, memory_client: Client):
+    agent = memory_agent
+    client = memory_client
+    futures = client.map('builtin', 'relay', [{'test_arg': i} for i in range(5)])
+    with TaskPool(agent.broker, workers=2) as pool:
+        for task in agent.broker.pulling_generator():
+            pool.submit(task)
+        assert pool.drain(1), 'Tasks are not completed by pool'
+    assert [future.result(timeout=5) for future in futures] == [{'test_arg': i} for i in range(5)], \
+        'Wrong results are received through memory broker'
+
+
+def test_memory_client_previous_run_results(memory_agent: Agent, memory_client: Client):
+    agent = memory_agent
+    client = memory_client
+    destination = compose_queue(client.broker.queue)
+    # Results left in durable result queue by previous client run with the same name
+    stale = compose_report(1, destination)
+    stale.update(result='stale', status=True)
+    assert agent.broker.push(stale, destination, 'previous.1'), 'Stale result is not published'
+    assert agent.broker.push(compose_batch_report({'id': 1, 'client': destination}, [stale]), destination,
+                             'previous'), 'Stale batch report is not published'
+    future = client.submit('builtin', 'relay', {'test_arg': 1})
+    with TaskPool(agent.broker) as pool:
+        for task in agent.broker.pulling_generator():
+            pool.submit(task)
+        assert pool.drain(1), 'Task is not completed by pool'
+    assert future.result(timeout=5) == {'test_arg': 1}, 'Result of previous client run is matched'
@@ -0,0 +1,47 @@
+import logging
+from urllib.request import urlopen
+
+import pytest
+
+from dcn.agent.agent import TaskRunner
+from dcn.common.data_structures import task_body
+from dcn.common.metrics import MetricsRegistry, metrics
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.enabled = True
+    yield metrics
+    metrics.enabled = False
+
+
+def test_metrics_render():
+    registry = MetricsRegistry(enabled=True)
+    counter = registry.counter('test_total', 'Test counter', ('kind',))
+    histogram = registry.histogram('test_seconds', 'Test histogram', buckets=(0.1, 1))
+    counter.inc('a')
+    counter.inc('a', value=2)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    text = registry.render()
+    assert 'test_total{kind="a"} 3' in text, 'Counter value is not rendered'
+    assert 'test_seconds_bucket{le="0.1"} 1' in text, 'Histogram buckets are not cumulative'
+    assert 'test_seconds_bucket{le="1"} 2' in text, 'Histogram buckets are not cumulative'
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text, 'Values above buckets are not counted'
+    assert registry.snapshot()['test_seconds'][()]['sum'] == 5.55, 'Histogram sum is wrong'
+
+
+def test_metrics_task_stages(enabled_metrics):
+    stages = enabled_metrics.snapshot()['dcn_task_stage_seconds']
+    count = stages.get(('execution',), {}).get('count', 0)
+    assert TaskRunner(dict(task_body, arguments={'arg': 1})).run(), 'Error occur during task execution'
+    stages = enabled_metrics.snapshot()['dcn_task_stage_seconds']
+    assert stages[('execution',)]['count'] == count + 1, 'Execution stage is not measured'
+    server = enabled_metrics.serve(0, 'localhost')
+    try:
+        text = urlopen(f'http://localhost:{server.server_port}/metrics').read().decode()
+    finally:
+        server.shutdown()
+    assert 'dcn_task_stage_seconds_count{stage="execution"}' in text, 'Metrics are not served'
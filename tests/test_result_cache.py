@@ -0,0 +1,107 @@
+from copy import deepcopy
+import logging
+import pickle
+from time import sleep
+
+from dcn.agent.agent import TaskRunner
+from dcn.agent.modules import CACHEABLE_ATTRIBUTE, cacheable
+from dcn.agent.pool import execute_task
+from dcn.client.client import ResultAssembler
+from dcn.common.data_structures import compose_batch, compose_queue, compose_task, task_body
+from dcn.common.metrics import metrics
+from dcn.common.result_cache import ResultCache, task_key
+
+logger = logging.getLogger(__name__)
+
+
+def test_result_cache_task_key():
+    key = task_key('builtin', 'relay', {'a': 1, 'b': [1, 2]})
+    assert key == task_key('builtin', 'relay', {'b': [1, 2], 'a': 1}), 'Key depends on arguments order'
+    assert key != task_key('builtin', 'stream', {'a': 1, 'b': [1, 2]}), 'Key does not depend on function'
+    assert task_key('builtin', 'relay', {'a': object()}) is None, 'Key of not serializable arguments'
+
+
+def test_result_cache_eviction():
+    cache = ResultCache(maxsize=2, ttl=0.1)
+    for key in ('first', 'second', 'third'):
+        cache.set(key, key)
+    assert cache.get('first') == (False, None), 'Least recently used result is not evicted'
+    assert cache.get('third') == (True, 'third'), 'Recent result is not cached'
+    sleep(0.2)
+    assert not cache.get('third')[0], 'Expired result is returned'
+
+
+def test_result_cache_shared(tmp_path):
+    cache = ResultCache(tmp_path)
+    cache.set('key', {'result': [1, 2]})
+    assert ResultCache(tmp_path).get('key') == (True, {'result': [1, 2]}), \
+        'Result is not shared through cache path'
+    worker_cache = pickle.loads(pickle.dumps(cache))
+    assert not len(worker_cache._memory), 'Memory layer is passed to worker process'
+    assert worker_cache.get('key')[0], 'Stored result is not available in worker process'
+    cache.clear()
+    assert not ResultCache(tmp_path).get('key')[0], 'Stored result is not cleared'
+
+
+def test_result_cache_store_failure(tmp_path):
+    cache = ResultCache(tmp_path)
+    key = task_key(task_body['module'], task_body['function'], {'arg': 'unstored'})
+    # Result directory could not be created
+    (tmp_path / key[:2]).write_bytes(b'')
+    test_task = dict(task_body, arguments={'arg': 'unstored'}, cacheable=True)
+    runner = TaskRunner(test_task, result_cache=cache)
+    assert runner.run(), 'Task is failed by result store error'
+    assert cache.get(key) == (True, {'arg': 'unstored'}), 'Result is not kept in memory'
+    assert not ResultCache(tmp_path).get(key)[0], 'Result is stored'
+
+
+def test_result_cache_trim(tmp_path):
+    cache = ResultCache(tmp_path, maxsize=3)
+    for i in range(5):
+        cache.set(f'{i:02}', i)
+    cache.trim()
+    assert len(list(tmp_path.glob('*/*'))) == 3, 'Stored results are not trimmed to cache size'
+
+
+def test_result_cache_task_runner():
+    cache = ResultCache()
+    test_task = deepcopy(task_body)
+    test_task['arguments'] = {'arg': 'cached'}
+    runner = TaskRunner(test_task, result_cache=cache)
+    assert runner.run(), 'Error occur during task execution'
+    assert not len(cache._memory), 'Result of not cacheable task is cached'
+    test_task['cacheable'] = True
+    key = task_key(test_task['module'], test_task['function'], test_task['arguments'])
+    cache.set(key, 'cached result')
+    runner = TaskRunner(test_task, result_cache=cache)
+    assert runner.run(), 'Error occur during task execution'
+    assert runner.report['result'] == 'cached result', 'Cached result is not used'
+    test_task['arguments'] = {'arg': 'computed'}
+    assert TaskRunner(test_task, result_cache=cache).run(), 'Error occur during task execution'
+    key = task_key(test_task['module'], test_task['function'], test_task['arguments'])
+    assert cache.get(key) == (True, test_task['arguments']), 'Task result is not cached'
+    assert getattr(cacheable(lambda arguments: arguments), CACHEABLE_ATTRIBUTE), \
+        'Function is not declared pure'
+
+
+def test_result_cache_batch():
+    cache = ResultCache()
+    client = compose_queue('test_client')
+    tasks = [compose_task(i, client, 'builtin', 'relay_vectorized', {'arg': i}) for i in range(4)]
+    for task in tasks:
+        task['cacheable'] = True
+    cache.set(task_key('builtin', 'relay_vectorized', {'arg': 1}), 'cached result')
+    message, = execute_task(compose_batch(1, client, tasks), result_cache=cache)
+    results = [report['result'] for report in ResultAssembler().reports(message)]
+    assert results == [{'arg': 0}, 'cached result', {'arg': 2}, {'arg': 3}], \
+        'Cached result is not used in batch'
+    assert len(cache._memory) == 4, 'Results of vectorized batch are not cached'
+    tasks = [compose_task(i, client, 'builtin', 'relay', {'arg': i}) for i in range(2)]
+    for task in tasks:
+        task['cacheable'] = True
+    metrics.enabled = True
+    misses = metrics.snapshot()['dcn_task_result_cache_total'].get(('miss',), 0)
+    execute_task(compose_batch(2, client, tasks), result_cache=cache)
+    metrics.enabled = False
+    assert metrics.snapshot()['dcn_task_result_cache_total'][('miss',)] == misses + 2, \
+        'Cache misses of batched tasks are counted twice'
@@ -7,7 +7,8 @@ from time import sleep
 from typing import Union
 
 from dcn.agent.agent import Agent, TaskRunner
-from dcn.client.client import Client
+from dcn.agent.pool import TaskPool
+from dcn.client.client import Client, TaskError
 from dcn.common.data_structures import compose_queue, task_body
 from dcn.common.defaults import RoutingKeys
 from dcn.dispatcher.dispatcher import Dispatcher
@@ -72,3 +73,82 @@ def test_full_chain(agent_on_dispatcher: Agent, client_on_dispatcher: Client):
     _, result = client.broker.consume()
     assert test_task['arguments'] == result['result'], \
         'Wrong task is received from task queue for Agent'
+
+
+def test_task_pool(agent_on_dispatcher: Agent, client_on_dispatcher: Client):
+    agent = agent_on_dispatcher
+    client = client_on_dispatcher
+    agent.broker._inactivity_timeout = 0.1
+    tasks = []
+    for i in range(6):
+        task = deepcopy(task_body)
+        task['id'] = i
+        task['client'] = client.broker.queue
+        task['arguments'] = {'test_arg': i}
+        tasks.append(task)
+    assert all(client.broker.publish_many(tasks)), 'Tasks are not published'
+    with TaskPool(agent.broker, workers=3) as pool:
+        for task in agent.broker.pulling_generator():
+            pool.submit(task)
+        assert pool.drain(1), 'Tasks are not completed by pool'
+    sleep(0.1)
+    results = {}
+    for _ in tasks:
+        _, report = client.broker.consume()
+        results[report['id']] = report['result']
+    assert results == {task['id']: task['arguments'] for task in tasks}, \
+        'Wrong reports are received from task pool'
+
+
+def test_result_stream(agent_on_dispatcher: Agent, client_on_dispatcher: Client):
+    agent = agent_on_dispatcher
+    client = client_on_dispatcher
+    agent.broker._inactivity_timeout = 0.1
+    client.broker._inactivity_timeout = 0.1
+    test_task = deepcopy(task_body)
+    test_task['client'] = client.broker.queue
+    test_task['function'] = 'stream'
+    test_task['arguments'] = [{'part': i} for i in range(5)]
+    client.broker.publish(test_task)
+    with TaskPool(agent.broker, workers=2) as pool:
+        for task in agent.broker.pulling_generator():
+            pool.submit(task)
+        assert pool.drain(1), 'Task is not completed by pool'
+    reports = list(client.results())
+    assert len(reports) == 1, 'Streamed result is not assembled to a single report'
+    assert reports[0]['result'] == test_task['arguments'], 'Wrong streamed result'
+
+
+def test_client_futures(agent_on_dispatcher: Agent, client_on_dispatcher: Client):
+    agent = agent_on_dispatcher
+    client = client_on_dispatcher
+    agent.broker._inactivity_timeout = 0.1
+    single = client.submit('builtin', 'relay', {'test_arg': 'single'})
+    mapped = client.map('builtin', 'relay', [{'test_arg': i} for i in range(5)])
+    failed = client.submit('builtin', 'missing_function', {})
+    with TaskPool(agent.broker, workers=2) as pool:
+        for task in agent.broker.pulling_generator():
+            pool.submit(task)
+        assert pool.drain(1), 'Tasks are not completed by pool'
+    assert single.result(timeout=5) == {'test_arg': 'single'}, 'Wrong result of submitted task'
+    assert [future.result(timeout=5) for future in mapped] == [{'test_arg': i} for i in range(5)], \
+        'Results of mapped tasks are not matched with their arguments'
+    assert isinstance(failed.exception(timeout=5), TaskError), 'Task failure is not raised'
+
+
+def test_client_batching(agent_on_dispatcher: Agent, client_on_dispatcher: Client):
+    agent = agent_on_dispatcher
+    client = client_on_dispatcher
+    agent.broker._inactivity_timeout = 0.1
+    client.batch_size = 4
+    mapped = client.map('builtin', 'relay', [{'test_arg': i} for i in range(10)])
+    single = client.submit('builtin', 'relay', {'test_arg': 'single'})
+    sleep(0.1)
+    assert agent.broker.queue_depth() == 4, 'Tasks are not packed into batches'
+    with TaskPool(agent.broker, workers=2) as pool:
+        for task in agent.broker.pulling_generator():
+            pool.submit(task)
+        assert pool.drain(1), 'Batches are not completed by pool'
+    assert [future.result(timeout=5) for future in mapped] == [{'test_arg': i} for i in range(10)], \
+        'Results of batched tasks are not matched with their arguments'
+    assert single.result(timeout=5) == {'test_arg': 'single'}, 'Lingered batch is not published'
@@ -3,7 +3,10 @@ import json
 import logging
 
 from dcn.agent.agent import TaskRunner
-from dcn.common.data_structures import task_body
+from dcn.agent.loader import loader
+from dcn.agent.pool import execute_task
+from dcn.client.client import ResultAssembler
+from dcn.common.data_structures import compose_batch, compose_queue, compose_task, task_body
 
 logger = logging.getLogger(__name__)
 
@@ -16,3 +19,87 @@ def test_task_runner_flow():
     report = runner.report
     assert test_task['arguments'] == report['result'], \
         'Wrong task is received from task queue for Agent'
+
+
+def test_task_runner_function_cache():
+    loader.invalidate()
+    test_task = deepcopy(task_body)
+    test_task['arguments'] = {'arg': 'agent_task_test'}
+    runner = TaskRunner(test_task)
+    assert runner.run(), 'Error occur during task execution'
+    assert loader.get_function(test_task['module'], test_task['function']) is runner._function, \
+        'Task function is not cached'
+
+
+def test_task_runner_missing_module():
+    loader.invalidate()
+    test_task = deepcopy(task_body)
+    test_task['module'] = 'not_existing_module'
+    for _ in range(2):
+        runner = TaskRunner(test_task)
+        assert not runner.run(), 'Task with missing module is executed'
+        assert not runner.report['status'], 'Task report status is not failed'
+    assert test_task['module'] in loader.missing_modules, 'Missing module is not cached'
+    loader.invalidate(test_task['module'])
+    assert test_task['module'] not in loader.missing_modules, 'Missing module is not invalidated'
+
+
+def test_task_runner_missing_function():
+    test_task = deepcopy(task_body)
+    test_task['function'] = 'not_existing_function'
+    runner = TaskRunner(test_task)
+    assert not runner.run(), 'Task with missing function is executed'
+    assert 'not_existing_function' in runner.report['resolution'], \
+        'Missing function is not reported'
+
+
+def test_task_runner_stream():
+    test_task = deepcopy(task_body)
+    test_task['function'] = 'stream'
+    test_task['arguments'] = [{'part': i} for i in range(5)]
+    runner = TaskRunner(test_task)
+    assert runner.run(), 'Error occur during task execution'
+    messages = list(runner.messages())
+    assert len(messages) == len(test_task['arguments']) + 1, 'Wrong number of chunks'
+    assert messages[-1]['last'] and messages[-1]['status'], 'Stream is not completed'
+    assembler = ResultAssembler()
+    reports = [assembler.feed(message) for message in reversed(messages)]
+    assert reports[:-1] == [None] * len(test_task['arguments']), \
+        'Report is assembled before all chunks are received'
+    assert reports[-1]['result'] == test_task['arguments'], 'Wrong streamed result'
+
+
+def test_task_runner_batch():
+    client = compose_queue('test_client')
+    tasks = [compose_task(i, client, 'builtin', 'relay', {'arg': i}) for i in range(5)]
+    tasks.append(compose_task(5, client, 'builtin', 'stream', [1, 2]))
+    tasks.append(compose_task(6, client, 'builtin', 'missing_function', {}))
+    messages = execute_task(compose_batch(1, client, tasks))
+    assert len(messages) == 1, 'Batch is not reported with a single message'
+    reports = ResultAssembler().reports(messages[0])
+    assert [report['id'] for report in reports] == [task['id'] for task in tasks], \
+        'Batch reports are not matched with tasks'
+    assert [report['result'] for report in reports[:5]] == [task['arguments'] for task in tasks[:5]], \
+        'Wrong results of batched tasks'
+    assert reports[5]['result'] == [1, 2], 'Streamed result is not collected in batch'
+    assert not reports[6]['status'], 'Failed task does not fail its batch report'
+
+
+def test_task_runner_vectorized():
+    client = compose_queue('test_client')
+    tasks = [compose_task(i, client, 'builtin', 'relay_vectorized', {'arg': i}) for i in range(5)]
+    tasks.insert(2, compose_task(5, client, 'builtin', 'relay', {'arg': 5}))
+    runner = TaskRunner(tasks[0])
+    assert runner.run(), 'Vectorized function is not executed for a single task'
+    assert runner.report['result'] == tasks[0]['arguments'], 'Wrong result of vectorized function'
+    assert runner.batch_function is not None, 'Batch variant of vectorized function is not resolved'
+    empty = compose_task(7, client, 'builtin', 'relay_vectorized', {})
+    runner = TaskRunner(empty)
+    assert runner.run(), 'Vectorized function is not executed for a task without arguments'
+    message, = execute_task(compose_batch(2, client, [empty, tasks[0]]))
+    assert ResultAssembler().reports(message)[0]['result'] == runner.report['result'] == {}, \
+        'Vectorized function gets different arguments in batch'
+    message, = execute_task(compose_batch(1, client, tasks))
+    reports = ResultAssembler().reports(message)
+    assert [report['result'] for report in reports] == [task['arguments'] for task in tasks], \
+        'Results of vectorized batch are not matched with tasks'